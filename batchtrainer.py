@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+
+# batchtrainer.py
+#
+# Trains many models on overlapping parts of one corpus, sharing
+# everything that can be shared between them.
+#
+# Experiments like genre_experiment.create_cross_models() train a
+# model for every genre against each of several contrast sets. Done
+# one at a time through get_simple_data() and tune_a_model(), every
+# model lists the folder again, reloads and re-dates the metadata,
+# re-reads volumes the previous model already read, counts document
+# frequencies for its vocabulary from scratch, and opens two pools of
+# workers of its own.
+#
+# Here a CorpusIndex loads the metadata once, makes every model's
+# selection, and then reads the union of all the selected volumes in
+# a single pass, into a sparse matrix of word counts. Each model's
+# vocabulary (top n words by document frequency in its selection) and
+# data matrix are computed from that matrix. Then the models are tuned
+# one after another on a single pool of workers, and write the same
+# .csv, .pkl and .coefs.csv files that tune_a_model() always writes.
+#
+# A spec is a dictionary describing one model:
+#
+#     {'name': 'gothic_randomA', 'tags4positive': {'gothic'},
+#      'tags4negative': {'randomA'}, 'forbid4positive': set(),
+#      'forbid4negative': set()}
+#
+# The forbid sets are optional and default to set(). A spec can also
+# limit its candidates to a date window, with 'floor' and 'ceiling',
+# or to a list of 'docids', and can have its own 'sizecap' and a
+# dilution 'ratio'. period_specs() makes a spec for each of a list of
+# windows, and ratio_specs() for each point of a grid of sizecaps and
+# ratios. Other arguments of get_simple_data() (numfeatures,
+# negative_strategy and so on) are given once, to train_specs(), for
+# all the specs.
+#
+# graph_specs() adds the models to a taskgraph.TaskGraph instead of
+# training them in turn, so several models (and anything that depends
+# on them) can run at once.
+#
+# train_multinomial() is an alternative to a batch of one-vs-contrast
+# models: a single model over a list of genres plus the contrast class.
+
+import csv, os, random, shutil
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+import metaselector
+import modelingprocess
+import versatiletrainer2
+import volumeio
+import workerpool
+
+class CorpusIndex:
+    '''
+    The metadata for a folder of volumes, plus a sparse matrix of the
+    word counts of every volume loaded so far (one row per volume, one
+    column per word type), from which models' vocabularies and data
+    matrices are cut.
+    '''
+
+    def __init__(self, sourcefolder, metadatapath, excludebelow = 0, excludeabove = 3000, datecols = ['firstpub'], indexcol = ['docid'], extension = '.tsv', genrecol = 'tags'):
+
+        if not sourcefolder.endswith('/'):
+            sourcefolder = sourcefolder + '/'
+
+        self.volumesinfolder = volumeio.list_volumes(sourcefolder, extension)
+        self.metadata = metaselector.load_metadata(metadatapath, list(self.volumesinfolder.keys()), excludebelow, excludeabove, indexcol = indexcol, datecols = datecols, genrecol = genrecol)
+
+        self.rows = dict()
+        # volume ID -> row of the count matrix
+        self.words = pd.Index([], dtype = object)
+        # column of the count matrix -> word
+
+        self.indptr = np.zeros(1, dtype = np.int64)
+        self.indices = np.zeros(0, dtype = np.int64)
+        self.counts = np.zeros(0, dtype = np.float64)
+        self.totals = np.zeros(0, dtype = np.float64)
+        # The count matrix in CSR form, kept as three arrays so that
+        # each row's words stay in the order they had in the file.
+
+        self.failed = dict()
+
+    def load(self, volids):
+        '''
+        Reads every volume in volids that hasn't been read yet, and adds
+        it to the count matrix. Volumes that can't be read are recorded
+        in self.failed.
+        '''
+
+        volspresent = [(x, self.volumesinfolder[x]) for x in dict.fromkeys(volids) if x not in self.rows and x not in self.failed]
+        if len(volspresent) == 0:
+            return
+
+        print('Reading ' + str(len(volspresent)) + ' volumes.')
+
+        wordarrays = []
+        countarrays = []
+        malformed = dict()
+        failed = dict()
+
+        for volid, words, counts, badlines, error in versatiletrainer2.ingest_volumes(volspresent):
+            if error is not None:
+                failed[volid] = error
+                continue
+            malformed[volid] = badlines
+            self.rows[volid] = len(self.totals) + len(wordarrays)
+            wordarrays.append(words)
+            countarrays.append(counts)
+
+        volumeio.report_malformed(malformed)
+        versatiletrainer2.report_failures(failed)
+        self.failed.update(failed)
+
+        if len(wordarrays) == 0:
+            return
+
+        lengths = np.array([len(x) for x in wordarrays], dtype = np.int64)
+        allwords = np.concatenate(wordarrays)
+
+        # Words get column numbers with a single hash pass over every
+        # word read; words we haven't seen before get new columns at
+        # the end.
+
+        codes, uniques = pd.factorize(allwords)
+        columns = self.words.get_indexer(uniques)
+        unseen = columns < 0
+        columns[unseen] = len(self.words) + np.arange(int(unseen.sum()))
+        self.words = self.words.append(pd.Index(uniques[unseen], dtype = object))
+
+        self.indices = np.concatenate([self.indices, columns[codes]])
+        self.counts = np.concatenate([self.counts] + countarrays)
+        self.indptr = np.concatenate([self.indptr, self.indptr[-1] + np.cumsum(lengths)])
+        self.totals = np.concatenate([self.totals, np.array([x.sum() for x in countarrays])])
+
+    def row_entries(self, volids):
+        '''
+        For a list of (loaded) volumes, returns three aligned arrays
+        covering all their words: the position of the volume in volids,
+        the column of the word, and its count. Each volume's words are
+        in file order.
+        '''
+
+        rows = np.array([self.rows[x] for x in volids], dtype = np.int64)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+
+        positions = np.cumsum(lengths)
+        offsets = np.repeat(starts - (positions - lengths), lengths)
+        entries = np.arange(int(lengths.sum())) + offsets
+
+        whichvolume = np.repeat(np.arange(len(volids)), lengths)
+
+        return whichvolume, self.indices[entries], self.counts[entries]
+
+    def vocabulary(self, volids, n, forbidden = set()):
+        '''
+        The top n words by document frequency in these volumes, as
+        create_vocablist() would rank them: ties go to the word that
+        turns up first, reading the volumes in order. Like
+        create_vocablist(), we count a word once for each line it's
+        on, so a word listed twice in a volume counts twice.
+        '''
+
+        whichvolume, columns, counts = self.row_entries(volids)
+
+        docfreqs = np.bincount(columns, minlength = len(self.words))
+
+        present, firstseen = np.unique(columns, return_index = True)
+        order = present[np.lexsort((firstseen, -docfreqs[present]))]
+
+        vocablist = []
+        for word in self.words[order]:
+            if word in forbidden or len(word) == 0:
+                continue
+            vocablist.append(word)
+            if len(vocablist) >= n:
+                break
+
+        return vocablist, [int(x) for x in docfreqs[self.words.get_indexer(vocablist)]]
+
+    def dataframe(self, volids, vocablist, freqs_already_normalized = True):
+        '''
+        The data matrix for these volumes and this vocabulary, with the
+        same values get_dataframe() would have produced.
+        '''
+
+        whichvolume, columns, counts = self.row_entries(volids)
+
+        lookup = np.full(len(self.words), -1, dtype = np.int64)
+        lookup[self.words.get_indexer(vocablist)] = np.arange(len(vocablist))
+        vocabcolumns = lookup[columns]
+        invocab = vocabcolumns >= 0
+
+        features = np.zeros((len(volids), len(vocablist)))
+        features[whichvolume[invocab], vocabcolumns[invocab]] = counts[invocab]
+
+        if not freqs_already_normalized:
+            totals = self.totals[[self.rows[x] for x in volids]]
+            totals[totals == 0] = .00001
+            features = features / totals[ : , None]
+
+        return pd.DataFrame(features)
+
+    def select(self, spec, sizecap, negative_strategy = 'random', overlap_strategy = 'random', force_even_distribution = False, rng = random):
+        '''
+        Selects the volumes for a spec from the shared metadata, as
+        get_simple_data() does. Returns orderedIDs and classdictionary.
+
+        If the spec has a 'floor' and 'ceiling' (both inclusive), only
+        volumes dated in that window are candidates; if it has 'docids',
+        only those volumes are. Both are applied as masks to the shared
+        metadata, so windows don't need metadata of their own.
+
+        A spec's own 'sizecap' overrides the one passed in. A spec with
+        a 'ratio' is selected by metaselector.dilute_positive_class(),
+        which dilutes the positive class with that fraction of negatives.
+
+        Random choices are made with rng (see spec_seed()).
+        '''
+
+        print()
+        print('Selecting volumes for ' + spec['name'])
+
+        metadata = self.metadata
+
+        if 'docids' in spec:
+            metadata = metadata[metadata.index.isin(spec['docids'])]
+
+        if 'floor' in spec or 'ceiling' in spec:
+            datemask = (metadata.std_date >= spec.get('floor', 0)) & (metadata.std_date <= spec.get('ceiling', 3000))
+            metadata = metadata[datemask]
+
+        sizecap = spec.get('sizecap', sizecap)
+
+        if 'ratio' in spec:
+            return metaselector.dilute_positive_class(metadata, sizecap, spec['tags4positive'], spec['tags4negative'], spec['ratio'], rng = rng)
+
+        return metaselector.select_instances(metadata, sizecap, spec['tags4positive'], spec['tags4negative'], spec.get('forbid4positive', set()), spec.get('forbid4negative', set()), negative_strategy = negative_strategy, overlap_strategy = overlap_strategy, force_even_distribution = force_even_distribution, rng = rng)
+
+    def simple_data(self, orderedIDs, classdictionary, numfeatures, forbiddenwords = set(), vocabpath = None):
+        '''
+        Returns everything get_simple_data() returns, for a selection
+        whose volumes have been loaded. If vocabpath names an existing
+        lexicon it is used; otherwise the vocabulary is ranked from the
+        count matrix (and written to vocabpath, if there is one).
+        '''
+
+        holdout_authors = True
+        freqs_already_normalized = True
+
+        orderedIDs = [x for x in orderedIDs if x not in self.failed]
+        classdictionary = {x: classdictionary[x] for x in orderedIDs}
+        # Volumes that couldn't be read are dropped, as in get_simple_data().
+
+        metadata = self.metadata.loc[orderedIDs]
+
+        print()
+        print(str(len(orderedIDs)) + " volumes range in date from " + str(min(metadata.std_date)) + " to " + str(max(metadata.std_date)) + ".")
+        print()
+
+        if vocabpath is not None and os.path.isfile(vocabpath):
+            vocablist = versatiletrainer2.get_vocablist(vocabpath, [], numfeatures, forbiddenwords)
+        else:
+            vocablist, docfreqs = self.vocabulary(orderedIDs, numfeatures, forbiddenwords)
+            if vocabpath is not None:
+                with open(vocabpath, mode = 'w', encoding = 'utf-8') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(['word', 'docfreq'])
+                    for word, docfreq in zip(vocablist, docfreqs):
+                        writer.writerow([word, docfreq])
+
+        print("Number of features: " + str(len(vocablist)))
+
+        masterdata = self.dataframe(orderedIDs, vocablist, freqs_already_normalized)
+        classvector = np.array([classdictionary[x] for x in orderedIDs], dtype = np.int8)
+
+        authormatches = versatiletrainer2.match_authors(metadata, holdout_authors)
+
+        return metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist
+
+def period_specs(prefix, periods, tags4positive, tags4negative, forbid4positive = set(), forbid4negative = set(), replicates = 1):
+    '''
+    Specs for a model of the same classes in each of a list of
+    (floor, ceiling) date windows, replicates times over. They are
+    named prefix + floor + 'to' + ceiling + 'v' + replicate, and also
+    record 'floor', 'ceiling' and 'replicate'.
+    '''
+
+    specs = []
+
+    for floor, ceiling in periods:
+        for i in range(replicates):
+            name = prefix + str(floor) + 'to' + str(ceiling) + 'v' + str(i)
+            specs.append({'name': name, 'tags4positive': tags4positive, 'tags4negative': tags4negative, 'forbid4positive': forbid4positive, 'forbid4negative': forbid4negative, 'floor': floor, 'ceiling': ceiling, 'replicate': i})
+
+    return specs
+
+def ratio_specs(iterations, sizecaps, percentages, tags4positive, tags4negative):
+    '''
+    Specs for a sweep over a grid of iterations, sizecaps and dilution
+    ratios (given as whole percentages), as in methodological_experiment.
+    They are named 'iter' + iteration + '_size' + sizecap + '_ratio' + pct,
+    and also record 'iteration', 'sizecap' and 'ratio'.
+    '''
+
+    specs = []
+
+    for iteration in iterations:
+        for size in sizecaps:
+            for pct in percentages:
+                name = 'iter' + str(iteration) + '_size' + str(size) + '_ratio' + str(pct)
+                specs.append({'name': name, 'tags4positive': tags4positive, 'tags4negative': tags4negative, 'sizecap': size, 'ratio': pct / 100, 'iteration': iteration})
+
+    return specs
+
+def spec_seed(spec, seed):
+    '''
+    The seed for a spec's selection and folds: its own 'seed', if it
+    has one, or else seed combined with its name, so that replicates
+    of the same window get different volumes. None if neither is given.
+    '''
+
+    if 'seed' in spec:
+        return spec['seed']
+    elif seed is None:
+        return None
+    else:
+        return str(seed) + '/' + spec['name']
+
+def spec_rng(spec, seed):
+    specseed = spec_seed(spec, seed)
+    if specseed is None:
+        return random
+    else:
+        return random.Random(specseed)
+
+def train_specs(index, specs, modelparams, outputfolder, sizecap, numfeatures = 5000, negative_strategy = 'random', overlap_strategy = 'random', force_even_distribution = False, forbiddenwords = set(), processes = None, write_fullmodel = False, seed = None):
+    '''
+    Trains a model for each spec, writing outputfolder + name + '.csv'
+    (and the .pkl and .coefs.csv files that go with it). Specs whose
+    .csv already exists are skipped, so an interrupted batch can be
+    run again.
+
+    This is a generator: after each model it yields the spec and
+    whatever tune_a_model() returned, so the caller can record results
+    as they come in.
+
+    With a seed (or specs that have their own), selections and folds
+    are reproducible, which lets versatiletrainer2.resultcache find
+    models that have been trained before.
+
+    All the models share one pool, using processes cores (by default,
+    all of them), split between processes and threads to suit the
+    largest model (see workerpool.py).
+    '''
+
+    if not outputfolder.endswith('/'):
+        outputfolder = outputfolder + '/'
+
+    todo = [x for x in specs if not os.path.isfile(outputfolder + x['name'] + '.csv')]
+    print(str(len(specs)) + ' models requested; ' + str(len(specs) - len(todo)) + ' already exist.')
+
+    selections = []
+    for spec in todo:
+        orderedIDs, classdictionary = index.select(spec, sizecap, negative_strategy = negative_strategy, overlap_strategy = overlap_strategy, force_even_distribution = force_even_distribution, rng = spec_rng(spec, seed))
+        selections.append((orderedIDs, classdictionary))
+
+    # Every volume any model needs is read in one pass.
+
+    allvolumes = []
+    for orderedIDs, classdictionary in selections:
+        allvolumes.extend(orderedIDs)
+    index.load(allvolumes)
+
+    if volumeio.volumecache.budget > 0:
+        volumeio.volumecache.report()
+
+    maxrows = max([len(x[0]) for x in selections], default = 0)
+    pool = workerpool.open_pool(processes, rows = maxrows, features = numfeatures)
+
+    try:
+        for spec, (orderedIDs, classdictionary) in zip(todo, selections):
+            print()
+            print('Model: ' + spec['name'])
+
+            metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = index.simple_data(orderedIDs, classdictionary, numfeatures, forbiddenwords = forbiddenwords, vocabpath = spec.get('vocabpath'))
+
+            results = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, spec['tags4positive'], spec['tags4negative'], modelparams, spec['name'], outputfolder + spec['name'] + '.csv', write_fullmodel = write_fullmodel, pool = pool, seed = spec_seed(spec, seed))
+
+            yield spec, results
+    finally:
+        pool.close()
+        pool.join()
+
+def train_task(index, spec, orderedIDs, classdictionary, modelparams, outputpath, numfeatures, forbiddenwords, processes, write_fullmodel, seed):
+    '''
+    Trains one spec's model on volumes already loaded in index, with
+    a pool of its own using processes cores. This is what a task added
+    by graph_specs() runs.
+    '''
+
+    workerpool.limit_threads(processes)
+    # This process fits the full model itself, and shouldn't use more
+    # threads than its share of the task graph's cores.
+
+    metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = index.simple_data(orderedIDs, classdictionary, numfeatures, forbiddenwords = forbiddenwords, vocabpath = spec.get('vocabpath'))
+
+    pool = workerpool.open_pool(processes, rows = masterdata.shape[0], features = masterdata.shape[1])
+    try:
+        return versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, spec['tags4positive'], spec['tags4negative'], modelparams, spec['name'], outputpath, write_fullmodel = write_fullmodel, pool = pool, seed = seed)
+    finally:
+        pool.close()
+        pool.join()
+
+def graph_specs(graph, index, specs, modelparams, outputfolder, sizecap, numfeatures = 5000, negative_strategy = 'random', overlap_strategy = 'random', force_even_distribution = False, forbiddenwords = set(), processes = 4, write_fullmodel = False, seed = None, callback = None):
+    '''
+    Like train_specs(), but instead of training the models one after
+    another, adds a task for each to a taskgraph.TaskGraph, using
+    processes cores, so that several can be trained at once and tasks
+    that need them (comparisons) can start as soon as they're done.
+    Each task's memory is estimated from its number of volumes and
+    numfeatures, so the graph can keep within its memory budget.
+    Selection and reading volumes happen here, before the graph runs.
+
+    The task for a spec is named after it, and when it's done,
+    callback(spec, results) is called. Returns the names of the specs
+    whose .csv already exists: they get no task, so tasks that need
+    them shouldn't list them as requirements.
+    '''
+
+    if not outputfolder.endswith('/'):
+        outputfolder = outputfolder + '/'
+
+    existing = [x['name'] for x in specs if os.path.isfile(outputfolder + x['name'] + '.csv')]
+    todo = [x for x in specs if x['name'] not in existing]
+    print(str(len(specs)) + ' models requested; ' + str(len(existing)) + ' already exist.')
+
+    selections = []
+    for spec in todo:
+        orderedIDs, classdictionary = index.select(spec, sizecap, negative_strategy = negative_strategy, overlap_strategy = overlap_strategy, force_even_distribution = force_even_distribution, rng = spec_rng(spec, seed))
+        selections.append((orderedIDs, classdictionary))
+
+    allvolumes = []
+    for orderedIDs, classdictionary in selections:
+        allvolumes.extend(orderedIDs)
+    index.load(allvolumes)
+
+    for spec, (orderedIDs, classdictionary) in zip(todo, selections):
+        args = (index, spec, orderedIDs, classdictionary, modelparams, outputfolder + spec['name'] + '.csv', numfeatures, forbiddenwords, processes, write_fullmodel, spec_seed(spec, seed))
+
+        numprocesses, numthreads = workerpool.split(processes, rows = len(orderedIDs), features = numfeatures)
+        memory = workerpool.estimate_memory(len(orderedIDs), numfeatures, numprocesses, k = modelparams[1])
+
+        if callback is None:
+            specdone = None
+        else:
+            specdone = lambda name, results, spec = spec: callback(spec, results)
+
+        graph.add(spec['name'], train_task, args, cores = processes, memory = memory, callback = specdone)
+
+    return existing
+
+def train_multinomial(index, genres, tags4negative, modelparams, outputpath, sizecap, numfeatures = 5000, negative_strategy = 'random', overlap_strategy = 'random', forbiddenwords = set(), processes = None, seed = None):
+    '''
+    Instead of a binary model for each genre against the same contrast,
+    fits a single multinomial model of all the genres plus the contrast
+    class, using one feature matrix, one scaler and one set of folds
+    (holding out authors, as always). The grid search is the same, but
+    accuracy means choosing the right class out of all of them.
+
+    Writes outputpath (.csv) with a probability column for each class,
+    outputpath with .pkl, which apply_pickled_model() turns into a column
+    for each class, and outputpath with .coefs.csv, a row per word with
+    a coefficient for each class.
+
+    If a seed is given, the selection and folds are reproducible.
+    '''
+
+    if isinstance(genres, (set, frozenset)):
+        genres = sorted(genres)
+        # (a set's order would change from one process to the next)
+    else:
+        genres = list(genres)
+    labels = ['|'.join(sorted(tags4negative))] + genres
+    # the name of each class, in order of class number
+
+    if seed is None:
+        rng = random
+    else:
+        rng = random.Random(seed)
+
+    orderedIDs, classdictionary = metaselector.select_multiclass(index.metadata, sizecap, genres, tags4negative, negative_strategy = negative_strategy, overlap_strategy = overlap_strategy, rng = rng)
+    index.load(orderedIDs)
+
+    metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = index.simple_data(orderedIDs, classdictionary, numfeatures, forbiddenwords = forbiddenwords)
+
+    algorithm, k, featurestart, featureend, featurestep, crange = modelparams
+
+    if k < 1:
+        foldlabels = versatiletrainer2.leave_one_out_folds(len(orderedIDs), authormatches)
+    else:
+        foldlabels = versatiletrainer2.create_folds(k, classvector, authormatches, rng = rng)
+
+    pool = workerpool.open_pool(processes, rows = masterdata.shape[0], features = masterdata.shape[1])
+    datakey = versatiletrainer2.share_with_pool(masterdata, classvector, foldlabels)
+
+    try:
+        matrix, features4max, best_regularization_coef, maxaccuracy = versatiletrainer2.gridsearch(featurestart, featureend, featurestep, crange, masterdata, foldlabels, algorithm, classvector, pool = pool, datakey = datakey)
+        predictions = versatiletrainer2.crossvalidate(masterdata, classvector, foldlabels, algorithm, best_regularization_coef, numfeatures = features4max, pool = pool, datakey = datakey)
+    finally:
+        pool.close()
+        pool.join()
+        shutil.rmtree(datakey, ignore_errors = True)
+
+    if np.ndim(predictions) == 1:
+        predictions = np.column_stack([1 - predictions, predictions])
+
+    accuracy = versatiletrainer2.calculate_accuracy(predictions, classvector, True)
+    print(accuracy, maxaccuracy)
+
+    datasubset = masterdata.iloc[ : , 0 : features4max]
+    scaler = StandardScaler()
+    scaledtraining = scaler.fit_transform(datasubset)
+    fullmodel = modelingprocess.make_classifier(algorithm, best_regularization_coef, numrows = len(classvector))
+    fullmodel.fit(scaledtraining, classvector)
+
+    modelpath = outputpath.replace('.csv', '.pkl')
+    modelname = outputpath.split('/')[-1].replace('.csv', '')
+    versatiletrainer2.export_model(fullmodel, algorithm, scaler, vocablist[0 : features4max], genres, tags4negative, best_regularization_coef, len(orderedIDs), modelname, modelpath, labels = labels)
+
+    coefficients = modelingprocess.model_coefficients(fullmodel, allclasses = True) * 100
+    if coefficients.shape[0] == 1:
+        coefficients = np.vstack([-coefficients, coefficients])
+        # with only one genre, scikit-learn fits a binary model
+
+    coefficientpath = outputpath.replace('.csv', '.coefs.csv')
+    with open(coefficientpath, mode = 'w', encoding = 'utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['word'] + labels)
+        for column, word in enumerate(vocablist[0 : features4max]):
+            writer.writerow([word] + list(coefficients[ : , column]))
+
+    for column, label in enumerate(labels):
+        metadata = metadata.assign(**{'probability_' + label: predictions[ : , column]})
+    metadata = metadata.assign(realclass = [labels[x] for x in classvector])
+    metadata = metadata.drop('tagset', axis = 1)
+    metadata.to_csv(outputpath)
+
+    return matrix, maxaccuracy, metadata, features4max, best_regularization_coef
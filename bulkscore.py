@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# bulkscore.py
+#
+# Applies a model exported by versatiletrainer2.export_model() to
+# an arbitrarily large collection of volumes, without ever holding
+# more than a few chunks of them in memory.
+#
+# apply_pickled_model() builds one dataframe of every volume named
+# in the metadata, which is fine for a few thousand volumes but not
+# for hundreds of thousands. Here we divide the list of docids into
+# chunks, send chunks to a pool of worker processes, and append
+# (docid, probability) rows to the output file as each chunk comes
+# back. A small progress file records every chunk that has been
+# written, so an interrupted run can be restarted with the same
+# command and will pick up where it left off.
+#
+# USAGE syntax:
+#
+# python3 bulkscore.py model.pkl results.tsv --folder ../data/
+# python3 bulkscore.py model.pkl results.tsv --pairtree /htrc/ --ids htids.txt
+#
+# Volumes can come from a flat folder (docid + extension), or from
+# a HathiTrust pairtree, where each volume lives at
+# root/prefix/pairtree_root/.../postfix/postfix + extension.
+# Either way they may be compressed (.gz, .bz2, .zst).
+# Docids come from --ids (a plain list, or a csv with a docid column),
+# or, for a folder, from the files in the folder. A volume that can't
+# be read gets a row of NaN, and is listed at the end, rather than
+# stopping the run.
+#
+# A model of several classes (one with labels, trained by
+# batchtrainer.train_multinomial) gets a column of probabilities
+# for each class, headed by its label, instead of a single column.
+
+import argparse, csv, hashlib, os, pickle
+
+import numpy as np
+
+import SonicScrewdriver as utils
+import versatiletrainer2
+import volumeio
+import workerpool
+
+# Each worker process loads the model once, in init_worker(),
+# and keeps it here.
+
+workermodel = dict()
+
+def folder_path(docid, folder, extension):
+    return volumeio.find_volume(folder, docid, extension)
+
+def pairtree_path(docid, root, extension):
+    if not root.endswith('/'):
+        root = root + '/'
+    path, postfix = utils.pairtreepath(docid, root)
+    return volumeio.find_volume(path + postfix, postfix, extension)
+
+def get_docids(idpath, folder, extension):
+    '''
+    Reads docids from a file, or if no file is given, lists the
+    volumes in a folder. Sorted folder listings keep chunk
+    numbers stable when a run is resumed.
+    '''
+
+    docids = []
+
+    if idpath is not None:
+        with open(idpath, encoding = 'utf-8') as f:
+            firstline = f.readline().strip()
+            f.seek(0)
+            if firstline.startswith('docid'):
+                reader = csv.DictReader(f, delimiter = '\t' if '\t' in firstline else ',')
+                docids = [row['docid'] for row in reader]
+            else:
+                docids = [line.strip() for line in f if len(line.strip()) > 0]
+
+    else:
+        docids = sorted(volumeio.list_volumes(folder, extension).keys())
+
+    return docids
+
+def init_worker(modelpath, source, root, extension):
+    with open(modelpath, 'rb') as input:
+        modeldict = pickle.load(input)
+
+    workermodel['model'] = modeldict
+    workermodel['source'] = source
+    workermodel['root'] = root
+    workermodel['extension'] = extension
+
+def score_chunk(chunktuple):
+    '''
+    Runs in a worker process. Reads every volume in the chunk that
+    can be found, and returns the chunk number, a list of (docid,
+    probabilities) pairs, a list of docids that were missing, and a
+    dictionary mapping docids that couldn't be read to the error.
+    The probabilities are a list with a value for each column of
+    output (see output_columns()); volumes that couldn't be read
+    get NaN in every column, so one bad file doesn't stop the run.
+    '''
+
+    chunknumber, docids = chunktuple
+
+    modeldict = workermodel['model']
+    vocablist = modeldict['vocabulary']
+    if workermodel['source'] == 'pairtree':
+        getpath = pairtree_path
+    else:
+        getpath = folder_path
+
+    found = []
+    rows = []
+    missing = []
+    failed = dict()
+
+    for docid in docids:
+        path = getpath(docid, workermodel['root'], workermodel['extension'])
+        if path is None:
+            missing.append(docid)
+            continue
+
+        try:
+            voldict, totalcount = versatiletrainer2.get_voldict(path)
+            row = versatiletrainer2.get_features(voldict, vocablist)
+        except Exception as e:
+            failed[docid] = type(e).__name__ + ': ' + str(e)
+            continue
+
+        rows.append(row)
+        found.append(docid)
+
+    if len(found) > 0:
+        standarddata = modeldict['scaler'].transform(np.array(rows))
+        probabilities = modeldict['itself'].predict_proba(standarddata)
+        if 'labels' not in modeldict:
+            probabilities = probabilities[ : , 1 : 2]
+        probabilities = probabilities.tolist()
+    else:
+        probabilities = []
+
+    results = list(zip(found, probabilities))
+    for docid in failed:
+        results.append((docid, [float('nan')] * len(output_columns(modeldict))))
+
+    return chunknumber, results, missing, failed
+
+def output_columns(modeldict):
+    '''
+    The columns of probabilities written for a model: one for each
+    class of a multinomial model, or else just 'probability'.
+    '''
+
+    if 'labels' in modeldict:
+        return list(modeldict['labels'])
+    else:
+        return ['probability']
+
+def docid_digest(docids):
+    ''' A short fingerprint of the docid list, so that a progress
+    file can't be applied to a different list by mistake.
+    '''
+
+    digest = hashlib.sha1()
+    for docid in docids:
+        digest.update(docid.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()[0 : 16]
+
+def read_progress(progresspath, outpath, signature):
+    '''
+    Returns the set of chunks already written. Each line of the
+    progress file records a chunk and the size of the output file
+    after that chunk was appended; if we crashed after writing rows
+    but before recording them, the output is truncated back to the
+    last recorded size, so no rows are duplicated.
+    '''
+
+    done = set()
+    outsize = 0
+
+    if not os.path.isfile(progresspath):
+        return done
+
+    with open(progresspath, encoding = 'utf-8') as f:
+        header = f.readline().strip()
+        if header != signature:
+            raise ValueError(progresspath + ' was written for a different list of volumes or chunksize; delete it to start over.')
+        for line in f:
+            fields = line.strip().split('\t')
+            if len(fields) != 2:
+                continue
+            done.add(int(fields[0]))
+            outsize = max(outsize, int(fields[1]))
+
+    if os.path.isfile(outpath) and os.path.getsize(outpath) > outsize:
+        with open(outpath, mode = 'r+b') as f:
+            f.truncate(outsize)
+
+    return done
+
+def bulk_score(modelpath, outpath, docids, source = 'folder', root = '../data/', extension = '.tsv', chunksize = 500, processes = None):
+    '''
+    Scores every docid in the list and writes docid<tab>probability
+    rows to outpath, resuming from outpath + '.progress' if it exists.
+    '''
+
+    with open(modelpath, 'rb') as input:
+        columns = output_columns(pickle.load(input))
+
+    chunks = [(i, docids[start : start + chunksize]) for i, start in enumerate(range(0, len(docids), chunksize))]
+
+    progresspath = outpath + '.progress'
+    signature = '#\t' + str(len(docids)) + '\t' + str(chunksize) + '\t' + docid_digest(docids)
+
+    done = read_progress(progresspath, outpath, signature)
+    todo = [x for x in chunks if x[0] not in done]
+
+    print(str(len(chunks)) + ' chunks of ' + str(chunksize) + ' volumes; ' + str(len(done)) + ' already done.')
+
+    if not os.path.isfile(outpath) or os.path.getsize(outpath) == 0:
+        with open(outpath, mode = 'w', encoding = 'utf-8') as f:
+            f.write('docid\t' + '\t'.join(columns) + '\n')
+
+    if not os.path.isfile(progresspath):
+        with open(progresspath, mode = 'w', encoding = 'utf-8') as f:
+            f.write(signature + '\n')
+
+    totalmissing = 0
+    allfailed = dict()
+    pool = workerpool.open_pool(processes, numthreads = 1, initializer = init_worker, initargs = (modelpath, source, root, extension))
+
+    try:
+        for chunknumber, results, missing, failed in pool.imap_unordered(score_chunk, todo):
+            with open(outpath, mode = 'a', encoding = 'utf-8') as f:
+                for docid, probabilities in results:
+                    f.write(docid + '\t' + '\t'.join([str(x) for x in probabilities]) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+                outsize = f.tell()
+
+            with open(progresspath, mode = 'a', encoding = 'utf-8') as f:
+                f.write(str(chunknumber) + '\t' + str(outsize) + '\n')
+
+            totalmissing += len(missing)
+            allfailed.update(failed)
+            done.add(chunknumber)
+            print('Chunk ' + str(chunknumber) + ': ' + str(len(results) - len(failed)) + ' scored, ' + str(len(missing)) + ' missing, ' + str(len(failed)) + ' unreadable. ' + str(len(done)) + ' of ' + str(len(chunks)) + ' chunks done.')
+
+    finally:
+        pool.close()
+        pool.join()
+
+    print(str(totalmissing) + ' volumes were not found.')
+    versatiletrainer2.report_failures(allfailed, outcome = 'were given NaN')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Apply an exported model to a whole corpus, in resumable chunks.')
+    parser.add_argument('model', help = 'pickled model written by export_model()')
+    parser.add_argument('outpath', help = 'tsv file of docid, probability rows (a column per class for multinomial models)')
+    parser.add_argument('--folder', default = None, help = 'flat folder of volumes')
+    parser.add_argument('--pairtree', default = None, help = 'root of a pairtree of volumes')
+    parser.add_argument('--ids', default = None, help = 'list of docids, or a csv/tsv with a docid column')
+    parser.add_argument('--extension', default = '.tsv')
+    parser.add_argument('--chunksize', type = int, default = 500)
+    parser.add_argument('--processes', type = int, default = None, help = 'default: one per core')
+    args = parser.parse_args()
+
+    if args.pairtree is not None:
+        if args.ids is None:
+            parser.error('--pairtree requires --ids')
+        source = 'pairtree'
+        root = args.pairtree
+    else:
+        source = 'folder'
+        root = args.folder if args.folder is not None else '../data/'
+
+    docids = get_docids(args.ids, root, args.extension)
+    bulk_score(args.model, args.outpath, docids, source = source, root = root, extension = args.extension, chunksize = args.chunksize, processes = args.processes)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+
+# costmodel.py
+#
+# Estimates what a batch of models will cost to train, before
+# training them, so we can decide how many nodes to ask for and how
+# to divide the work.
+#
+# The cost of tune_a_model() is dominated by the grid search: for
+# every cell (number of features x value of C) we fit k models, each
+# on (k - 1) / k of the rows, and fit time grows roughly with rows x
+# features, at a rate that depends a lot on C. So calibrate() times
+# modelingprocess.model_fold() on synthetic data of a few shapes, for
+# each C in a standard range, on the current machine, and fits
+#
+#     seconds = a(C) * rows * features + b(C)
+#
+# for each C; other values of C are interpolated on a log scale. It
+# also times reading volumes, if given a folder of them. The results
+# are saved as json, one calibration per machine, in calibrationpath
+# (by default in ../temp/, with our other working files, not in the
+# code folder). Calibrating takes a few minutes, so it only happens
+# when asked for, with the command below; without a calibration for
+# this machine, load_calibration() warns and falls back on rough
+# default coefficients.
+#
+# estimate_model() applies that to one model, given its number of rows
+# and modelparams, and returns the number of fits, CPU seconds,
+# expected wall-clock seconds with a pool of processes, and the size of
+# the data matrix and estimated peak memory. schedule() assigns a list
+# of such estimates to nodes (longest first, each to the least loaded
+# node) and prints the result. See the 'dryrun' command of
+# genre_experiment.py.
+#
+# USAGE syntax:
+#
+# python3 costmodel.py calibrate [--folder ../data/] [--algorithm logistic] [--path ../temp/costcalibration.json]
+
+import argparse, json, os, platform, time
+
+import numpy as np
+
+import modelingprocess
+import volumeio
+import workerpool
+
+calibrationpath = '../temp/costcalibration.json'
+
+DEFAULT_COEFFICIENTS = {'1e-05': [2.7e-08, 0.0056], '0.0001': [3.0e-08, 0.0022], '0.001': [4.2e-08, 0.0], '0.01': [3.2e-08, 0.0049], '0.1': [3.6e-08, 0.0051], '1': [2.9e-08, 0.0095], '10': [3.6e-08, 0.0038], '100': [4.9e-08, 0.0044]}
+DEFAULT_SECONDS_PER_VOLUME = 0.0005
+# Measured for logistic regression on one core of a modest machine;
+# good enough to see the shape of a schedule, not to trust to the hour.
+
+c_grid = [.00001, .0001, .001, .01, 0.1, 1, 10, 100]
+shapes = [(120, 1000), (240, 3000), (240, 6000), (480, 3000)]
+# (rows, features) of the synthetic matrices we time
+
+def synthetic_data(rows, features, seed = 0):
+    '''
+    A matrix that looks roughly like relative word frequencies: a few
+    common words and a long tail, with some columns that differ between
+    the two classes, so that fitting is neither trivial nor hopeless.
+    '''
+
+    rng = np.random.RandomState(seed)
+    scales = 1 / np.arange(1, features + 1)
+    data = rng.exponential(1, (rows, features)) * scales
+    classvector = np.arange(rows) % 2
+    signal = rng.choice(features, features // 20, replace = False)
+    data[ : , signal] = data[ : , signal] * (1 + 0.3 * classvector[ : , None])
+
+    return data, classvector
+
+def time_folds(algorithm, data, classvector, regularization, repeats = 2):
+    '''
+    Median seconds for one model_fold() task on data (five folds).
+    '''
+
+    foldlabels = np.arange(len(classvector)) % 5
+    modelingprocess.init_shared(data, classvector, foldlabels)
+
+    times = []
+    for i in range(repeats):
+        started = time.perf_counter()
+        modelingprocess.model_fold((None, algorithm, i % 5, data.shape[1], regularization))
+        times.append(time.perf_counter() - started)
+
+    return float(np.median(times))
+
+def time_ingestion(folder, extension = '.tsv', sample = 50):
+    ''' Seconds to read and parse one volume, on average. '''
+
+    paths = list(volumeio.list_volumes(folder, extension).values())[0 : sample]
+    if len(paths) == 0:
+        return None
+
+    started = time.perf_counter()
+    for path in paths:
+        volumeio.read_counts(path)
+
+    return (time.perf_counter() - started) / len(paths)
+
+def calibrate(algorithm = 'logistic', folder = None, extension = '.tsv', path = None):
+    '''
+    Times fits on this machine and saves the calibration (to
+    calibrationpath, unless another path is given). Returns it.
+    '''
+
+    if path is None:
+        path = calibrationpath
+
+    if os.path.dirname(path) != '':
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+    print('Calibrating ' + algorithm + ' on ' + platform.node() + '.')
+
+    coefficients = dict()
+    for regularization in c_grid:
+        x = []
+        y = []
+        for rows, features in shapes:
+            data, classvector = synthetic_data(rows, features)
+            seconds = time_folds(algorithm, data, classvector, regularization)
+            x.append(rows * 0.8 * features)
+            y.append(seconds)
+        a, b = np.polyfit(x, y, 1)
+        coefficients[str(regularization)] = [max(a, 0.0), max(b, 0.0)]
+        print('    C = ' + str(regularization) + ': ' + str(round(max(y), 3)) + 's for the largest fit.')
+
+    calibration = dict()
+    if os.path.isfile(path):
+        with open(path, encoding = 'utf-8') as f:
+            calibration = json.load(f)
+
+    calibration['machine'] = platform.node()
+    calibration['cores'] = os.cpu_count()
+    calibration.setdefault('algorithms', dict())[algorithm] = coefficients
+
+    if folder is not None:
+        calibration['seconds_per_volume'] = time_ingestion(folder, extension)
+        print('    ' + str(calibration['seconds_per_volume']) + 's to read a volume.')
+
+    with open(path, mode = 'w', encoding = 'utf-8') as f:
+        json.dump(calibration, f, indent = 2)
+
+    return calibration
+
+def default_calibration(algorithm = 'logistic'):
+    ''' A calibration made of the default coefficients, for this machine's cores. '''
+
+    calibration = dict()
+    calibration['machine'] = None
+    calibration['cores'] = os.cpu_count()
+    calibration['algorithms'] = {algorithm: dict(DEFAULT_COEFFICIENTS)}
+    calibration['seconds_per_volume'] = DEFAULT_SECONDS_PER_VOLUME
+
+    return calibration
+
+def load_calibration(algorithm = 'logistic', path = None, calibrate_if_missing = False):
+    '''
+    The saved calibration for this machine. If there isn't one (or it
+    was made on another machine, or for another algorithm), calibrates
+    now if calibrate_if_missing is True, and otherwise warns and
+    returns default_calibration().
+    '''
+
+    if path is None:
+        path = calibrationpath
+
+    if os.path.isfile(path):
+        with open(path, encoding = 'utf-8') as f:
+            calibration = json.load(f)
+        if calibration.get('machine') == platform.node() and algorithm in calibration.get('algorithms', dict()):
+            return calibration
+
+    if calibrate_if_missing:
+        return calibrate(algorithm = algorithm, path = path)
+
+    print('Warning: no calibration for ' + algorithm + ' on ' + platform.node() + ' in ' + path + '; using rough default coefficients.')
+    print('Run python3 costmodel.py calibrate for better estimates.')
+
+    return default_calibration(algorithm)
+
+def fit_seconds(calibration, algorithm, regularization, rows, features):
+    ''' Estimated seconds for one fit (and prediction) of a fold. '''
+
+    coefficients = calibration['algorithms'][algorithm]
+    logc = [np.log10(float(x)) for x in coefficients]
+    order = np.argsort(logc)
+    slopes = np.array([coefficients[x][0] for x in coefficients])[order]
+    intercepts = np.array([coefficients[x][1] for x in coefficients])[order]
+    logc = np.array(logc)[order]
+
+    a = np.interp(np.log10(regularization), logc, slopes)
+    b = np.interp(np.log10(regularization), logc, intercepts)
+
+    return a * rows * features + b
+
+def estimate_model(rows, modelparams, numfeatures, calibration, processes = None):
+    '''
+    Estimates the cost of tune_a_model() for a model of rows volumes,
+    with a vocabulary of numfeatures words, trained by a pool of
+    processes (by default, as many as workerpool.split() would start
+    on the calibrated machine). Returns a dictionary.
+    '''
+
+    algorithm, k, featurestart, featureend, featurestep, c_range = modelparams
+
+    if k < 1:
+        k = rows
+        # leave-one-out
+
+    xaxis = [min(x, numfeatures) for x in range(featurestart, featureend, featurestep)]
+    trainrows = rows * (k - 1) / k
+
+    if processes is None:
+        processes = workerpool.split(calibration.get('cores'), rows = rows, features = numfeatures)[0]
+
+    cellseconds = []
+    for features in xaxis:
+        for regularization in c_range:
+            cellseconds.append(k * fit_seconds(calibration, algorithm, regularization, trainrows, features))
+
+    gridseconds = sum(cellseconds)
+    typicalcell = float(np.mean(cellseconds))
+    # We don't know which cell will win, so the final crossvalidation
+    # and the full model are charged at the average cell's cost; a fit
+    # on all the rows costs about k / (k - 1) of a fold's.
+
+    cpuseconds = gridseconds + typicalcell + typicalcell / max(k - 1, 1)
+
+    tasks = len(cellseconds) * k
+    wallseconds = cpuseconds / max(min(processes, calibration.get('cores', processes), tasks), 1)
+
+    if calibration.get('seconds_per_volume') is not None:
+        wallseconds += rows * calibration['seconds_per_volume']
+
+    matrixbytes = rows * numfeatures * 8
+    peakbytes = workerpool.estimate_memory(rows, numfeatures, processes, k = modelparams[1])
+
+    estimate = dict()
+    estimate['rows'] = rows
+    estimate['cells'] = len(cellseconds)
+    estimate['fits'] = tasks + k + 1
+    estimate['cpuseconds'] = cpuseconds
+    estimate['wallseconds'] = wallseconds
+    estimate['matrixbytes'] = matrixbytes
+    estimate['peakbytes'] = peakbytes
+
+    return estimate
+
+def human_seconds(seconds):
+    if seconds < 120:
+        return str(round(seconds, 1)) + 's'
+    elif seconds < 7200:
+        return str(round(seconds / 60, 1)) + 'm'
+    else:
+        return str(round(seconds / 3600, 1)) + 'h'
+
+def human_bytes(numbytes):
+    return str(round(numbytes / (1024 * 1024), 1)) + ' MB'
+
+def schedule(estimates, nodes = 1):
+    '''
+    Given a dictionary mapping job names to estimates, assigns jobs to
+    nodes (longest first, each to the node that will be free soonest),
+    prints the schedule, and returns a list of job names for each node.
+    '''
+
+    loads = [0.0] * nodes
+    peaks = [0] * nodes
+    assigned = [[] for x in range(nodes)]
+
+    for name in sorted(estimates, key = lambda x: estimates[x]['wallseconds'], reverse = True):
+        node = loads.index(min(loads))
+        loads[node] += estimates[name]['wallseconds']
+        peaks[node] = max(peaks[node], estimates[name]['peakbytes'])
+        assigned[node].append(name)
+
+    totalfits = sum([x['fits'] for x in estimates.values()])
+    totalcpu = sum([x['cpuseconds'] for x in estimates.values()])
+
+    print()
+    print(str(len(estimates)) + ' models; ' + str(totalfits) + ' fits; ' + human_seconds(totalcpu) + ' of CPU time.')
+    print()
+    print('node\tmodels\twall-clock\tpeak memory')
+    for node in range(nodes):
+        print(str(node) + '\t' + str(len(assigned[node])) + '\t' + human_seconds(loads[node]) + '\t' + human_bytes(peaks[node]))
+    print()
+    print('Finishes in about ' + human_seconds(max(loads)) + ' on ' + str(nodes) + ' nodes.')
+
+    return assigned
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Calibrate the cost model on this machine.')
+    parser.add_argument('command', choices = ['calibrate'])
+    parser.add_argument('--algorithm', default = 'logistic')
+    parser.add_argument('--folder', default = None, help = 'a folder of volumes, to time reading them')
+    parser.add_argument('--extension', default = '.tsv')
+    parser.add_argument('--path', default = calibrationpath, help = 'where to save the calibration')
+    args = parser.parse_args()
+
+    calibrate(algorithm = args.algorithm, folder = args.folder, extension = args.extension, path = args.path)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# efreader.py
+#
+# Reads HathiTrust Extended Features files (the bzipped json
+# files distributed by HTRC) directly, so that they can be used
+# by versatiletrainer2 without first being converted into
+# word<tab>count files.
+#
+# An EF file records token counts page by page, and on each page
+# separately for header, body and footer, and for each part of
+# speech a token takes. We collapse all of that into a single
+# volume-level count for each (lowercased) word, using only the
+# body of each page unless asked otherwise.
+#
+# By default counts are divided by the total, producing the
+# relative frequencies that get_simple_data() assumes it is
+# being given (freqs_already_normalized = True).
+#
+# EF volumes are read in parallel along with every other kind of
+# volume, by versatiletrainer2.ingest_volumes().
+
+import bz2, gzip, json
+from collections import Counter
+
+EF_SUFFIXES = ('.json.bz2', '.json.gz', '.json')
+
+def is_ef_path(path):
+    return path.endswith(EF_SUFFIXES)
+
+def open_ef(path):
+    if path.endswith('.bz2'):
+        return bz2.open(path, mode = 'rt', encoding = 'utf-8')
+    elif path.endswith('.gz'):
+        return gzip.open(path, mode = 'rt', encoding = 'utf-8')
+    else:
+        return open(path, encoding = 'utf-8')
+
+def aggregate_pages(pages, sections = ('body',), lowercase = True):
+    '''
+    Sums the tokenPosCount dictionaries of every page into a single
+    Counter of word -> count, ignoring part of speech.
+    '''
+
+    wordcounts = Counter()
+
+    for page in pages:
+        for section in sections:
+            if section not in page or page[section] is None:
+                continue
+            tokenposcount = page[section].get('tokenPosCount', dict())
+            for token, poscounts in tokenposcount.items():
+                if lowercase:
+                    token = token.lower()
+                wordcounts[token] += sum(poscounts.values())
+
+    return wordcounts
+
+def read_ef_volume(path, normalize = True, sections = ('body',), lowercase = True):
+    '''
+    Returns a word -> count dictionary for a single EF volume, and the
+    sum of its values, in the same form as versatiletrainer2.get_voldict().
+    '''
+
+    with open_ef(path) as f:
+        volume = json.load(f)
+
+    pages = volume['features']['pages']
+    wordcounts = aggregate_pages(pages, sections = sections, lowercase = lowercase)
+
+    totalcount = sum(wordcounts.values())
+
+    if normalize and totalcount > 0:
+        voldict = {word: count / totalcount for word, count in wordcounts.items()}
+        totalcount = 1.0
+    else:
+        voldict = dict(wordcounts)
+
+    return voldict, totalcount
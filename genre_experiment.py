@@ -6,11 +6,23 @@
 
 # python3 main_experiment.py *command*
 
+# To spread models and comparisons across nodes that share a filesystem:
+
+# python3 genre_experiment.py enqueue ../queue
+# python3 genre_experiment.py work ../queue      (on as many nodes as you like)
+
+# To estimate the time and memory that will take, without training:
+
+# python3 genre_experiment.py dryrun 8           (for 8 nodes)
+
 import sys, os, csv, random
 import numpy as np
 import pandas as pd
 import versatiletrainer2
 import metaselector
+import batchtrainer
+import jobqueue
+import costmodel
 
 import matplotlib.pyplot as plt
 
@@ -174,7 +186,10 @@ def compress(aname):
     aname = aname.replace(',', '')
     return aname
 
-def create_comparison_assignments():
+def comparison_assignments():
+    '''
+    The pairs of primary genres whose models should be compared.
+    '''
 
     genrenamedf = pd.read_csv('../metadata/selected_genres.tsv', sep = '\t')
     primary_genres = genrenamedf.loc[genrenamedf.genretype == 'primary', 'genre'].tolist()
@@ -190,6 +205,27 @@ def create_comparison_assignments():
             else:
                 assignments.append((g1, g2))
 
+    return assignments
+
+def comparison_models(g1, g2, intersection_genres):
+    '''
+    The model assignments whose models compare_pairs() compares for a
+    pair of genres: each genre without the other, if they intersect,
+    or else each genre's own model.
+    '''
+
+    intersect1 = g1 + '-Not-' + g2
+    intersect2 = g2 + '-Not-' + g1
+
+    if intersect1 in intersection_genres:
+        return [(g1, intersect1), (g2, intersect2)]
+    else:
+        return [(g1, 'self'), (g2, 'self')]
+
+def create_comparison_assignments():
+
+    assignments = comparison_assignments()
+
     for floor in range(0, len(assignments), 128):
         with open('comparison' + str(floor) + '.tsv', mode = 'w', encoding = 'utf-8') as f:
             for g1, g2 in assignments[floor: floor + 128]:
@@ -208,6 +244,14 @@ def compare_cross_models(assignment_file):
             row = line.strip().split('\t')
             assignments.append((row[0], row[1]))
 
+    compare_pairs(assignments)
+
+def compare_pairs(assignments):
+    '''
+    Compares the cross models for each (genre, genre) pair in a list,
+    skipping pairs already recorded in crosscomparisons.tsv.
+    '''
+
     modelfiles = [x for x in os.listdir('../models') if x.endswith('.pkl')]
 
     genrenamedf = pd.read_csv('../metadata/selected_genres.tsv', sep = '\t')
@@ -372,53 +416,47 @@ def create_cross_models():
     allgenres = list(allgenres)
     print(allgenres)
 
-    for g in allgenres:
-        print()
-        print(g)
-        print()
-        sourcefolder = '../data/'
-        sizecap = 100
-        outmodels = '../results/crossmodels.tsv'
-
-        c_range = [.00001, .0001, .001, .01, 0.1, 1, 10, 100]
-        featurestart = 1000
-        featureend = 7000
-        featurestep = 100
-        modelparams = 'logistic', 12, featurestart, featureend, featurestep, c_range
-        metadatapath = '../genremeta.csv'
+    sourcefolder = '../data/'
+    sizecap = 100
+    outmodels = '../results/crossmodels.tsv'
 
+    c_range = [.00001, .0001, .001, .01, 0.1, 1, 10, 100]
+    featurestart = 1000
+    featureend = 7000
+    featurestep = 100
+    modelparams = 'logistic', 12, featurestart, featureend, featurestep, c_range
+    metadatapath = '../genremeta.csv'
+    floor = 1700
+    ceiling = 2011
+
+    specs = []
+    for g in allgenres:
         for contrast in ['randomA', 'randomB']:
-
             name = g + '_' + contrast
-            vocabpath = '../lexica/' + name + '.txt'
-            tags4positive = {g}
-            tags4negative = {contrast}
-            floor = 1700
-            ceiling = 2011
+            specs.append({'name': name, 'tags4positive': {g}, 'tags4negative': {contrast}, 'forbid4positive': set(), 'forbid4negative': set()})
 
-            checkpath = '../models/' + name + '.csv'
-            if not os.path.isfile(checkpath):
+    # All the models are trained in one batch, which reads each volume
+    # once and shares a pool of workers; models already in ../models/
+    # are skipped.
 
-                metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = versatiletrainer2.get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4negative, sizecap, excludebelow = floor, excludeabove = ceiling, force_even_distribution = False, negative_strategy = 'closely match', numfeatures = 7000, forbid4positive = set(), forbid4negative = set())
+    index = batchtrainer.CorpusIndex(sourcefolder, metadatapath, excludebelow = floor, excludeabove = ceiling)
 
-                # notice that I am excluding children's lit this time!
+    for spec, results in batchtrainer.train_specs(index, specs, modelparams, '../models/', sizecap, numfeatures = 7000, negative_strategy = 'closely match', force_even_distribution = False):
 
-                matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, tags4positive, tags4negative, modelparams, name, '../models/' + name + '.csv')
+        matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = results
 
-                meandate = int(round(np.sum(metadata.firstpub) / len(metadata.firstpub)))
-
-                with open(outmodels, mode = 'a', encoding = 'utf-8') as f:
-                    outline = name + '\t' + str(meandate) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\n'
-                    f.write(outline)
+        meandate = int(round(np.sum(metadata.firstpub) / len(metadata.firstpub)))
 
-                os.remove(vocabpath)
+        with open(outmodels, mode = 'a', encoding = 'utf-8') as f:
+            outline = spec['name'] + '\t' + str(meandate) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\n'
+            f.write(outline)
 
-def create_model_assignments():
+def model_assignments():
     '''
     To make sure that overlaps aren't biasing the model, we'll need to train
     extra models for comparisons where there is an overlap. This is quite a task
     and may need to be distributed across nodes. So first let's generate a list
-    of assignments.
+    of assignments: (positive genre, 'self' or intersection) pairs.
     '''
 
     genres = pd.read_csv('../metadata/selected_genres.tsv', sep = '\t')
@@ -449,7 +487,18 @@ def create_model_assignments():
                     else:
                         print('weird error you should check on')
 
-    models = list(models)
+    models = sorted(models)
+
+    return models
+
+def create_model_assignments():
+    '''
+    Writes the model assignments in chunks of 25, to be run by hand
+    with implement_assignment on different nodes. (The 'enqueue' and
+    'work' commands do the same job with better load balancing.)
+    '''
+
+    models = model_assignments()
     modelct = len(models)
     print(modelct)
 
@@ -458,38 +507,74 @@ def create_model_assignments():
             for positive, other in models[floor: floor + 25]:
                 f.write(positive + '\t' + other + '\n')
 
+def assignment_name(positive, other):
+    '''
+    The name of the model for an assignment, and its positive genres.
+    '''
+
+    name = positive.replace(': ', '')
+    name = name.replace(' ', '')
+    name = name.replace(',', '')
+
+    positive_genres = [positive]
+
+    if other != 'self':
+        positive_genres.append(other)
+        exclusion = other.split('-Not-')[1]
+        excludename = exclusion.replace(' ', '')
+        excludename = excludename.replace(':', '')
+        excludename = excludename.replace(',', '')
+        name = name + '-Not-' + excludename
+
+    return name, positive_genres
+
 def implement_assignment(assignment_file):
 
-    assignments = dict()
+    pairs = []
 
     with open(assignment_file, encoding = 'utf-8') as f:
         for line in f:
             row = line.strip().split('\t')
+            pairs.append((row[0], row[1]))
 
-            name = row[0].replace(': ', '')
-            name = name.replace(' ', '')
-            name = name.replace(',', '')
+    train_assignments(pairs)
 
-            positive_genres = [row[0]]
-
-            if row[1] != 'self':
-                positive_genres.append(row[1])
-                exclusion = row[1].split('-Not-')[1]
-                excludename = exclusion.replace(' ', '')
-                excludename = excludename.replace(':', '')
-                excludename = excludename.replace(',', '')
-                name = name + '-Not-' + excludename
-
-            assignments[name] = positive_genres
+def assignment_settings():
+    '''
+    The settings used to train every assignment's models: source folder,
+    metadata, date range, sizecap, modelparams and number of features.
+    '''
 
     sourcefolder = '../data/'
+    metadatapath = '../metadata/genremeta.csv'
+    floor = 1700
+    ceiling = 2011
     sizecap = 100
-    outmodels = '../results/crossmodels.tsv'
+
+    c_range = [.00001, .0001, .001, .01, 0.1, 1, 10, 100]
+    featurestart = 500
+    featureend = 6800
+    featurestep = 100
+    modelparams = 'logistic', 12, featurestart, featureend, featurestep, c_range
+    numfeatures = 6900
+
+    return sourcefolder, metadatapath, floor, ceiling, sizecap, modelparams, numfeatures
+
+def assignment_specs(pairs):
+    '''
+    Specs for the models (against randomA and randomB) of a list of
+    (positive genre, 'self' or intersection) assignments.
+    '''
+
+    assignments = dict()
+
+    for positive, other in pairs:
+        name, positive_genres = assignment_name(positive, other)
+        assignments[name] = positive_genres
+
+    specs = []
 
     for posname, assigned_positives in assignments.items():
-        print()
-        print(name, assigned_positives)
-        print()
 
         if len(assigned_positives) > 1:
             exclusion = assigned_positives[1].split('-Not-')[1]
@@ -499,37 +584,105 @@ def implement_assignment(assignment_file):
         else:
             set2exclude = set()
 
-        c_range = [.00001, .0001, .001, .01, 0.1, 1, 10, 100]
-        featurestart = 500
-        featureend = 6800
-        featurestep = 100
-        modelparams = 'logistic', 12, featurestart, featureend, featurestep, c_range
-        metadatapath = '../metadata/genremeta.csv'
-
         for contrast in ['randomA', 'randomB']:
-
             name = posname + '_' + contrast
-            vocabpath = '../lexica/' + name + '.txt'
-            tags4positive = set(assigned_positives)
+            specs.append({'name': name, 'tags4positive': set(assigned_positives), 'tags4negative': {contrast}, 'forbid4positive': set2exclude, 'forbid4negative': set()})
+
+    return specs
 
-            tags4negative = {contrast}
-            floor = 1700
-            ceiling = 2011
+def train_assignments(pairs):
+    '''
+    Trains models (against randomA and randomB) for a list of
+    (positive genre, 'self' or intersection) assignments.
+    '''
 
-            checkpath = '../models/' + name + '.csv'
-            if not os.path.isfile(checkpath):
+    sourcefolder, metadatapath, floor, ceiling, sizecap, modelparams, numfeatures = assignment_settings()
+    outmodels = '../results/crossmodels.tsv'
 
-                metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = versatiletrainer2.get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4negative, sizecap, excludebelow = floor, excludeabove = ceiling, force_even_distribution = False, negative_strategy = 'closely match', numfeatures = 6900, forbid4positive = set2exclude, forbid4negative = set())
+    specs = assignment_specs(pairs)
 
-                matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, tags4positive, tags4negative, modelparams, name, '../models/' + name + '.csv')
+    index = batchtrainer.CorpusIndex(sourcefolder, metadatapath, excludebelow = floor, excludeabove = ceiling)
 
-                meandate = int(round(np.sum(metadata.firstpub) / len(metadata.firstpub)))
+    for spec, results in batchtrainer.train_specs(index, specs, modelparams, '../models/', sizecap, numfeatures = numfeatures, negative_strategy = 'closely match', force_even_distribution = False):
 
-                with open(outmodels, mode = 'a', encoding = 'utf-8') as f:
-                    outline = name + '\t' + str(meandate) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\n'
-                    f.write(outline)
+        matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = results
 
-                os.remove(vocabpath)
+        meandate = int(round(np.sum(metadata.firstpub) / len(metadata.firstpub)))
+
+        with open(outmodels, mode = 'a', encoding = 'utf-8') as f:
+            outline = spec['name'] + '\t' + str(meandate) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\n'
+            f.write(outline)
+
+def dry_run(nodes):
+    '''
+    Estimates, without training anything, what it will cost to train
+    every assignment's models (see costmodel.py): selects each model's
+    volumes from the metadata to count its rows, then prints a schedule
+    for the given number of nodes, with each node's peak memory. This
+    never calibrates; without a saved calibration it uses defaults.
+    '''
+
+    sourcefolder, metadatapath, floor, ceiling, sizecap, modelparams, numfeatures = assignment_settings()
+
+    specs = assignment_specs(model_assignments())
+    specs = [x for x in specs if not os.path.isfile('../models/' + x['name'] + '.csv')]
+
+    calibration = costmodel.load_calibration(modelparams[0])
+    index = batchtrainer.CorpusIndex(sourcefolder, metadatapath, excludebelow = floor, excludeabove = ceiling)
+
+    estimates = dict()
+    for spec in specs:
+        orderedIDs, classdictionary = index.select(spec, sizecap, negative_strategy = 'closely match')
+        estimates[spec['name']] = costmodel.estimate_model(len(orderedIDs), modelparams, numfeatures, calibration)
+
+    costmodel.schedule(estimates, nodes)
+
+def enqueue_jobs(queuefolder):
+    '''
+    Puts every model assignment, and every comparison, in a job queue
+    (see jobqueue.py) that workers on any node can drain with the 'work'
+    command. Each comparison waits only for the two models it compares.
+    '''
+
+    queue = jobqueue.JobQueue(queuefolder)
+
+    modeljobs = []
+    for positive, other in model_assignments():
+        name, positive_genres = assignment_name(positive, other)
+        modeljobs.append({'id': 'model-' + name, 'kind': 'model', 'args': [positive, other]})
+
+    modelids = set([x['id'] for x in modeljobs])
+
+    genrenamedf = pd.read_csv('../metadata/selected_genres.tsv', sep = '\t')
+    intersection_genres = set(genrenamedf.loc[genrenamedf.genretype == 'intersection', 'genre'].tolist())
+
+    comparejobs = []
+    for g1, g2 in comparison_assignments():
+        jobid = 'compare-' + compress(g1) + '+' + compress(g2)
+        requires = []
+        for positive, other in comparison_models(g1, g2, intersection_genres):
+            modelid = 'model-' + assignment_name(positive, other)[0]
+            if modelid in modelids:
+                requires.append(modelid)
+        comparejobs.append({'id': jobid, 'kind': 'compare', 'args': [g1, g2], 'requires': requires})
+
+    added = queue.add(modeljobs + comparejobs)
+    print(str(added) + ' jobs added to ' + queuefolder)
+    queue.status()
+
+def work_queue(queuefolder):
+    '''
+    Runs model and comparison jobs from the queue until it is drained.
+    Both kinds of job skip work that is already done, so a job that
+    gets run twice does no harm.
+    '''
+
+    handlers = dict()
+    handlers['model'] = lambda positive, other: train_assignments([(positive, other)])
+    handlers['compare'] = lambda g1, g2: compare_pairs([(g1, g2)])
+
+    queue = jobqueue.JobQueue(queuefolder)
+    jobqueue.work(queue, handlers)
 
 def genrespace():
 
@@ -613,6 +766,15 @@ elif command == 'create_model_assignments':
 elif command == 'assign':
     assignment_file = sys.argv[2]
     implement_assignment(assignment_file)
+elif command == 'enqueue':
+    queuefolder = sys.argv[2]
+    enqueue_jobs(queuefolder)
+elif command == 'work':
+    queuefolder = sys.argv[2]
+    work_queue(queuefolder)
+elif command == 'dryrun':
+    nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    dry_run(nodes)
 
 else:
     print('Not an allowable command.')
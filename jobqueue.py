@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+
+# jobqueue.py
+#
+# A queue of jobs kept in a folder on a shared filesystem, so that
+# workers on any number of nodes can pull jobs from it until it is
+# empty, with no broker or database to run.
+#
+# Each job is a small json file, and its state is the subfolder it
+# sits in:
+#
+#     pending/jobid.json            waiting to be run
+#     leased/jobid@worker.json      being run by worker
+#     done/jobid.json               finished
+#     failed/jobid.json             failed maxattempts times
+#
+# Jobs move between states by os.rename(), which is atomic even over
+# NFS: if two workers try to lease the same job, exactly one rename
+# succeeds. A worker holding a lease touches the leased file every
+# so often (a heartbeat). If a leased file hasn't been touched for
+# leasetime seconds, its worker is presumed dead, and any worker may
+# put the job back in pending/, counting the attempt. Job files are
+# only ever rewritten by whoever has just renamed them out of the
+# shared folders, so no two processes write the same file.
+#
+# A job can also list other jobs that it requires; it won't be leased
+# until all of those are done. The jobs it requires must already be in
+# the queue, or be added along with it. If nothing is running and every
+# pending job is waiting on jobs that will never be done (because they
+# failed, or were removed by hand), workers stop and say which.
+#
+# Times are compared with the filesystem's clock, not the node's,
+# since nodes' clocks may not agree.
+#
+# USAGE syntax:
+#
+# python3 jobqueue.py status queuefolder
+# python3 jobqueue.py retry queuefolder      (puts failed jobs back in pending)
+#
+# Jobs are added and run from experiment scripts; see the 'enqueue' and
+# 'work' commands of genre_experiment.py.
+
+import argparse, json, os, socket, threading, time, traceback
+
+STATES = ['pending', 'leased', 'done', 'failed']
+
+class LostLease(Exception):
+    pass
+
+class JobQueue:
+    '''
+    A job queue in a folder. Jobs are dictionaries with an 'id',
+    a 'kind' and a list of 'args', plus bookkeeping: 'requires',
+    'attempts' and a list of 'errors'.
+    '''
+
+    def __init__(self, folder, leasetime = 600, maxattempts = 3):
+        self.folder = folder
+        self.leasetime = leasetime
+        self.maxattempts = maxattempts
+
+        for state in STATES + ['tmp']:
+            os.makedirs(os.path.join(folder, state), exist_ok = True)
+
+    def path(self, state, filename):
+        return os.path.join(self.folder, state, filename)
+
+    def write_job(self, job, destination):
+        '''
+        Writes a job to a temporary file and renames it into place,
+        so nobody ever reads a half-written job.
+        '''
+
+        temppath = self.path('tmp', job['id'] + '.' + str(os.getpid()) + '.' + socket.gethostname())
+        with open(temppath, mode = 'w', encoding = 'utf-8') as f:
+            json.dump(job, f)
+        os.rename(temppath, destination)
+
+    def read_job(self, path):
+        with open(path, encoding = 'utf-8') as f:
+            return json.load(f)
+
+    def filesystem_now(self):
+        ''' The current time by the clock of the filesystem. '''
+
+        clockpath = self.path('tmp', 'clock.' + str(os.getpid()) + '.' + socket.gethostname())
+        with open(clockpath, mode = 'w') as f:
+            pass
+        now = os.stat(clockpath).st_mtime
+        os.remove(clockpath)
+
+        return now
+
+    def known_ids(self):
+        ids = set()
+        for state in STATES:
+            for filename in os.listdir(os.path.join(self.folder, state)):
+                ids.add(filename.split('@')[0].replace('.json', ''))
+        return ids
+
+    def add(self, jobs):
+        '''
+        Adds jobs (dictionaries with 'id', 'kind', 'args' and optionally
+        'requires'), skipping any whose id is already in the queue, in
+        any state. Returns the number added.
+
+        Raises ValueError, before adding anything, if a job requires
+        an id that is neither in the queue nor among the jobs.
+        '''
+
+        known = self.known_ids()
+        added = 0
+
+        allids = known | set([x['id'] for x in jobs])
+        for job in jobs:
+            unknown = [x for x in job.get('requires', []) if x not in allids]
+            if job['id'] not in known and len(unknown) > 0:
+                raise ValueError('Job ' + job['id'] + ' requires jobs that are not in the queue: ' + ', '.join(unknown))
+
+        for job in jobs:
+            if job['id'] in known:
+                continue
+            if '@' in job['id'] or '/' in job['id']:
+                raise ValueError('Job ids cannot contain @ or /: ' + job['id'])
+
+            job = dict(job)
+            job.setdefault('requires', [])
+            job['attempts'] = 0
+            job['errors'] = []
+            self.write_job(job, self.path('pending', job['id'] + '.json'))
+            known.add(job['id'])
+            added += 1
+
+        return added
+
+    def reap(self):
+        '''
+        Puts jobs whose leases have expired back in pending/, or in
+        failed/ if they have used up their attempts. Returns the number
+        of leases reaped.
+        '''
+
+        now = self.filesystem_now()
+        reaped = 0
+
+        for filename in os.listdir(os.path.join(self.folder, 'leased')):
+            leasedpath = self.path('leased', filename)
+            try:
+                age = now - os.stat(leasedpath).st_mtime
+            except FileNotFoundError:
+                continue
+
+            if age < self.leasetime:
+                continue
+
+            worker = filename.split('@')[1].replace('.json', '')
+            if self.release(filename, 'lease expired (held by ' + worker + ')'):
+                reaped += 1
+
+        return reaped
+
+    def release(self, leasedname, error):
+        '''
+        Takes a job out of leased/ and, counting the attempt and
+        recording the error, puts it back in pending/ or in failed/.
+        Returns False if someone else got to the job first.
+        '''
+
+        claimpath = self.path('tmp', leasedname + '.' + str(os.getpid()) + '.' + socket.gethostname())
+        try:
+            os.rename(self.path('leased', leasedname), claimpath)
+        except FileNotFoundError:
+            return False
+
+        job = self.read_job(claimpath)
+        job['attempts'] += 1
+        job['errors'].append(error)
+
+        if job['attempts'] >= self.maxattempts:
+            self.write_job(job, self.path('failed', job['id'] + '.json'))
+            print('Job ' + job['id'] + ' failed ' + str(job['attempts']) + ' times; giving up.')
+        else:
+            self.write_job(job, self.path('pending', job['id'] + '.json'))
+
+        os.remove(claimpath)
+        return True
+
+    def lease(self, worker):
+        '''
+        Leases the first pending job whose requirements are done, and
+        returns it along with the name of its lease; or returns None,
+        None if there is no such job.
+        '''
+
+        done = set([x.replace('.json', '') for x in os.listdir(os.path.join(self.folder, 'done'))])
+
+        for filename in sorted(os.listdir(os.path.join(self.folder, 'pending'))):
+            pendingpath = self.path('pending', filename)
+            try:
+                job = self.read_job(pendingpath)
+            except (FileNotFoundError, ValueError):
+                continue
+
+            if not all(x in done for x in job['requires']):
+                continue
+
+            leasedname = job['id'] + '@' + worker + '.json'
+            try:
+                os.rename(pendingpath, self.path('leased', leasedname))
+            except FileNotFoundError:
+                continue
+                # another worker leased it first
+
+            try:
+                self.heartbeat(leasedname)
+            except LostLease:
+                continue
+
+            return job, leasedname
+
+        return None, None
+
+    def waiting(self):
+        '''
+        Sorts the pending jobs into those whose requirements are done,
+        returned as a list of ids, and the rest, returned as a dictionary
+        mapping ids to the requirements that aren't done.
+        '''
+
+        done = set([x.replace('.json', '') for x in os.listdir(os.path.join(self.folder, 'done'))])
+
+        runnable = []
+        blocked = dict()
+        for filename in sorted(os.listdir(os.path.join(self.folder, 'pending'))):
+            try:
+                job = self.read_job(self.path('pending', filename))
+            except (FileNotFoundError, ValueError):
+                continue
+
+            unmet = [x for x in job['requires'] if x not in done]
+            if len(unmet) == 0:
+                runnable.append(job['id'])
+            else:
+                blocked[job['id']] = unmet
+
+        return runnable, blocked
+
+    def heartbeat(self, leasedname):
+        try:
+            os.utime(self.path('leased', leasedname))
+        except FileNotFoundError:
+            raise LostLease(leasedname)
+
+    def complete(self, leasedname, seconds):
+        '''
+        Moves a job to done/, and records who ran it and how long it
+        took. Raises LostLease if the lease had expired and the job has
+        been taken back.
+        '''
+
+        donepath = self.path('done', leasedname.split('@')[0] + '.json')
+        try:
+            os.rename(self.path('leased', leasedname), donepath)
+        except FileNotFoundError:
+            raise LostLease(leasedname)
+
+        job = self.read_job(donepath)
+        job['worker'] = leasedname.split('@')[1].replace('.json', '')
+        job['seconds'] = round(seconds, 1)
+        self.write_job(job, donepath)
+
+    def counts(self):
+        counts = dict()
+        for state in STATES:
+            counts[state] = len(os.listdir(os.path.join(self.folder, state)))
+        return counts
+
+    def drained(self):
+        ''' True if there is nothing pending or leased. '''
+
+        counts = self.counts()
+        return counts['pending'] == 0 and counts['leased'] == 0
+
+    def status(self):
+        counts = self.counts()
+        print('  '.join([state + ': ' + str(counts[state]) for state in STATES]))
+
+        for filename in sorted(os.listdir(os.path.join(self.folder, 'leased'))):
+            jobid, worker = filename.replace('.json', '').split('@')
+            try:
+                age = self.filesystem_now() - os.stat(self.path('leased', filename)).st_mtime
+            except FileNotFoundError:
+                continue
+            print('    leased  ' + jobid + '  by ' + worker + ', heartbeat ' + str(int(age)) + 's ago')
+
+        for filename in sorted(os.listdir(os.path.join(self.folder, 'failed'))):
+            job = self.read_job(self.path('failed', filename))
+            print('    failed  ' + job['id'] + '  ' + job['errors'][-1].strip().split('\n')[-1])
+
+    def retry_failed(self):
+        ''' Puts failed jobs back in pending/, with fresh attempts. '''
+
+        retried = 0
+        for filename in os.listdir(os.path.join(self.folder, 'failed')):
+            claimpath = self.path('tmp', filename + '.' + str(os.getpid()))
+            try:
+                os.rename(self.path('failed', filename), claimpath)
+            except FileNotFoundError:
+                continue
+            job = self.read_job(claimpath)
+            job['attempts'] = 0
+            self.write_job(job, self.path('pending', filename))
+            os.remove(claimpath)
+            retried += 1
+
+        return retried
+
+class Heartbeat(threading.Thread):
+    '''
+    Touches a lease every interval seconds, in the background, until
+    stopped; notices if the lease has been lost.
+    '''
+
+    def __init__(self, queue, leasedname, interval):
+        threading.Thread.__init__(self, daemon = True)
+        self.queue = queue
+        self.leasedname = leasedname
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.lost = False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.queue.heartbeat(self.leasedname)
+            except LostLease:
+                self.lost = True
+                return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+def work(queue, handlers, worker = None, poll = 30):
+    '''
+    Leases and runs jobs until the queue is drained. handlers maps each
+    kind of job to a function, which is called with the job's args.
+    Jobs should be safe to run twice, since a job whose worker stops
+    sending heartbeats is given to someone else.
+    '''
+
+    if worker is None:
+        worker = socket.gethostname() + '-' + str(os.getpid())
+
+    jobsrun = 0
+
+    while True:
+        queue.reap()
+        job, leasedname = queue.lease(worker)
+
+        if job is None:
+            if queue.drained():
+                break
+            if queue.counts()['leased'] == 0:
+                runnable, blocked = queue.waiting()
+                if len(runnable) == 0 and len(blocked) > 0:
+                    print('Nothing is running, and the jobs left are waiting on jobs that will never be done:')
+                    for jobid in sorted(blocked):
+                        print('    ' + jobid + ' requires ' + ', '.join(blocked[jobid]))
+                    print('See jobqueue.py status.')
+                    break
+            time.sleep(poll)
+            # Jobs are leased elsewhere, or waiting on jobs that are;
+            # they may still come back to us.
+            continue
+
+        print()
+        print('Job ' + job['id'] + ' (attempt ' + str(job['attempts'] + 1) + ')')
+
+        heartbeat = Heartbeat(queue, leasedname, queue.leasetime / 4)
+        heartbeat.start()
+        started = time.time()
+
+        try:
+            handlers[job['kind']](*job['args'])
+            error = None
+        except Exception:
+            error = traceback.format_exc()
+            print(error)
+        finally:
+            heartbeat.stop()
+
+        try:
+            if error is None:
+                queue.complete(leasedname, time.time() - started)
+                jobsrun += 1
+            else:
+                queue.release(leasedname, error)
+        except LostLease:
+            print('Lost the lease on ' + job['id'] + '; it has been given to another worker.')
+
+    print('Queue drained; ' + worker + ' ran ' + str(jobsrun) + ' jobs.')
+    return jobsrun
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Inspect a job queue on a shared filesystem.')
+    parser.add_argument('command', choices = ['status', 'retry', 'reap'])
+    parser.add_argument('queuefolder')
+    args = parser.parse_args()
+
+    queue = JobQueue(args.queuefolder)
+
+    if args.command == 'status':
+        queue.status()
+    elif args.command == 'retry':
+        print(str(queue.retry_failed()) + ' failed jobs put back in the queue.')
+    elif args.command == 'reap':
+        print(str(queue.reap()) + ' expired leases reaped.')
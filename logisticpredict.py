@@ -92,7 +92,6 @@ import numpy as np
 import pandas as pd
 import csv, os, random, sys, datetime
 from collections import Counter
-from multiprocessing import Pool
 from sklearn.linear_model import LogisticRegression
 # from scipy.stats import norm
 import matplotlib.pyplot as plt
@@ -100,6 +99,9 @@ import matplotlib.pyplot as plt
 import modelingprocess
 import metafilter
 import metautils
+import poolprofile
+import volumeio
+import workerpool
 
 usedate = False
 # Leave this flag false unless you plan major
@@ -356,22 +358,19 @@ def make_vocablist(volspresent, n, vocabpath):
     to vocabpath.
     '''
 
-    sourcepaths = [x[1] for x in volspresent]
     # volspresent is a list of id, path 2-tuples created by get_volume_lists
 
     wordcounts = Counter()
+    malformed = dict()
 
-    for path in sourcepaths:
+    for volid, path in volspresent:
 
-        with open(path, encoding = 'utf-8') as f:
-            for line in f:
-                fields = line.strip().split('\t')
-                if len(fields) > 2 or len(fields) < 2:
-                    continue
-                word = fields[0]
-                if len(word) > 0 and word[0].isalpha():
-                    count = int(fields[1])
-                    wordcounts[word] += 1
+        words, counts, malformed[volid] = volumeio.read_counts(path)
+        for word in words.tolist():
+            if len(word) > 0 and word[0].isalpha():
+                wordcounts[word] += 1
+
+    volumeio.report_malformed(malformed)
 
     with open(vocabpath, mode = 'w', encoding = 'utf-8') as f:
         writer = csv.writer(f)
@@ -420,24 +419,22 @@ def get_docfrequency(volspresent, donttrainset):
     '''
 
     wordcounts = Counter()
+    malformed = dict()
 
     for volid, volpath in volspresent:
         if volid in donttrainset:
             continue
         else:
-            with open(volpath, encoding = 'utf-8') as f:
-                for line in f:
-                    fields = line.strip().split('\t')
-                    if len(fields) > 2 or len(fields) < 2:
-                        # this is a malformed line; there are a few of them,
-                        # but not enough to be important -- ignore
-                        continue
-                    word = fields[0]
-                    if len(word) > 0 and word[0].isalpha():
-                        wordcounts[word] += 1
-                        # We're getting docfrequency (the number of documents that
-                        # contain this word), not absolute number of word occurrences.
-                        # So just add 1 no matter how many times the word occurs.
+            words, counts, malformed[volid] = volumeio.read_counts(volpath)
+            # malformed lines are skipped and counted by volumeio
+            for word in words.tolist():
+                if len(word) > 0 and word[0].isalpha():
+                    wordcounts[word] += 1
+                    # We're getting docfrequency (the number of documents that
+                    # contain this word), not absolute number of word occurrences.
+                    # So just add 1 no matter how many times the word occurs.
+
+    volumeio.report_malformed(malformed)
 
     return wordcounts
 
@@ -478,12 +475,10 @@ def create_model(paths, exclusions, classifyconditions):
 
     for filename in allthefiles:
 
-        if filename.endswith(extension):
-            volID = filename.replace(extension, "")
-            # The volume ID is basically the filename minus its extension.
-            # Extensions are likely to be long enough that there is little
-            # danger of accidental occurrence inside a filename. E.g.
-            # '.fic.tsv'
+        volID = volumeio.volume_id(filename, extension)
+        if volID is not None:
+            # The volume ID is basically the filename minus its extension
+            # (and minus .gz, .bz2 or .zst, if the volume is compressed).
             path = sourcefolder + filename
             volumeIDs.append(volID)
             volumepaths.append(path)
@@ -552,7 +547,11 @@ def create_model(paths, exclusions, classifyconditions):
 
     # This list will include for ALL volumes, the indexes of vols in the donttrainset.
 
-    donttrainon = [orderedIDs.index(x) for x in donttrainset]
+    rowcodes = {anid: i for i, anid in enumerate(orderedIDs)}
+    # maps each volume ID to its position in orderedIDs, so we don't
+    # have to search the list every time we need a position
+
+    donttrainon = [rowcodes[x] for x in donttrainset]
 
     authormatches = [list(donttrainon) for x in range(len(orderedIDs))]
 
@@ -587,9 +586,9 @@ def create_model(paths, exclusions, classifyconditions):
             continue
 
         if thisclass == 1:
-            trainingpositives.add(orderedIDs.index(anid))
+            trainingpositives.add(rowcodes[anid])
         else:
-            trainingnegatives.add(orderedIDs.index(anid))
+            trainingnegatives.add(rowcodes[anid])
 
     print('Training positives: ' + str(len(trainingpositives)))
     print('Training negatives: ' + str(len(trainingnegatives)))
@@ -644,20 +643,11 @@ def create_model(paths, exclusions, classifyconditions):
     voldata = list()
     classvector = list()
 
-    for volid, volpath in volspresent:
+    malformed = dict()
 
-        with open(volpath, encoding = 'utf-8') as f:
-            voldict = dict()
-            totalcount = 0
-            for line in f:
-                fields = line.strip().split('\t')
-                if len(fields) > 2 or len(fields) < 2:
-                    continue
+    for volid, volpath in volspresent:
 
-                word = fields[0]
-                count = int(fields[1])
-                voldict[word] = count
-                totalcount += count
+        voldict, totalcount, malformed[volid] = volumeio.read_voldict(volpath)
 
         date = metautils.infer_date(metadict[volid], datetype)
         date = date - 1700
@@ -678,6 +668,8 @@ def create_model(paths, exclusions, classifyconditions):
         classflag = classdictionary[volid]
         classvector.append(classflag)
 
+    volumeio.report_malformed(malformed)
+
     data = pd.DataFrame(voldata)
 
     sextuplets = list()
@@ -689,12 +681,12 @@ def create_model(paths, exclusions, classifyconditions):
     # Now do leave-one-out predictions.
     print('Beginning multiprocessing.')
 
-    pool = Pool(processes = 11)
-    res = pool.map_async(modelingprocess.model_one_volume, sextuplets)
+    pool = workerpool.open_pool(rows = data.shape[0], features = data.shape[1], tasks = len(sextuplets))
+    res = pool.map_async(*poolprofile.wrap(modelingprocess.model_one_volume, sextuplets))
 
     # After all files are processed, write metadata, errorlog, and counts of phrases.
     res.wait()
-    resultlist = res.get()
+    resultlist = poolprofile.unwrap(res.get())
 
     assert len(resultlist) == len(orderedIDs)
 
@@ -7,6 +7,10 @@ import numpy as np
 import pandas as pd
 import versatiletrainer2
 import metaselector
+import batchtrainer
+import taskgraph
+import planner
+import workerpool
 
 import matplotlib.pyplot as plt
 
@@ -46,7 +50,7 @@ def divide_authdict(authdict, auths, ceiling, sizecap):
             part1.extend(part2[sizecap: ])
         return part1, part2
 
-def split_metadata(master, floor, ceiling, sizecap):
+def split_metadata(master, floor, ceiling, sizecap, suffix = ''):
     '''
     This function serves quixotic_dead_end() and should
     probably be moved closer to it. It selects a chronological
@@ -54,7 +58,10 @@ def split_metadata(master, floor, ceiling, sizecap):
     randomly into two partitions. Each partition is turned into
     two files: one that can be used for a model of SF vs
     mainstream lit, and one that can be used for a model of
-    fantasy vs mainstream lit.
+    fantasy vs mainstream lit. The docids in each file are also
+    returned, in a dictionary keyed by file name (sf1, sf2, fant1,
+    fant2). The files are named sf1 + suffix + '.csv' and so on, so
+    that splits for different periods don't overwrite each other.
     '''
 
     dateslice = master[(master.firstpub >= floor) & (master.firstpub <= ceiling)]
@@ -116,14 +123,23 @@ def split_metadata(master, floor, ceiling, sizecap):
     fant1 = master.loc[fantdocs1 + maindocs1]
     fant2 = master.loc[fantdocs2 + maindocs2]
 
-    sf1.to_csv('../temp/sf1.csv')
-    sf2.to_csv('../temp/sf2.csv')
-    fant1.to_csv('../temp/fant1.csv')
-    fant2.to_csv('../temp/fant2.csv')
+    sf1.to_csv('../temp/sf1' + suffix + '.csv')
+    sf2.to_csv('../temp/sf2' + suffix + '.csv')
+    fant1.to_csv('../temp/fant1' + suffix + '.csv')
+    fant2.to_csv('../temp/fant2' + suffix + '.csv')
+
+    partitions = dict()
+    partitions['sf1'] = sfdocs1 + maindocs1
+    partitions['sf2'] = sfdocs2 + maindocs2
+    partitions['fant1'] = fantdocs1 + maindocs1
+    partitions['fant2'] = fantdocs2 + maindocs2
+
+    return partitions
 
 def split_one_genre(master, floor, ceiling, positive_tags, genrename, sizecap):
     '''
-    This function serves reliable_change_comparisons().
+    This function serves reliable_change_comparisons(). Returns the
+    docids in each of the two partitions.
     '''
 
     dateslice = master[(master.firstpub >= floor) & (master.firstpub <= ceiling)]
@@ -160,15 +176,21 @@ def split_one_genre(master, floor, ceiling, positive_tags, genrename, sizecap):
     partition1.to_csv('../temp/' + genrename + '1.csv')
     partition2.to_csv('../temp/' + genrename + '2.csv')
 
+    return genredocs1 + maindocs1, genredocs2 + maindocs2
+
 def fantasy_periods():
     print('fantasy periods:')
 
+    plan = planner.Plan('../data/')
+    declare_fantasy_periods(plan)
+    plan.run()
+
+def declare_fantasy_periods(plan):
     if not os.path.isfile('../results/fantasy_nojuv_periods.tsv'):
         with open('../results/fantasy_nojuv_periods.tsv', mode = 'w', encoding = 'utf-8') as f:
             outline = 'name\tsize\tfloor\tceiling\tmeandate\taccuracy\tfeatures\tregularization\ti\n'
             f.write(outline)
 
-    sourcefolder = '../data/'
     metadatapath = '../metadata/mastermetadata.csv'
     tags4positive = {'fantasy_loc', 'fantasy_oclc'}
     tags4negative = {'random'}
@@ -176,37 +198,32 @@ def fantasy_periods():
 
     periods = [(1800, 1899), (1900, 1919), (1920, 1949), (1950, 1969), (1970, 1979), (1980, 1989), (1990, 1999), (2000, 2010)]
 
-    for excludebelow, excludeabove in periods:
-        for i in range (5):
-
-            name = 'fantasynojuv' + str(excludebelow) + 'to' + str(excludeabove) + 'v' + str(i)
-
-            vocabpath = '../lexica/' + name + '.txt'
-            metadatapath = ''
-
-            metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = versatiletrainer2.get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4negative, sizecap, excludebelow = excludebelow, excludeabove = excludeabove, forbid4positive = {'juv'}, forbid4negative = {'juv'}, force_even_distribution = False)
-
-            c_range = [.0003, .001, .006, .02, 0.1, 0.7, 3, 12]
-            featurestart = 1000
-            featureend = 6100
-            featurestep = 200
-            modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
+    c_range = [.0003, .001, .006, .02, 0.1, 0.7, 3, 12]
+    featurestart = 1000
+    featureend = 6100
+    featurestep = 200
+    modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
 
-            matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, tags4positive, tags4negative, modelparams, name, '../modeloutput/' + name + '.csv')
+    # Every window is trained in one batch: metadata and volumes are
+    # loaded once, and each window's instances are picked by date.
 
-            meandate = int(round(np.sum(metadata.firstpub) / len(metadata.firstpub)))
+    specs = batchtrainer.period_specs('fantasynojuv', periods, tags4positive, tags4negative, forbid4positive = {'juv'}, forbid4negative = {'juv'}, replicates = 5)
+    for spec in specs:
+        spec['vocabpath'] = '../lexica/' + spec['name'] + '.txt'
 
-            with open('../results/fantasy_nojuv_periods.tsv', mode = 'a', encoding = 'utf-8') as f:
-                outline = name + '\t' + str(sizecap) + '\t' + str(excludebelow) + '\t' + str(excludeabove) + '\t' + str(meandate) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\t' + str(i) + '\n'
-                f.write(outline)
+    plan.add_models(specs, metadatapath, modelparams, sizecap, force_even_distribution = False, callback = lambda spec, results: write_model_row(spec, results, sizecap, '../results/fantasy_nojuv_periods.tsv'))
 
 def sf_periods():
+    plan = planner.Plan('../data/')
+    declare_sf_periods(plan)
+    plan.run()
+
+def declare_sf_periods(plan):
     if not os.path.isfile('../results/sf_nojuv_periods.tsv'):
         with open('../results/sf_nojuv_periods.tsv', mode = 'w', encoding = 'utf-8') as f:
             outline = 'name\tsize\tfloor\tceiling\tmeandate\taccuracy\tfeatures\tregularization\ti\n'
             f.write(outline)
 
-    sourcefolder = '../data/'
     metadatapath = '../metadata/mastermetadata.csv'
     tags4positive = {'sf_loc', 'sf_oclc'}
     tags4negative = {'random'}
@@ -214,28 +231,20 @@ def sf_periods():
 
     periods = [(1800, 1899), (1900, 1919), (1920, 1949), (1950, 1969), (1970, 1979), (1980, 1989), (1990, 1999), (2000, 2010)]
 
-    for excludebelow, excludeabove in periods:
-        for i in range (5):
-
-            name = 'sfnojuv' + str(excludebelow) + 'to' + str(excludeabove) + 'v' + str(i)
-
-            vocabpath = '../lexica/' + name + '.txt'
-
-            metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = versatiletrainer2.get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4negative, sizecap, excludebelow = excludebelow, excludeabove = excludeabove, forbid4positive = {'juv'}, forbid4negative = {'juv'})
-
-            c_range = [.0003, .001, .006, .02, 0.1, 0.7, 3, 12]
-            featurestart = 1000
-            featureend = 6100
-            featurestep = 200
-            modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
+    c_range = [.0003, .001, .006, .02, 0.1, 0.7, 3, 12]
+    featurestart = 1000
+    featureend = 6100
+    featurestep = 200
+    modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
 
-            matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, tags4positive, tags4negative, modelparams, name, '../modeloutput/' + name + '.csv')
+    # Every window is trained in one batch: metadata and volumes are
+    # loaded once, and each window's instances are picked by date.
 
-            meandate = int(round(np.sum(metadata.firstpub) / len(metadata.firstpub)))
+    specs = batchtrainer.period_specs('sfnojuv', periods, tags4positive, tags4negative, forbid4positive = {'juv'}, forbid4negative = {'juv'}, replicates = 5)
+    for spec in specs:
+        spec['vocabpath'] = '../lexica/' + spec['name'] + '.txt'
 
-            with open('../results/sf_nojuv_periods.tsv', mode = 'a', encoding = 'utf-8') as f:
-                outline = name + '\t' + str(sizecap) + '\t' + str(excludebelow) + '\t' + str(excludeabove) + '\t' + str(meandate) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\t' + str(i) + '\n'
-                f.write(outline)
+    plan.add_models(specs, metadatapath, modelparams, sizecap, callback = lambda spec, results: write_model_row(spec, results, sizecap, '../results/sf_nojuv_periods.tsv'))
 
 def accuracy(df, column):
     totalcount = len(df.realclass)
@@ -262,6 +271,29 @@ def write_a_row(r, outfile, columns):
         scribe = csv.DictWriter(f, fieldnames = columns, delimiter = '\t')
         scribe.writerow(r)
 
+def write_model_row(spec, results, sizecap, outmodels):
+    '''
+    Appends a line about a model trained from a spec (with 'floor',
+    'ceiling' and 'replicate') to outmodels.
+    '''
+
+    matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = results
+
+    meandate = int(round(np.sum(metadata.firstpub) / len(metadata.firstpub)))
+
+    with open(outmodels, mode = 'a', encoding = 'utf-8') as f:
+        outline = spec['name'] + '\t' + str(sizecap) + '\t' + str(spec['floor']) + '\t' + str(spec['ceiling']) + '\t' + str(meandate) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\t' + str(spec['replicate']) + '\n'
+        f.write(outline)
+
+def write_divergence(r, divergence, outcomparisons, columns):
+    '''
+    Adds what get_divergence() returned for r['name1'] and r['name2']
+    to the row r, and appends it to outcomparisons.
+    '''
+
+    r['spearman'], r['loss'], r['spear1on2'], r['spear2on1'], r['loss1on2'], r['loss2on1'], r['acc1'], r['acc2'], r['alienacc1'], r['alienacc2'], r['meandate1'], r['meandate2'] = divergence
+    write_a_row(r, outcomparisons, columns)
+
 def sf2fantasy_divergence():
 
     columns = ['testype', 'name1', 'name2', 'acc1', 'acc2', 'spearman', 'spear1on2', 'spear2on1', 'loss', 'loss1on2', 'loss2on1', 'meandate', 'ceiling', 'floor']
@@ -428,6 +460,11 @@ def sf_vs_fantasy_periods():
                 f.write(outline)
 
 def reliable_genre_comparisons():
+    plan = planner.Plan('../data/')
+    declare_reliable_genre_comparisons(plan)
+    plan.run()
+
+def declare_reliable_genre_comparisons(plan):
     '''
     Trying to get around contamination of my spearman comparisons
     by comparing only models *with no shared instances*.
@@ -450,7 +487,6 @@ def reliable_genre_comparisons():
             outline = 'name\tsize\tfloor\tceiling\tmeandate\taccuracy\tfeatures\tregularization\ti\n'
             f.write(outline)
 
-    sourcefolder = '../data/'
     sizecap = 72
 
     c_range = [.00001, .0001, .001, .01, 0.1, 1, 10, 100]
@@ -465,16 +501,21 @@ def reliable_genre_comparisons():
 
     # endpoints both inclusive
 
+    specs = []
+
     for i in range(15):
         for floor, ceiling in periods:
 
-            split_metadata(master, floor, ceiling, sizecap)
+            partitions = split_metadata(master, floor, ceiling, sizecap, suffix = str(ceiling) + '_' + str(i))
+
+            # That function just above does the real work of preventing leakage,
+            # by splitting the genre into two disjoint sets. This allows self-
+            # comparisons that avoid shared authors, and are thus strictly
+            # comparable to cross-comparisons.
 
             metaoptions = ['sf1', 'sf2', 'fant1', 'fant2']
 
             for m in metaoptions:
-                metadatapath = '../temp/' + m + '.csv'
-                vocabpath = '../lexica/' + m + '.txt'
                 name = 'temp_' + m + str(ceiling) + '_' + str(i)
 
                 if m == 'sf1' or m == 'sf2':
@@ -484,60 +525,38 @@ def reliable_genre_comparisons():
 
                 tags4negative = {'random', 'randomB'}
 
-                metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = versatiletrainer2.get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4negative, sizecap, excludebelow = floor, excludeabove = ceiling, forbid4positive = {'juv'}, forbid4negative = {'juv'}, force_even_distribution = False, numfeatures = 6500, forbiddenwords = forbiddenwords)
-
-                matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, tags4positive, tags4negative, modelparams, name, '../modeloutput/' + name + '.csv')
-
-                meandate = int(round(np.sum(metadata.firstpub) / len(metadata.firstpub)))
+                specs.append({'name': name, 'tags4positive': tags4positive, 'tags4negative': tags4negative, 'forbid4positive': {'juv'}, 'forbid4negative': {'juv'}, 'floor': floor, 'ceiling': ceiling, 'docids': partitions[m], 'replicate': i})
 
-                with open(outmodels, mode = 'a', encoding = 'utf-8') as f:
-                    outline = name + '\t' + str(sizecap) + '\t' + str(floor) + '\t' + str(ceiling) + '\t' + str(meandate) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\t' + str(i) + '\n'
-                    f.write(outline)
+    # Models are trained several at a time, and each comparison runs as
+    # soon as its two models exist (see planner.py).
 
-                os.remove(vocabpath)
+    plan.add_models(specs, '../metadata/mastermetadata.csv', modelparams, sizecap, force_even_distribution = False, numfeatures = 6500, forbiddenwords = forbiddenwords, callback = lambda spec, results: write_model_row(spec, results, sizecap, outmodels))
 
-            r = dict()
-            r['testype'] = 'sfself'
-            r['ceiling'] = ceiling
-            r['floor'] = floor
-            r['name1'] = 'temp_sf1' + str(ceiling) + '_' + str(i)
-            r['name2'] = 'temp_sf2' + str(ceiling) + '_' + str(i)
-            r['spearman'], r['loss'], r['spear1on2'], r['spear2on1'], r['loss1on2'], r['loss2on1'], r['acc1'], r['acc2'], r['alienacc1'], r['alienacc2'], r['meandate1'], r['meandate2'] = get_divergence(r['name1'], r['name2'])
-            write_a_row(r, outcomparisons, columns)
+    comparisons = [('sfself', 'sf1', 'sf2'), ('fantasyself', 'fant1', 'fant2'), ('cross', 'sf1', 'fant2'), ('cross', 'sf2', 'fant1')]
 
-            r = dict()
-            r['testype'] = 'fantasyself'
-            r['ceiling'] = ceiling
-            r['floor'] = floor
-            r['name1'] = 'temp_fant1' + str(ceiling) + '_' + str(i)
-            r['name2'] = 'temp_fant2' + str(ceiling) + '_' + str(i)
-            r['spearman'], r['loss'], r['spear1on2'], r['spear2on1'], r['loss1on2'], r['loss2on1'], r['acc1'], r['acc2'], r['alienacc1'], r['alienacc2'], r['meandate1'], r['meandate2'] = get_divergence(r['name1'], r['name2'])
-            write_a_row(r, outcomparisons, columns)
+    for i in range(15):
+        for floor, ceiling in periods:
+            for testype, m1, m2 in comparisons:
 
-            r = dict()
-            r['testype'] = 'cross'
-            r['ceiling'] = ceiling
-            r['floor'] = floor
-            r['name1'] = 'temp_sf1' + str(ceiling) + '_' + str(i)
-            r['name2'] = 'temp_fant2' + str(ceiling) + '_' + str(i)
-            r['spearman'], r['loss'], r['spear1on2'], r['spear2on1'], r['loss1on2'], r['loss2on1'], r['acc1'], r['acc2'], r['alienacc1'], r['alienacc2'], r['meandate1'], r['meandate2'] = get_divergence(r['name1'], r['name2'])
-            write_a_row(r, outcomparisons, columns)
+                r = dict()
+                r['testype'] = testype
+                r['ceiling'] = ceiling
+                r['floor'] = floor
+                r['name1'] = 'temp_' + m1 + str(ceiling) + '_' + str(i)
+                r['name2'] = 'temp_' + m2 + str(ceiling) + '_' + str(i)
 
-            r = dict()
-            r['testype'] = 'cross'
-            r['ceiling'] = ceiling
-            r['floor'] = floor
-            r['name1'] = 'temp_sf2' + str(ceiling) + '_' + str(i)
-            r['name2'] = 'temp_fant1' + str(ceiling) + '_' + str(i)
-            r['spearman'], r['loss'], r['spear1on2'], r['spear2on1'], r['loss1on2'], r['loss2on1'], r['acc1'], r['acc2'], r['alienacc1'], r['alienacc2'], r['meandate1'], r['meandate2'] = get_divergence(r['name1'], r['name2'])
-            write_a_row(r, outcomparisons, columns)
+                plan.add_comparison(r['name1'], r['name2'], get_divergence, swap = swap_divergence, callback = lambda divergence, r = r: write_divergence(r, divergence, outcomparisons, columns))
 
-def reliable_change_comparisons():
+def reliable_change_comparisons(cores = None):
     '''
     Using the same method in the previous function, but to assess
-    change in SF.
+    change in SF. The models are trained on a task graph with a budget
+    of cores, by default workerpool.available_cores().
     '''
 
+    if cores is None:
+        cores = workerpool.available_cores()
+
     outmodels = '../results/change_models.tsv'
     outcomparisons = '../results/change_comparisons.tsv'
     columns = ['testype', 'name1', 'name2', 'ceiling1', 'floor1', 'ceiling2', 'floor2', 'meandate1', 'meandate2', 'acc1', 'acc2', 'alienacc1', 'alienacc2', 'spearman', 'spear1on2', 'spear2on1', 'loss', 'loss1on2', 'loss2on1']
@@ -567,36 +586,29 @@ def reliable_change_comparisons():
 
     # endpoints both inclusive
 
+    specs = []
+
     for i in range(5):
         for floor, ceiling in periods:
 
             namestart = 'rccsf'+ str(floor) + '_' + str(ceiling) + '_' + str(i) + '_'
 
-            split_one_genre(master, floor, ceiling, {'sf_loc', 'sf_oclc', 'sf_bailey'}, namestart, sizecap)
-
-            names = []
+            partitions = split_one_genre(master, floor, ceiling, {'sf_loc', 'sf_oclc', 'sf_bailey'}, namestart, sizecap)
 
-            for partition in ['1', '2']:
+            for partition, docids in zip(['1', '2'], partitions):
                 name = namestart + partition
-                names.append(name)
-
-                metadatapath = '../temp/' + name + '.csv'
-                vocabpath = '../lexica/' + name + '.txt'
 
                 tags4positive = {'sf_loc', 'sf_oclc', 'sf_bailey'}
                 tags4negative = {'random', 'randomB'}
 
-                metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = versatiletrainer2.get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4negative, sizecap, excludebelow = floor, excludeabove = ceiling, forbid4positive = {'juv'}, forbid4negative = {'juv'}, force_even_distribution = False, numfeatures = 6500, forbiddenwords = forbiddenwords)
-
-                matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, tags4positive, tags4negative, modelparams, name, '../modeloutput/' + name + '.csv')
+                specs.append({'name': name, 'tags4positive': tags4positive, 'tags4negative': tags4negative, 'forbid4positive': {'juv'}, 'forbid4negative': {'juv'}, 'floor': floor, 'ceiling': ceiling, 'docids': docids, 'replicate': i})
 
-                meandate = int(round(np.sum(metadata.firstpub) / len(metadata.firstpub)))
+    index = batchtrainer.CorpusIndex(sourcefolder, '../metadata/mastermetadata.csv')
+    graph = taskgraph.TaskGraph(cores = cores)
 
-                with open(outmodels, mode = 'a', encoding = 'utf-8') as f:
-                    outline = name + '\t' + str(sizecap) + '\t' + str(floor) + '\t' + str(ceiling) + '\t' + str(meandate) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\t' + str(i) + '\n'
-                    f.write(outline)
+    batchtrainer.graph_specs(graph, index, specs, modelparams, '../modeloutput/', sizecap, force_even_distribution = False, numfeatures = 6500, forbiddenwords = forbiddenwords, processes = 4, callback = lambda spec, results: write_model_row(spec, results, sizecap, outmodels))
 
-                os.remove(vocabpath)
+    graph.run()
 
 def cross_reliable_change():
 
@@ -1487,6 +1499,16 @@ def get_divergence(sampleA, sampleB):
 
     return spearman, loss, spearman1on2, spearman2on1, loss1on2, loss2on1, acc1, acc2, alienacc1, alienacc2, meandate1, meandate2
 
+def swap_divergence(divergence):
+    '''
+    Turns what get_divergence(A, B) returns into what get_divergence(B, A)
+    would return.
+    '''
+
+    spearman, loss, spearman1on2, spearman2on1, loss1on2, loss2on1, acc1, acc2, alienacc1, alienacc2, meandate1, meandate2 = divergence
+
+    return spearman, loss, spearman2on1, spearman1on2, loss2on1, loss1on2, acc2, acc1, alienacc2, alienacc1, meandate2, meandate1
+
 def scarborough_to_detective():
     outmodels = '../results/scarborough2detective_models.tsv'
     outcomparisons = '../results/scarborough2detective_comparisons.tsv'
@@ -1685,5 +1707,14 @@ elif command == 'bailey_fantasy':
     baileytofantasy19c()
 elif command == 'scarborough_sf':
     scarborough_to_19cSF()
+elif command == 'plan':
+    # Runs several experiments together, training each distinct model
+    # and making each distinct comparison once, e.g.
+    # python3 main_experiment.py plan fantasy_periods sf_periods
+    declarations = {'fantasy_periods': declare_fantasy_periods, 'sf_periods': declare_sf_periods, 'reliable_genre_comparisons': declare_reliable_genre_comparisons}
+    plan = planner.Plan('../data/')
+    for experiment in sys.argv[2:]:
+        declarations[experiment](plan)
+    plan.run()
 
 
@@ -21,6 +21,10 @@
 # of a variety of systems. This returns a list of
 # IDstouse and a classdictionary.
 
+# Every selector makes its random choices with rng, which is
+# the random module unless you pass a seeded random.Random();
+# that way a selection can be reproduced exactly.
+
 import random, math
 import pandas as pd
 import numpy as np
@@ -70,7 +74,10 @@ def load_metadata(metapath, docidsindata, excludebelow, excludeabove, indexcol =
 
     initialrowct = metadata.shape[0]
     docidsindata = set(metadata.index) & set(docidsindata)
-    metadata = metadata.loc[docidsindata]
+    metadata = metadata.loc[sorted(docidsindata)]
+    # Sorted, because the order of a set changes from one process to
+    # the next (with PYTHONHASHSEED), and seeded selections sample from
+    # lists built in row order.
     filteredrowct = metadata.shape[0]
 
     if initialrowct != filteredrowct:
@@ -97,7 +104,7 @@ def load_metadata(metapath, docidsindata, excludebelow, excludeabove, indexcol =
 
     return metadata
 
-def match_negatives(metadata, positives, allnegatives):
+def match_negatives(metadata, positives, allnegatives, rng = random):
     '''
     A selection strategy that attempts to closely match the
     dates of positive and negative instances.
@@ -105,7 +112,7 @@ def match_negatives(metadata, positives, allnegatives):
 
     print('MATCHING DATES')
 
-    random.shuffle(allnegatives)
+    rng.shuffle(allnegatives)
 
     negatives = []
 
@@ -133,14 +140,14 @@ def match_negatives(metadata, positives, allnegatives):
 
         contestants = [x[1] for x in tuplelist[0 : k]]
 
-        choice = random.sample(contestants, 1)[0]
+        choice = rng.sample(contestants, 1)[0]
 
         allnegatives.pop(allnegatives.index(choice))
         negatives.append(choice)
 
     return negatives
 
-def force_even(allpositives, allnegatives, metadata, sizecap, k):
+def force_even(allpositives, allnegatives, metadata, sizecap, k, rng = random):
     '''
     The title of this function is a slight misnomer, because we can rarely
     get really even distribution across the timeline. What we can do is
@@ -203,13 +210,13 @@ def force_even(allpositives, allnegatives, metadata, sizecap, k):
     negatives = []
 
     for pslice, nslice, limit in zip(pos_slices, neg_slices, limitlist):
-        positives.extend(random.sample(pslice, limit))
-        negatives.extend(random.sample(nslice, limit))
+        positives.extend(rng.sample(pslice, limit))
+        negatives.extend(rng.sample(nslice, limit))
 
     return positives, negatives
 
 
-def select_instances(metadata, sizecap, tags4positive, tags4negative, forbid4positive = set(), forbid4negative = set(), negative_strategy = 'random', overlap_strategy = 'random', force_even_distribution = False):
+def select_instances(metadata, sizecap, tags4positive, tags4negative, forbid4positive = set(), forbid4negative = set(), negative_strategy = 'random', overlap_strategy = 'random', force_even_distribution = False, rng = random):
 
     '''Selects instances of the positive class and negative class, trying to
     hit sizecap,but not allowing imbalanced classes. For both positive and
@@ -262,7 +269,7 @@ def select_instances(metadata, sizecap, tags4positive, tags4negative, forbid4pos
     # class. Exclude it, or assign it randomly to both.
 
     if overlap_strategy == 'random':
-        random.shuffle(overlap)
+        rng.shuffle(overlap)
         print('Length of overlap: ' + str(len(overlap)))
         print('Overlap is randomly distributed between classes!')
         split = len(overlap) // 2
@@ -281,7 +288,7 @@ def select_instances(metadata, sizecap, tags4positive, tags4negative, forbid4pos
     # to be evenly distributed.
 
     if force_even_distribution:
-        positives, negatives = force_even(allpositives, allnegatives, pd.DataFrame(metadata), sizecap, k = 7)
+        positives, negatives = force_even(allpositives, allnegatives, pd.DataFrame(metadata), sizecap, k = 7, rng = rng)
         # where k is the number of slices to make
         # notice that we make a clean copy of the metadata
 
@@ -299,18 +306,18 @@ def select_instances(metadata, sizecap, tags4positive, tags4negative, forbid4pos
         print(str(numnegative) + ' potential negative instances. Choosing only')
         print(str(numinstances) + ' of each class.')
         # we randomly sample positive instances
-        positives = random.sample(allpositives, numinstances)
+        positives = rng.sample(allpositives, numinstances)
 
         # Now there are two different ways to select
         # negative instances. If it's just random, that's simple
 
         if negative_strategy == 'random':
-            negatives = random.sample(allnegatives, numinstances)
+            negatives = rng.sample(allnegatives, numinstances)
 
         # but we can also closely match dates
 
         else:
-            negatives = match_negatives(metadata, positives, allnegatives)
+            negatives = match_negatives(metadata, positives, allnegatives, rng = rng)
 
     orderedIDs = []
     classdictionary = dict()
@@ -327,7 +334,79 @@ def select_instances(metadata, sizecap, tags4positive, tags4negative, forbid4pos
 
     return orderedIDs, classdictionary
 
-def set_positive_ratio(metadata, sizecap, tags4positive1, tags4positive2, ratio, tags4negative):
+def select_multiclass(metadata, sizecap, genres, tags4negative, negative_strategy = 'random', overlap_strategy = 'random', rng = random):
+
+    '''Selects instances for a single model of several genres at once,
+    rather than a binary model of each genre against the same contrast.
+    We take up to sizecap volumes for each genre in the list genres, and
+    as many volumes from tags4negative as the largest genre gets.
+
+    Classes are numbered: 0 is the negative (contrast) class, and
+    genres[i] is class i + 1. A volume carrying several of the genres
+    is assigned to one of them at random, or with any other
+    overlap_strategy, left out. Volumes carrying any of the genres
+    are never used as negatives.'''
+
+    if isinstance(genres, (set, frozenset)):
+        genres = sorted(genres)
+    else:
+        genres = list(genres)
+    candidates = dict()
+    for g in genres:
+        candidates[g] = []
+
+    allnegatives = []
+    overlap = 0
+
+    for idx, row in metadata.iterrows():
+        mygenres = [g for g in genres if g in row['tagset']]
+
+        if len(mygenres) == 1:
+            candidates[mygenres[0]].append(idx)
+
+        elif len(mygenres) > 1:
+            overlap += 1
+            if overlap_strategy == 'random':
+                candidates[rng.choice(mygenres)].append(idx)
+
+        elif len(row['tagset'] & tags4negative) > 0:
+            allnegatives.append(idx)
+
+    print('Volumes in more than one genre: ' + str(overlap))
+
+    orderedIDs = []
+    classdictionary = dict()
+    allpositives = []
+
+    for classnumber, g in enumerate(genres, 1):
+        numinstances = min(sizecap, len(candidates[g]))
+        print(g + ': ' + str(len(candidates[g])) + ' potential instances; choosing ' + str(numinstances) + '.')
+        positives = rng.sample(candidates[g], numinstances)
+        allpositives.extend(positives)
+
+        for anid in positives:
+            orderedIDs.append(anid)
+            classdictionary[anid] = classnumber
+
+    largest = max([min(sizecap, len(candidates[g])) for g in genres])
+    numnegative = min(largest, len(allnegatives))
+    print('Negative instances: ' + str(len(allnegatives)) + ' potential; choosing ' + str(numnegative) + '.')
+
+    if negative_strategy == 'random':
+        negatives = rng.sample(allnegatives, numnegative)
+    else:
+        negatives = match_negatives(metadata, rng.sample(allpositives, numnegative), allnegatives, rng = rng)
+        # matching the dates of a sample of all the positive instances
+
+    for anid in negatives:
+        orderedIDs.append(anid)
+        classdictionary[anid] = 0
+
+    print('Instances chosen.')
+
+    return orderedIDs, classdictionary
+
+def set_positive_ratio(metadata, sizecap, tags4positive1, tags4positive2, ratio, tags4negative, rng = random):
 
     '''An experimental function that allows the user to adjust the balance of two different
     positive classes. The classes are treated as exclusive.'''
@@ -358,10 +437,10 @@ def set_positive_ratio(metadata, sizecap, tags4positive1, tags4positive2, ratio,
     positive2ct = int(sizecap - positive1ct)
 
     # we randomly sample positive instances
-    positives = random.sample(allpositive1, positive1ct)
-    positives.extend(random.sample(allpositive2, positive2ct))
+    positives = rng.sample(allpositive1, positive1ct)
+    positives.extend(rng.sample(allpositive2, positive2ct))
 
-    negatives = random.sample(allnegatives, sizecap)
+    negatives = rng.sample(allnegatives, sizecap)
 
     orderedIDs = []
     classdictionary = dict()
@@ -378,7 +457,7 @@ def set_positive_ratio(metadata, sizecap, tags4positive1, tags4positive2, ratio,
 
     return orderedIDs, classdictionary
 
-def dilute_positive_class(metadata, sizecap, tags4positive, tags4negative, ratio):
+def dilute_positive_class(metadata, sizecap, tags4positive, tags4negative, ratio, rng = random):
 
     '''An experimental function that allows the user to dilute the positive class with negative examples in a fixed ratio, blurring the model.'''
 
@@ -404,9 +483,9 @@ def dilute_positive_class(metadata, sizecap, tags4positive, tags4negative, ratio
 
     # we randomly sample positive instances
 
-    real_positives = random.sample(allpositives, real_positive_ct)
+    real_positives = rng.sample(allpositives, real_positive_ct)
 
-    dilution = random.sample(allnegatives, dilution_ct)
+    dilution = rng.sample(allnegatives, dilution_ct)
 
     for d in dilution:
         allnegatives.pop(allnegatives.index(d))
@@ -415,7 +494,7 @@ def dilute_positive_class(metadata, sizecap, tags4positive, tags4negative, ratio
 
     real_positives.extend(dilution)
 
-    negatives = random.sample(allnegatives, sizecap)
+    negatives = rng.sample(allnegatives, sizecap)
 
     orderedIDs = []
     classdictionary = dict()
@@ -7,6 +7,8 @@ import numpy as np
 import pandas as pd
 import versatiletrainer2
 import metaselector
+import volumeio
+import batchtrainer
 
 import matplotlib.pyplot as plt
 
@@ -58,18 +60,8 @@ def get_ratio_data(vocabpath, sizecap, ratio, tags4positive, tags4negative, excl
     metadatapath = '../metadata/mastermetadata.csv'
 
     # Get a list of files.
-    allthefiles = os.listdir(sourcefolder)
-
-    volumeIDsinfolder = list()
-    volumepaths = list()
-    numchars2trim = len(extension)
-
-    for filename in allthefiles:
-
-        if filename.endswith(extension):
-            volID = filename[0 : -numchars2trim]
-            # The volume ID is basically the filename minus its extension.
-            volumeIDsinfolder.append(volID)
+    volumesinfolder = volumeio.list_volumes(sourcefolder, extension)
+    volumeIDsinfolder = list(volumesinfolder.keys())
 
     metadata = metaselector.load_metadata(metadatapath, volumeIDsinfolder, excludebelow, excludeabove, indexcol = indexcol, datecols = datecols, genrecol = genrecol)
 
@@ -86,36 +78,32 @@ def get_ratio_data(vocabpath, sizecap, ratio, tags4positive, tags4negative, excl
 
     # We now create an ordered list of id-path tuples.
 
-    volspresent = [(x, sourcefolder + x + extension) for x in orderedIDs]
+    volspresent = [(x, volumesinfolder[x]) for x in orderedIDs]
     print(len(volspresent))
 
     print('Building vocabulary.')
 
-    vocablist = versatiletrainer2.get_vocablist(vocabpath, volspresent, n = numfeatures)
+    vocablist = versatiletrainer2.get_vocablist(vocabpath, volspresent, n = numfeatures, forbidden = set())
 
     numfeatures = len(vocablist)
 
     print()
     print("Number of features: " + str(numfeatures))
 
+    masterdata, classvector, failed = versatiletrainer2.get_dataframe(volspresent, classdictionary, vocablist, freqs_already_normalized)
+
+    if len(failed) > 0:
+        orderedIDs = [x for x in orderedIDs if x not in failed]
+        metadata = metadata.loc[orderedIDs]
+        for volid in failed:
+            del classdictionary[volid]
+
     # For each volume, we're going to create a list of volumes that should be
     # excluded from the training set when it is to be predicted. More precisely,
     # we're going to create a list of their *indexes*, so that we can easily
     # remove rows from the training matrix.
 
-    authormatches = [ [] for x in orderedIDs]
-
-    # Now we proceed to enlarge that list by identifying, for each volume,
-    # a set of indexes that have the same author. Obvs, there will always be at least one.
-    # We exclude a vol from it's own training set.
-
-    if holdout_authors:
-        for idx1, anid in enumerate(orderedIDs):
-            thisauthor = metadata.loc[anid, 'author']
-            authormatches[idx1] = list(np.flatnonzero(metadata['author'] == thisauthor))
-
-    for alist in authormatches:
-        alist.sort(reverse = True)
+    authormatches = versatiletrainer2.match_authors(metadata, holdout_authors)
 
     print()
     print('Authors matched.')
@@ -125,122 +113,85 @@ def get_ratio_data(vocabpath, sizecap, ratio, tags4positive, tags4negative, excl
     # back to front, without changing indexes yet to be deleted.
     # This will become important in the modelingprocess module.
 
-    masterdata, classvector = versatiletrainer2.get_dataframe(volspresent, classdictionary, vocablist, freqs_already_normalized)
-
     return metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist
 
-def vary_sf_ratio_against_random():
+def ratio_sweep(specs, modelparams, numfeatures = 8000):
+    '''
+    Trains a model for every point of a sweep (see batchtrainer.ratio_specs),
+    appending a row for each to ../measuredivergence/modeldata.tsv. All the
+    points share one load of metadata, one pass through the volumes they
+    need, and one pool of workers; points already in modeloutput/ are
+    skipped.
+    '''
+
     if not os.path.isfile('../measuredivergence/modeldata.tsv'):
         with open('../measuredivergence/modeldata.tsv', mode = 'w', encoding = 'utf-8') as f:
             outline = 'name\tsize\tratio\taccuracy\tfeatures\tregularization\n'
             f.write(outline)
 
-    size = 80
-
-    for iteration in [5, 6, 7]:
-
-        ceiling = 105
-        if iteration == 7:
-            ceiling = 5
+    for spec in specs:
+        spec['vocabpath'] = '../measuredivergence/vocabularies/' + spec['name'] + '.txt'
 
-        for pct in range(0, ceiling, 5):
-            ratio = pct / 100
-            name = 'iter' + str(iteration) + '_size' + str(size) + '_ratio' + str(pct)
+    index = batchtrainer.CorpusIndex('../data/', '../metadata/mastermetadata.csv', excludebelow = 0, excludeabove = 3000)
 
-            vocabpath = '../measuredivergence/vocabularies/' + name + '.txt'
-            tags4positive = {'sf_loc', 'sf_oclc'}
-            tags4negative = {'random'}
+    for spec, results in batchtrainer.train_specs(index, specs, modelparams, '../measuredivergence/modeloutput/', 80, numfeatures = numfeatures, write_fullmodel = False):
+        # It's important not to write fullmodel if you want the csvs
+        # to accurately reflect terrible accuracy on diluted datasets.
+        # write_fullmodel = False forces crossvalidation.
 
-            metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = get_ratio_data(vocabpath, size, ratio, tags4positive, tags4negative, excludebelow = 0, excludeabove = 3000)
+        matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = results
 
-            c_range = [.00005, .0003, .001, .004, .012, 0.2, 0.8]
-            featurestart = 1000
-            featureend = 6000
-            featurestep = 300
-            modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
-
-            matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, tags4positive, tags4negative, modelparams, name, '../measuredivergence/modeloutput/' + name + '.csv', write_fullmodel = False)
-            # It's important not to write fullmodel if you want the csvs
-            # to accurately reflect terrible accuracy on diluted datasets.
-            # write_fullmodel = False forces crossvalidation.
-
-            with open('../measuredivergence/modeldata.tsv', mode = 'a', encoding = 'utf-8') as f:
-                outline = name + '\t' + str(size) + '\t' + str(ratio) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\n'
-                f.write(outline)
-
-def vary_fantasy_ratio_against_sf():
-    if not os.path.isfile('../measuredivergence/modeldata.tsv'):
-        with open('../measuredivergence/modeldata.tsv', mode = 'w', encoding = 'utf-8') as f:
-            outline = 'name\tsize\tratio\taccuracy\tfeatures\tregularization\n'
+        with open('../measuredivergence/modeldata.tsv', mode = 'a', encoding = 'utf-8') as f:
+            outline = spec['name'] + '\t' + str(spec['sizecap']) + '\t' + str(spec['ratio']) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\n'
             f.write(outline)
 
-    size = 80
-
-    for iteration in [8, 9, 10]:
-
-        ceiling = 105
-        if iteration == 10:
-            ceiling = 5
-
-        for pct in range(0, ceiling, 5):
-            ratio = pct / 100
-            name = 'iter' + str(iteration) + '_size' + str(size) + '_ratio' + str(pct)
-
-            vocabpath = '../measuredivergence/vocabularies/' + name + '.txt'
-            tags4positive = {'fantasy_loc', 'fantasy_oclc'}
-            tags4negative = {'sf_loc', 'sf_oclc'}
+def vary_sf_ratio_against_random():
 
-            metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = get_ratio_data(vocabpath, size, ratio, tags4positive, tags4negative, excludebelow = 0, excludeabove = 3000)
+    tags4positive = {'sf_loc', 'sf_oclc'}
+    tags4negative = {'random'}
 
-            c_range = [.00005, .0003, .001, .004, .012, 0.2, 0.8, 3]
-            featurestart = 2000
-            featureend = 7500
-            featurestep = 400
-            modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
+    specs = batchtrainer.ratio_specs([5, 6], [80], range(0, 105, 5), tags4positive, tags4negative)
+    specs.extend(batchtrainer.ratio_specs([7], [80], [0], tags4positive, tags4negative))
 
-            matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, tags4positive, tags4negative, modelparams, name, '../measuredivergence/modeloutput/' + name + '.csv', write_fullmodel = False)
-            # write_fullmodel = False forces crossvalidation.
+    c_range = [.00005, .0003, .001, .004, .012, 0.2, 0.8]
+    featurestart = 1000
+    featureend = 6000
+    featurestep = 300
+    modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
 
-            with open('../measuredivergence/modeldata.tsv', mode = 'a', encoding = 'utf-8') as f:
-                outline = name + '\t' + str(size) + '\t' + str(ratio) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\n'
-                f.write(outline)
+    ratio_sweep(specs, modelparams)
 
-def vary_fantasy_ratio_against_random():
-    if not os.path.isfile('../measuredivergence/modeldata.tsv'):
-        with open('../measuredivergence/modeldata.tsv', mode = 'w', encoding = 'utf-8') as f:
-            outline = 'name\tsize\tratio\taccuracy\tfeatures\tregularization\n'
-            f.write(outline)
+def vary_fantasy_ratio_against_sf():
 
-    size = 80
+    tags4positive = {'fantasy_loc', 'fantasy_oclc'}
+    tags4negative = {'sf_loc', 'sf_oclc'}
 
-    for iteration in [11, 12, 13]:
+    specs = batchtrainer.ratio_specs([8, 9], [80], range(0, 105, 5), tags4positive, tags4negative)
+    specs.extend(batchtrainer.ratio_specs([10], [80], [0], tags4positive, tags4negative))
 
-        ceiling = 105
-        if iteration == 13:
-            ceiling = 5
+    c_range = [.00005, .0003, .001, .004, .012, 0.2, 0.8, 3]
+    featurestart = 2000
+    featureend = 7500
+    featurestep = 400
+    modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
 
-        for pct in range(0, ceiling, 5):
-            ratio = pct / 100
-            name = 'iter' + str(iteration) + '_size' + str(size) + '_ratio' + str(pct)
+    ratio_sweep(specs, modelparams)
 
-            vocabpath = '../measuredivergence/vocabularies/' + name + '.txt'
-            tags4positive = {'fantasy_loc', 'fantasy_oclc'}
-            tags4negative = {'random'}
+def vary_fantasy_ratio_against_random():
 
-            metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = get_ratio_data(vocabpath, size, ratio, tags4positive, tags4negative, excludebelow = 0, excludeabove = 3000)
+    tags4positive = {'fantasy_loc', 'fantasy_oclc'}
+    tags4negative = {'random'}
 
-            c_range = [.00005, .0003, .001, .004, .012, 0.2, 0.8, 3]
-            featurestart = 1600
-            featureend = 6400
-            featurestep = 400
-            modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
+    specs = batchtrainer.ratio_specs([11, 12], [80], range(0, 105, 5), tags4positive, tags4negative)
+    specs.extend(batchtrainer.ratio_specs([13], [80], [0], tags4positive, tags4negative))
 
-            matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, tags4positive, tags4negative, modelparams, name, '../measuredivergence/modeloutput/' + name + '.csv', write_fullmodel = False)
-            # write_fullmodel = False forces crossvalidation.
+    c_range = [.00005, .0003, .001, .004, .012, 0.2, 0.8, 3]
+    featurestart = 1600
+    featureend = 6400
+    featurestep = 400
+    modelparams = 'logistic', 16, featurestart, featureend, featurestep, c_range
 
-            with open('../measuredivergence/modeldata.tsv', mode = 'a', encoding = 'utf-8') as f:
-                outline = name + '\t' + str(size) + '\t' + str(ratio) + '\t' + str(maxaccuracy) + '\t' + str(features4max) + '\t' + str(best_regularization_coef) + '\n'
-                f.write(outline)
+    ratio_sweep(specs, modelparams)
 
 def accuracy(df, column):
     totalcount = len(df.realclass)
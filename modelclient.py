@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# modelclient.py
+#
+# Client functions for modelserver.py. Sparing scripts the cost of
+# importing pandas, sklearn and matplotlib is half the point of the
+# server, so this module needs nothing outside the standard library;
+# only apply_served_model() imports pandas, since it returns a
+# dataframe.
+#
+# score() returns probabilities[modelname][docid]; apply_served_model()
+# is a drop-in replacement for versatiletrainer2.apply_pickled_model().
+
+import http.client, json, os, socket
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, socketpath, timeout = 600):
+        super().__init__('localhost', timeout = timeout)
+        self.socketpath = socketpath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketpath)
+
+def request(address, path, payload = None):
+    '''
+    Sends a request to a running server. The address is either
+    'host:port' or the path to a Unix socket.
+    '''
+
+    if ':' in address and not os.path.exists(address):
+        host, port = address.rsplit(':', 1)
+        connection = http.client.HTTPConnection(host, int(port), timeout = 600)
+    else:
+        connection = UnixHTTPConnection(address)
+
+    try:
+        if payload is None:
+            connection.request('GET', path)
+        else:
+            body = json.dumps(payload).encode('utf-8')
+            connection.request('POST', path, body = body, headers = {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        result = json.loads(response.read().decode('utf-8'))
+    finally:
+        connection.close()
+
+    if response.status != 200:
+        raise RuntimeError('Model server error: ' + str(result.get('error')))
+
+    return result
+
+def score(address, docids = None, volumes = None, models = None, folder = None, extension = None):
+    '''
+    Asks the server for probabilities. Returns a dictionary of
+    dictionaries, probabilities[modelname][docid], and a list of
+    docids the server couldn't find.
+    '''
+
+    payload = dict()
+    for key, value in [('docids', docids), ('volumes', volumes), ('models', models), ('folder', folder), ('extension', extension)]:
+        if value is not None:
+            payload[key] = value
+
+    result = request(address, '/score', payload)
+
+    return result['probabilities'], result['missing']
+
+def apply_served_model(amodelpath, folder, extension, metapath, address = 'localhost:8765'):
+    '''
+    Does what versatiletrainer2.apply_pickled_model() does, but asks
+    a running server to do the work, loading the model there if it
+    isn't already resident. Returns the metadata with an
+    alien_model column, or for a multinomial model, a column
+    'alien_' + label for each class.
+    '''
+
+    import pandas as pd
+
+    modelname = request(address, '/load', {'paths': [os.path.abspath(amodelpath)]})['models'][0]
+
+    metadata = pd.read_csv(metapath)
+    metadata = metadata.set_index(['docid'])
+    metadata = metadata[~metadata.index.duplicated(keep='first')]
+
+    probabilities, missing = score(address, docids = [str(x) for x in metadata.index], models = [modelname], folder = os.path.abspath(folder), extension = extension)
+
+    for docid in missing:
+        print(os.path.join(folder, docid + extension))
+
+    modelprobabilities = probabilities[modelname]
+    if len(modelprobabilities) > 0 and isinstance(next(iter(modelprobabilities.values())), dict):
+        bylabel = pd.DataFrame.from_dict(modelprobabilities, orient = 'index')
+        for label in bylabel.columns:
+            metadata['alien_' + label] = bylabel[label]
+        return metadata
+
+    metadata['alien_model'] = pd.Series(modelprobabilities)
+
+    return metadata
@@ -2,12 +2,28 @@
 
 # modelingprocess.py
 
+import os, time
 import numpy as np
 import pandas as pd
-from sklearn.linear_model import LogisticRegression
-from sklearn import svm
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.svm import LinearSVC
+from sklearn.calibration import CalibratedClassifierCV
 from sklearn.preprocessing import StandardScaler
 
+import stagelog
+
+# versatiletrainer2 starts its pool of workers with init_shared(),
+# so that each worker holds the whole data matrix, class vector and
+# fold labels, and model_fold() tasks only need to say which fold
+# to hold out, how many features to use, and what C to use.
+#
+# A pool can also be shared by many models (see batchtrainer.py).
+# Then each model's arrays are saved to a folder with save_shared(),
+# and tasks carry the name of that folder; a worker memory-maps the
+# arrays the first time it sees a task for that model.
+
+shared = dict()
+
 def remove_zerocols(trainingset, testset):
     ''' Remove all columns that sum to zero in the trainingset.
     '''
@@ -121,17 +137,158 @@ def model_volume_list(data5tuple):
 
     return predictions
 
+def make_classifier(algorithm, regularization, numrows = None, random_state = None):
+    '''
+    Returns an unfitted model for an algorithm name.
+
+    'svm' is a linear SVM whose decision values are turned into
+    probabilities by a sigmoid (Platt) fit. We used to ask libsvm's
+    SVC(kernel = 'linear', probability = True) for this, but libsvm
+    calibrates with its own internal five-fold crossvalidation on a
+    kernel solver, so each fit was really six slow fits. Here the
+    SVM is liblinear's, and the sigmoid is fit once, on decision
+    values from three held-out folds of the training set; the final
+    SVM is then trained on the whole training set.
+
+    'sgd' is logistic regression trained by stochastic gradient
+    descent, which can learn from mini-batches (partial_fit) when the
+    training set is too big for memory. Its penalty is scaled so that
+    C means what it means for 'logistic': alpha = 1 / (C * numrows).
+    It shuffles each mini-batch with random_state.
+    '''
+
+    if algorithm == 'logistic':
+        return LogisticRegression(C = regularization)
+    elif algorithm == 'svm':
+        linearsvm = LinearSVC(C = regularization, dual = True, max_iter = 10000)
+        return CalibratedClassifierCV(linearsvm, method = 'sigmoid', cv = 3, ensemble = False)
+    elif algorithm == 'sgd':
+        return SGDClassifier(loss = 'log_loss', penalty = 'l2', alpha = 1 / (regularization * numrows), random_state = random_state)
+    else:
+        raise ValueError('Unknown algorithm: ' + str(algorithm))
+
+def model_coefficients(model, allclasses = False):
+    '''
+    The coefficients of a fitted linear model made by make_classifier().
+    With allclasses = True, returns the whole matrix of coefficients,
+    one row per class, for a model of more than two classes.
+    '''
+
+    if hasattr(model, 'coef_'):
+        coefficients = model.coef_
+    else:
+        calibrated = model.calibrated_classifiers_[0]
+        if hasattr(calibrated, 'estimator'):
+            coefficients = calibrated.estimator.coef_
+        else:
+            coefficients = calibrated.base_estimator.coef_
+            # the attribute's name in scikit-learn before 1.2
+
+    if allclasses:
+        return coefficients
+    else:
+        return coefficients[0]
+
 def svm_model(data5tuple):
     data, classvector, idstomodel, indicestomodel, regularization = data5tuple
     trainingset, yvals, testset = sliceframe_list(data, classvector, indicestomodel)
     trainingset, means, stdevs = normalizearray(trainingset, False)
 
-    supportvector = svm.SVC(C = regularization, kernel = 'linear', probability = True)
+    supportvector = make_classifier('svm', regularization)
     supportvector.fit(trainingset, yvals)
 
     testset = (testset - means) / stdevs
-    predictions = supportvector.predict(testset)
     probabilities = [x[1] for x in supportvector.predict_proba(testset)]
 
     return probabilities
 
+
+def init_shared(data, classvector, foldlabels):
+    shared['data'] = data
+    shared['classvector'] = np.asarray(classvector)
+    shared['foldlabels'] = foldlabels
+    shared['datakey'] = None
+
+def save_shared(folder, data, classvector, foldlabels):
+    '''
+    Writes the arrays a model's tasks need into folder, so that
+    workers of a pool that wasn't started with them can load them.
+    '''
+
+    np.save(os.path.join(folder, 'data.npy'), np.ascontiguousarray(data))
+    np.save(os.path.join(folder, 'classvector.npy'), np.asarray(classvector))
+    np.save(os.path.join(folder, 'foldlabels.npy'), np.asarray(foldlabels))
+
+def use_shared(datakey):
+    '''
+    Makes sure the arrays for datakey are the ones in shared. None means
+    the arrays the worker was started with; otherwise datakey is a
+    folder written by save_shared(), which is memory-mapped, so workers
+    share one copy through the page cache.
+    '''
+
+    if datakey is None or shared.get('datakey') == datakey:
+        return
+
+    shared['data'] = np.load(os.path.join(datakey, 'data.npy'), mmap_mode = 'r')
+    shared['classvector'] = np.load(os.path.join(datakey, 'classvector.npy'))
+    shared['foldlabels'] = np.load(os.path.join(datakey, 'foldlabels.npy'))
+    shared['datakey'] = datakey
+
+def fold_slices(foldnumber, numfeatures):
+    '''
+    Returns the training rows, their classes, and the test rows for
+    a fold, using only the first numfeatures columns. Rows are chosen
+    with a boolean mask on the shared matrix, so nothing is copied
+    except the rows we actually use.
+    '''
+
+    data = shared['data'][ : , 0 : numfeatures]
+    # a view of the first numfeatures columns, not a copy
+
+    testmask = shared['foldlabels'] == foldnumber
+    trainmask = ~testmask
+
+    return data[trainmask], shared['classvector'][trainmask], data[testmask]
+
+def model_fold(task):
+    '''
+    Trains a model on every row outside one fold, and returns the
+    predicted probabilities for the rows in the fold, in row order.
+    With more than two classes, it returns a matrix with a column
+    for every class, even if one is missing from this training set.
+    '''
+
+    datakey, algorithm, foldnumber, numfeatures, regularization = task
+    use_shared(datakey)
+    trainingset, yvals, testset = fold_slices(foldnumber, numfeatures)
+
+    stdscaler = StandardScaler()
+    scaledtraining = stdscaler.fit_transform(trainingset)
+    scaledtest = stdscaler.transform(testset)
+
+    newmodel = make_classifier(algorithm, regularization, numrows = len(yvals))
+    newmodel.fit(scaledtraining, yvals)
+
+    numclasses = int(shared['classvector'].max()) + 1
+    if numclasses <= 2:
+        return newmodel.predict_proba(scaledtest)[ : , 1]
+
+    probabilities = np.zeros((len(scaledtest), numclasses))
+    probabilities[ : , newmodel.classes_] = newmodel.predict_proba(scaledtest)
+
+    return probabilities
+
+def timed_fold(task):
+    '''
+    Runs model_fold(task), and returns its predictions along with the
+    wall-clock and CPU seconds it took, and this worker's peak memory,
+    so the parent can report the work done in the pool (see stagelog.py).
+    '''
+
+    wallstart = time.perf_counter()
+    cpustart = time.process_time()
+
+    predictions = model_fold(task)
+
+    return predictions, time.perf_counter() - wallstart, time.process_time() - cpustart, stagelog.high_water_mark()
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+
+# modelserver.py
+#
+# A long-running local service that keeps models exported by
+# versatiletrainer2.export_model(), and the volumes they are
+# applied to, resident in memory.
+#
+# apply_pickled_model() reloads a pickle and re-parses every
+# volume each time it's called, and every script that calls it
+# pays the full cost of importing pandas, sklearn and matplotlib.
+# When we're comparing hundreds of models that adds up to hours.
+# Here we pay those costs once; after that, scoring a batch of
+# volumes is just a sparse-matrix slice, a scaler transform and
+# a call to predict_proba.
+#
+# USAGE syntax:
+#
+# python3 modelserver.py --folder ../data/ --models ../models/*.pkl
+# python3 modelserver.py --socket ../temp/models.sock --models ...
+#
+# The server speaks JSON over HTTP, either on a localhost port
+# or on a Unix socket. Endpoints:
+#
+# GET  /models   lists the names of the models in memory
+# POST /load     {"paths": [...]} loads more pickled models
+# POST /preload  {"docids": [...]} parses volumes in advance
+# POST /score    {"docids": [...]} or {"volumes": {docid: {word: count}}},
+#                optionally with "models": [...], "folder" and "extension";
+#                returns {"probabilities": {model: {docid: p}}, "missing": [...]},
+#                missing being docids that couldn't be found or read
+#                (for a multinomial model, p is {label: probability})
+#
+# Clients talk to it with the functions in modelclient.py, which
+# needs only the standard library (and pandas, for
+# apply_served_model), so asking for scores doesn't cost a script
+# the imports the server pays for. They're also importable from here,
+# for scripts written when they lived in this module.
+
+import argparse, csv, json, os, pickle, socketserver, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from scipy import sparse
+
+import versatiletrainer2
+import volumeio
+from modelclient import request, score, apply_served_model
+
+class ResidentModels(object):
+    '''
+    Holds a set of exported models and a cache of parsed volumes.
+
+    Volumes are stored as sparse rows over a single index of all the
+    words that appear in the vocabulary of any loaded model; words
+    no model uses are simply not kept. If a newly loaded model
+    brings words we haven't indexed, resident volumes are dropped
+    and will be re-read the next time they're requested.
+
+    The rows are kept in a volumeio.VolumeCache, keyed by path and
+    modification time (so a volume rewritten on disk is read again),
+    within volumeio's cachebudget unless a budget is given.
+    '''
+
+    def __init__(self, folder, extension, budget = None):
+        self.folder = folder
+        self.extension = extension
+        self.models = dict()
+        self.columns = dict()
+        self.wordindex = dict()
+        self.volumes = volumeio.VolumeCache(budget)
+        self.lock = threading.RLock()
+
+    def load_model(self, modelpath):
+        with open(modelpath, 'rb') as input:
+            modeldict = pickle.load(input)
+
+        with self.lock:
+            newwords = False
+            for word in modeldict['vocabulary']:
+                if word not in self.wordindex:
+                    self.wordindex[word] = len(self.wordindex)
+                    newwords = True
+
+            if newwords:
+                self.volumes.clear()
+
+            modelname = modeldict['name']
+            self.models[modelname] = modeldict
+            self.columns[modelname] = np.array([self.wordindex[x] for x in modeldict['vocabulary']], dtype = np.int64)
+
+        return modelname
+
+    def volume_path(self, docid, folder = None, extension = None):
+        if folder is None:
+            folder = self.folder
+        if extension is None:
+            extension = self.extension
+
+        return volumeio.find_volume(folder, docid, extension)
+
+    def sparse_row(self, voldict):
+        ''' Turns a word -> count dictionary into a pair of arrays
+        (column ids, counts), keeping only indexed words.
+        '''
+
+        ids = []
+        counts = []
+        for word, count in voldict.items():
+            if word in self.wordindex:
+                ids.append(self.wordindex[word])
+                counts.append(count)
+
+        return np.array(ids, dtype = np.int64), np.array(counts, dtype = np.float64)
+
+    def get_volume(self, path):
+        key = self.volumes.key(path)
+        row = self.volumes.get(key)
+        if row is not None:
+            return row
+
+        voldict, totalcount = versatiletrainer2.get_voldict(path)
+
+        with self.lock:
+            row = self.sparse_row(voldict)
+            self.volumes.put(key, row, size = row[0].nbytes + row[1].nbytes)
+
+        return row
+
+    def find_row(self, docid, folder = None, extension = None):
+        '''
+        The sparse row for a docid, or None if it can't be found or
+        read; one bad file shouldn't sink a whole batch.
+        '''
+
+        path = self.volume_path(docid, folder, extension)
+        if path is None:
+            return None
+
+        try:
+            return self.get_volume(path)
+        except Exception as e:
+            print('Could not read ' + path + ': ' + type(e).__name__ + ': ' + str(e))
+            return None
+
+    def preload(self, docids, folder = None, extension = None):
+        loaded = []
+        missing = []
+        for docid in docids:
+            if self.find_row(docid, folder, extension) is not None:
+                loaded.append(docid)
+            else:
+                missing.append(docid)
+
+        return loaded, missing
+
+    def build_matrix(self, rows):
+        ''' Stacks a list of sparse rows into a csr matrix
+        covering the whole word index.
+        '''
+
+        indptr = [0]
+        for ids, counts in rows:
+            indptr.append(indptr[-1] + len(ids))
+
+        if len(rows) > 0:
+            indices = np.concatenate([x[0] for x in rows])
+            data = np.concatenate([x[1] for x in rows])
+        else:
+            indices = np.zeros(0, dtype = np.int64)
+            data = np.zeros(0, dtype = np.float64)
+
+        return sparse.csr_matrix((data, indices, np.array(indptr)), shape = (len(rows), len(self.wordindex)))
+
+    def score(self, modelnames = None, docids = None, volumes = None, folder = None, extension = None):
+        '''
+        Applies each of the named models (or all of them) to a batch of
+        volumes, given either as docids to be found in the folder, or as
+        raw word -> count dictionaries. Returns a dictionary of
+        dictionaries, probabilities[modelname][docid], and a list of
+        docids that couldn't be found or read. A multinomial model (one with
+        labels) gives each docid a dictionary of label -> probability
+        instead of a single probability.
+        '''
+
+        if modelnames is None:
+            modelnames = list(self.models.keys())
+
+        resultindex = []
+        rows = []
+        missing = []
+
+        if docids is not None:
+            for docid in docids:
+                row = self.find_row(docid, folder, extension)
+                if row is not None:
+                    rows.append(row)
+                    resultindex.append(docid)
+                else:
+                    missing.append(docid)
+
+        if volumes is not None:
+            with self.lock:
+                for docid, voldict in volumes.items():
+                    rows.append(self.sparse_row(voldict))
+                    resultindex.append(docid)
+
+        with self.lock:
+            matrix = self.build_matrix(rows)
+            probabilities = dict()
+
+            for modelname in modelnames:
+                modeldict = self.models[modelname]
+                if len(resultindex) < 1:
+                    probabilities[modelname] = dict()
+                    continue
+
+                data = matrix[ : , self.columns[modelname]].toarray()
+                standarddata = modeldict['scaler'].transform(data)
+                predicted = modeldict['itself'].predict_proba(standarddata)
+                if 'labels' in modeldict:
+                    labels = modeldict['labels']
+                    probabilities[modelname] = {docid: dict(zip(labels, [float(x) for x in row])) for docid, row in zip(resultindex, predicted)}
+                else:
+                    probabilities[modelname] = dict(zip(resultindex, [float(x) for x in predicted[ : , 1]]))
+
+        return probabilities, missing
+
+def make_handler(resident):
+
+    class ScoringHandler(BaseHTTPRequestHandler):
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def read_json(self):
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 1:
+                return dict()
+            return json.loads(self.rfile.read(length).decode('utf-8'))
+
+        def do_GET(self):
+            if self.path == '/models':
+                self.send_json(200, {'models': sorted(resident.models.keys())})
+            else:
+                self.send_json(404, {'error': 'unknown path ' + self.path})
+
+        def do_POST(self):
+            try:
+                payload = self.read_json()
+
+                if self.path == '/score':
+                    probabilities, missing = resident.score(modelnames = payload.get('models'), docids = payload.get('docids'), volumes = payload.get('volumes'), folder = payload.get('folder'), extension = payload.get('extension'))
+                    self.send_json(200, {'probabilities': probabilities, 'missing': missing})
+
+                elif self.path == '/load':
+                    names = [resident.load_model(x) for x in payload.get('paths', [])]
+                    self.send_json(200, {'models': names})
+
+                elif self.path == '/preload':
+                    loaded, missing = resident.preload(payload.get('docids', []), payload.get('folder'), payload.get('extension'))
+                    self.send_json(200, {'loaded': len(loaded), 'missing': missing})
+
+                else:
+                    self.send_json(404, {'error': 'unknown path ' + self.path})
+
+            except Exception as e:
+                self.send_json(500, {'error': repr(e)})
+
+        def address_string(self):
+            # Unix-socket clients don't have a (host, port) address.
+            if isinstance(self.client_address, tuple) and len(self.client_address) > 0:
+                return str(self.client_address[0])
+            else:
+                return 'local'
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoringHandler
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, client_address = super().get_request()
+        return request, ('local', 0)
+
+def serve(resident, port = 8765, socketpath = None):
+    handler = make_handler(resident)
+
+    if socketpath is not None:
+        if os.path.exists(socketpath):
+            os.remove(socketpath)
+        server = UnixHTTPServer(socketpath, handler)
+        print('Serving ' + str(len(resident.models)) + ' models on ' + socketpath)
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        print('Serving ' + str(len(resident.models)) + ' models on localhost:' + str(port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socketpath is not None and os.path.exists(socketpath):
+            os.remove(socketpath)
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Serve exported models from memory.')
+    parser.add_argument('--models', nargs = '*', default = [], help = 'pickled models to load at startup')
+    parser.add_argument('--folder', default = '../data/', help = 'default folder of volumes')
+    parser.add_argument('--extension', default = '.tsv', help = 'default volume file extension')
+    parser.add_argument('--port', type = int, default = 8765, help = 'localhost port to listen on')
+    parser.add_argument('--socket', default = None, help = 'listen on this Unix socket instead of a port')
+    parser.add_argument('--preload', default = None, help = 'metadata csv whose docids should be parsed at startup')
+    args = parser.parse_args()
+
+    resident = ResidentModels(args.folder, args.extension)
+    for modelpath in args.models:
+        print('Loaded ' + resident.load_model(modelpath))
+
+    if args.preload is not None:
+        with open(args.preload, encoding = 'utf-8') as f:
+            docids = [row['docid'] for row in csv.DictReader(f)]
+        loaded, missing = resident.preload(docids)
+        print('Preloaded ' + str(len(loaded)) + ' volumes; ' + str(len(missing)) + ' missing.')
+
+    serve(resident, port = args.port, socketpath = args.socket)
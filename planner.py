@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+# planner.py
+#
+# Runs several experiments at once, training each distinct model and
+# making each distinct comparison only once.
+#
+# Experiment functions in main_experiment, genre_experiment and
+# methodological_experiment often ask for the same model under
+# different names: the same positive tags, contrast, date window and
+# sizecap, trained with the same parameters. They also often compare
+# the same pair of models, sometimes in both orders. Run separately,
+# every one of those is trained or compared again.
+#
+# Instead, an experiment can declare what it needs in a Plan: its
+# model specs (in the form batchtrainer.py uses), and the comparisons
+# it wants between them, each with a callback that writes its rows.
+# The plan reduces every spec to a canonical key (everything that
+# determines which volumes are selected and how the model is trained,
+# but not its name) and every comparison to a key made from the keys
+# of its two models. run() then trains each unique model once, as a
+# task graph (see taskgraph.py), copies its files to every other name
+# it was requested under, and calls every experiment's callback with
+# its own spec. Comparisons are deduplicated the same way, and each
+# requester's callback gets the result in the order it asked for.
+#
+# Specs that differ only by name are treated as the same model, so
+# replicates must be distinguished by their 'replicate' (or
+# 'iteration') number, as period_specs() and ratio_specs() do.
+
+import hashlib, os, pickle, shutil
+
+import batchtrainer
+import taskgraph
+
+def canonical_key(spec, settings):
+    '''
+    A hash of everything about a spec that determines its model,
+    except its name.
+    '''
+
+    parts = []
+    for field in ['tags4positive', 'tags4negative', 'forbid4positive', 'forbid4negative']:
+        parts.append(sorted(spec.get(field, set())))
+    for field in ['floor', 'ceiling', 'sizecap', 'ratio', 'seed']:
+        parts.append(spec.get(field))
+    parts.append(spec.get('replicate', spec.get('iteration')))
+
+    if 'docids' in spec:
+        parts.append(sorted(spec['docids']))
+    else:
+        parts.append(None)
+
+    # A lexicon that already exists fixes the vocabulary, so its contents
+    # are part of the key; otherwise the vocabulary is ranked from the
+    # selection, like any model's without one.
+
+    vocabpath = spec.get('vocabpath')
+    if vocabpath is not None and os.path.isfile(vocabpath):
+        with open(vocabpath, mode = 'rb') as f:
+            parts.append(hashlib.sha1(f.read()).hexdigest())
+    else:
+        parts.append(None)
+
+    parts.append(settings)
+
+    return hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+def copy_outputs(outputfolder, sourcespec, spec):
+    '''
+    Copies the .csv, .coefs.csv and .pkl files of the model trained for
+    sourcespec to the name of another spec that asked for the same
+    model, along with its lexicon if the spec names one that doesn't
+    exist yet.
+    '''
+
+    source = os.path.join(outputfolder, sourcespec['name'])
+    destination = os.path.join(outputfolder, spec['name'])
+
+    shutil.copyfile(source + '.csv', destination + '.csv')
+    shutil.copyfile(source + '.coefs.csv', destination + '.coefs.csv')
+
+    with open(source + '.pkl', mode = 'rb') as f:
+        model = pickle.load(f)
+    model['name'] = spec['name']
+    with open(destination + '.pkl', mode = 'wb') as f:
+        pickle.dump(model, f)
+
+    if 'vocabpath' in spec and not os.path.isfile(spec['vocabpath']):
+        if os.path.isfile(sourcespec.get('vocabpath', '')):
+            shutil.copyfile(sourcespec['vocabpath'], spec['vocabpath'])
+
+class Plan:
+    '''
+    Models and comparisons declared by any number of experiments, to
+    be deduplicated and run together.
+    '''
+
+    def __init__(self, sourcefolder, outputfolder = '../modeloutput/', cores = 12, processes = 4, memory = None):
+        self.sourcefolder = sourcefolder
+        self.outputfolder = outputfolder
+        self.cores = cores
+        self.processes = processes
+        # cores for the whole plan, and for each model's pool
+        self.memory = memory
+        # bytes for the whole plan (by default, the machine's memory)
+
+        self.models = dict()
+        # canonical key -> {'settings', 'modelparams', 'requests': [(spec, callback)]}
+        self.keyofname = dict()
+        self.comparisons = dict()
+        # comparison key -> {'function', 'requests': [(name1, name2, callback, swapped)]}
+        self.modelrequests = 0
+        self.comparisonrequests = 0
+
+    def add_models(self, specs, metadatapath, modelparams, sizecap, callback = None, numfeatures = 5000, negative_strategy = 'random', overlap_strategy = 'random', force_even_distribution = False, forbiddenwords = set(), write_fullmodel = False):
+        '''
+        Declares a model for each spec, with the same arguments as
+        batchtrainer.train_specs(). When a model is trained, the
+        callback is called with (spec, results) for this spec, whichever
+        experiment's spec it was actually trained under.
+        '''
+
+        settings = (os.path.abspath(metadatapath), repr(modelparams), numfeatures, negative_strategy, overlap_strategy, force_even_distribution, tuple(sorted(forbiddenwords)), write_fullmodel)
+
+        for spec in specs:
+            spec = dict(spec)
+            spec.setdefault('sizecap', sizecap)
+            key = canonical_key(spec, settings)
+
+            if spec['name'] in self.keyofname and self.keyofname[spec['name']] != key:
+                raise ValueError('Two different models are both named ' + spec['name'])
+            self.keyofname[spec['name']] = key
+
+            if key not in self.models:
+                self.models[key] = {'settings': settings, 'modelparams': modelparams, 'requests': []}
+            self.models[key]['requests'].append((spec, callback))
+            self.modelrequests += 1
+
+    def add_comparison(self, name1, name2, function, callback = None, swap = None):
+        '''
+        Declares a comparison: function(name1, name2), run after both
+        models exist (they needn't be in the plan, if their files do),
+        and then callback(result). If swap is given, it turns the result
+        of function(name2, name1) into that of function(name1, name2),
+        so the two orders count as one comparison.
+        '''
+
+        key1 = self.keyofname.get(name1, 'file:' + name1)
+        key2 = self.keyofname.get(name2, 'file:' + name2)
+
+        swapped = swap is not None and key2 < key1
+        if swapped:
+            key1, key2 = key2, key1
+
+        key = (function.__module__ + '.' + function.__name__, key1, key2)
+
+        if key not in self.comparisons:
+            self.comparisons[key] = {'function': function, 'swap': swap, 'requests': []}
+        self.comparisons[key]['requests'].append((name1, name2, callback, swapped))
+        self.comparisonrequests += 1
+
+    def model_done(self, key, trainedspec, results):
+        for spec, callback in self.models[key]['requests']:
+            if spec['name'] != trainedspec['name']:
+                copy_outputs(self.outputfolder, trainedspec, spec)
+            if callback is not None:
+                callback(spec, results)
+
+    def comparison_done(self, key, result):
+        comparison = self.comparisons[key]
+        for name1, name2, callback, swapped in comparison['requests']:
+            if callback is None:
+                continue
+            if swapped != comparison['requests'][0][3]:
+                callback(comparison['swap'](result))
+            else:
+                callback(result)
+
+    def run(self):
+        print('Plan: ' + str(self.modelrequests) + ' models requested, ' + str(len(self.models)) + ' distinct; ' + str(self.comparisonrequests) + ' comparisons requested, ' + str(len(self.comparisons)) + ' distinct.')
+
+        graph = taskgraph.TaskGraph(cores = self.cores, memory = self.memory)
+        indexes = dict()
+        taskofkey = dict()
+
+        # Models are grouped by their settings, since batchtrainer takes
+        # those once for a batch of specs. (Every spec has its own sizecap
+        # by now.)
+
+        groups = dict()
+        for key, model in self.models.items():
+            requested = [x[0] for x in model['requests']]
+            existing = [x for x in requested if os.path.isfile(os.path.join(self.outputfolder, x['name'] + '.csv'))]
+
+            if len(existing) > 0:
+                # Trained on an earlier run; the other names just get copies.
+                for spec in requested:
+                    if spec not in existing:
+                        copy_outputs(self.outputfolder, existing[0], spec)
+                continue
+
+            groups.setdefault(model['settings'], []).append(key)
+
+        for settings, keys in groups.items():
+            metadatapath, paramstring, numfeatures, negative_strategy, overlap_strategy, force_even_distribution, forbiddenwords, write_fullmodel = settings
+            modelparams = self.models[keys[0]]['modelparams']
+
+            if metadatapath not in indexes:
+                indexes[metadatapath] = batchtrainer.CorpusIndex(self.sourcefolder, metadatapath)
+
+            specs = []
+            for key in keys:
+                spec = self.models[key]['requests'][0][0]
+                specs.append(spec)
+                taskofkey[key] = spec['name']
+
+            keyofspec = {taskofkey[key]: key for key in keys}
+            batchtrainer.graph_specs(graph, indexes[metadatapath], specs, modelparams, self.outputfolder, None, numfeatures = numfeatures, negative_strategy = negative_strategy, overlap_strategy = overlap_strategy, force_even_distribution = force_even_distribution, forbiddenwords = set(forbiddenwords), processes = self.processes, write_fullmodel = write_fullmodel, callback = lambda spec, results, keyofspec = keyofspec: self.model_done(keyofspec[spec['name']], spec, results))
+
+        for key, comparison in self.comparisons.items():
+            name1, name2, callback, swapped = comparison['requests'][0]
+            requires = []
+            for name in [name1, name2]:
+                if self.keyofname.get(name) in taskofkey:
+                    requires.append(taskofkey[self.keyofname[name]])
+
+            taskname = 'compare_' + name1 + '_' + name2
+            graph.add(taskname, comparison['function'], (name1, name2), requires = requires, callback = lambda taskname, result, key = key: self.comparison_done(key, result))
+
+        return graph.run()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+# poolprofile.py
+#
+# Opt-in profiling of the tasks that run in pools of worker processes.
+#
+# Profiling tune_a_model() from the parent process misses nearly all
+# of the work, which happens inside pool workers (modelingprocess's
+# model_fold, model_volume_list, svm_model and model_one_volume). With
+# profiling enabled, code that sends modeling tasks to a pool wraps
+# them with wrap(): each task then runs under cProfile in its worker,
+# and the worker sends its stats back with the result. The parent
+# merges the stats of every task, from every worker and every cell of
+# the grid, with unwrap(), and report() prints the merged profile,
+# along with the time spent in each package (pandas, numpy, sklearn,
+# scipy, pickle ...), which is usually what we want to know first.
+#
+# Workers pickle each result inside the profiled call, so the cost of
+# pickling results shows up in the profile too.
+#
+# Tasks run in a taskgraph.TaskGraph's processes send their stats back
+# to the graph's process, so one report covers a whole graph.
+#
+# To use it:
+#
+#     poolprofile.enabled = True
+#     ... train models ...
+#     poolprofile.report(path = 'workers.prof')
+#
+# The file written to path can be read by pstats or snakeviz.
+# cProfile adds some overhead to every function call, so profiled
+# runs are slower, and this is off by default.
+
+import cProfile, pickle, pstats, re
+
+enabled = False
+
+merged = None
+taskcount = 0
+
+class ShippedStats:
+    '''
+    Stats sent back from a worker, in the form pstats.Stats.add()
+    accepts (it wants something with a create_stats() method).
+    '''
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+def run_profiled(functionandtask):
+    '''
+    Runs function(task) under cProfile, and returns the pickled result
+    along with the profiler's stats.
+    '''
+
+    function, task = functionandtask
+
+    profiler = cProfile.Profile()
+    pickledresult = profiler.runcall(lambda: pickle.dumps(function(task), protocol = pickle.HIGHEST_PROTOCOL))
+    profiler.create_stats()
+
+    return pickledresult, profiler.stats
+
+def wrap(function, tasks):
+    '''
+    Returns the function and list of tasks to send to a pool instead of
+    function and tasks: run_profiled and (function, task) pairs if
+    profiling is enabled, otherwise just function and tasks.
+    '''
+
+    if not enabled:
+        return function, tasks
+
+    return run_profiled, [(function, task) for task in tasks]
+
+def unwrap(results):
+    '''
+    Takes the results of tasks wrapped by wrap(), merges their stats,
+    and returns the results their functions returned.
+    '''
+
+    if not enabled:
+        return results
+
+    unwrapped = []
+    for pickledresult, stats in results:
+        merge(stats)
+        unwrapped.append(pickle.loads(pickledresult))
+
+    return unwrapped
+
+def merge(stats, tasks = 1):
+    ''' Adds a dictionary of profiler stats to the merged profile. '''
+
+    global merged, taskcount
+
+    if merged is None:
+        merged = pstats.Stats()
+    merged.add(ShippedStats(stats))
+    taskcount += tasks
+
+def collected():
+    '''
+    The merged stats of this process, and the number of tasks in them,
+    for sending on to a parent process; or None.
+    '''
+
+    if merged is None:
+        return None
+
+    return merged.stats, taskcount
+
+def reset():
+    global merged, taskcount
+
+    merged = None
+    taskcount = 0
+
+def package(filename, functionname):
+    '''
+    The package a profiled function belongs to: the folder under
+    site-packages for library code, the module of a built-in, or
+    the file name for our own code.
+    '''
+
+    if filename == '~':
+        match = re.search(r"of '([\w.]+)'|built-in method ([\w.]+)", functionname)
+        if match is None:
+            return 'builtins'
+        name = match.group(1) or match.group(2)
+        if '.' not in name:
+            return 'builtins'
+        name = name.split('.')[0].strip('_')
+        if name == 'lsprof':
+            return 'profiler'
+        return name
+
+    parts = re.split(r'[/\\]', filename)
+    if 'site-packages' in parts:
+        return parts[parts.index('site-packages') + 1].split('.')[0]
+    if 'lib' in parts and len(parts) > parts.index('lib') + 2 and parts[parts.index('lib') + 1].startswith('python'):
+        return parts[parts.index('lib') + 2].replace('.py', '')
+        # the standard library
+    return parts[-1]
+
+def package_times():
+    ''' Seconds spent in each package (excluding callees), largest first. '''
+
+    times = dict()
+    for (filename, lineno, functionname), (primitivecalls, calls, tottime, cumtime, callers) in merged.stats.items():
+        name = package(filename, functionname)
+        times[name] = times.get(name, 0) + tottime
+
+    return sorted(times.items(), key = lambda x: x[1], reverse = True)
+
+def report(limit = 30, sortby = 'cumulative', path = None):
+    '''
+    Prints the merged profile of every task profiled in this process,
+    with the time in each package, and writes it to path if given.
+    '''
+
+    if merged is None:
+        print('No worker tasks were profiled.')
+        return
+
+    times = package_times()
+    total = sum([x[1] for x in times])
+
+    print()
+    print('Profile of ' + str(taskcount) + ' worker tasks: ' + str(round(total, 1)) + ' seconds.')
+    print()
+    for name, seconds in times[0 : 15]:
+        print('    ' + name + '\t' + str(round(seconds, 2)) + 's\t' + str(round(100 * seconds / total, 1)) + '%')
+    print()
+
+    merged.sort_stats(sortby).print_stats(limit)
+
+    if path is not None:
+        merged.dump_stats(path)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+# stagelog.py
+#
+# Times the stages of getting data for a model and training it, so
+# that across thousands of models we can see where the hours go.
+#
+# Code wraps each stage in a with-block:
+#
+#     with stagelog.stage('ingestion', volumes = len(volspresent)) as record:
+#         ...
+#         record['shape'] = list(masterdata.shape)
+#
+# and when the block ends, a record is made of the stage's name, the
+# fields given or added inside the block, and
+#
+#     wall        seconds elapsed
+#     cpu         CPU seconds used by this process
+#     childcpu    CPU seconds used by child processes that ended during
+#                 the stage (the workers of a pool opened and closed in it)
+#     peak        the most memory this process held during the stage
+#     rss         the memory it held at the end
+#
+# Memory is in bytes. On Linux, the peak is measured by resetting the
+# process's high-water mark when a stage starts; elsewhere it's the
+# peak for the process's whole life so far. Work done in a pool that
+# outlives the stage (batchtrainer's shared pool) isn't in its CPU
+# times; the grid search reports that work cell by cell instead, as
+# measured by the workers themselves (see report()).
+#
+# What happens to records depends on mode:
+#
+#     'quiet'     nothing
+#     'human'     a line of text for each stage, printed
+#     'machine'   a JSON object for each stage, one per line, appended
+#                 to logpath (or printed, if logpath is None)
+#
+# Every record also includes the fields in context, which callers can
+# use to say which model or job the records belong to.
+#
+# USAGE syntax, to total up the stages in logs written in machine mode:
+#
+# python3 stagelog.py summarize stages1.jsonl [stages2.jsonl ...]
+
+import argparse, json, resource, sys, time
+
+mode = 'human'
+logpath = None
+context = dict()
+
+openstages = []
+
+def memory_status(field):
+    ''' A field of /proc/self/status, in bytes, or None. '''
+
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+def high_water_mark():
+    hwm = memory_status('VmHWM:')
+    if hwm is None:
+        hwm = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            hwm = hwm * 1024
+            # ru_maxrss is in kilobytes, except on macOS
+    return hwm
+
+def reset_high_water_mark():
+    '''
+    Resets the process's peak memory to its current memory, first
+    passing the old peak on to every stage still open. Returns False
+    if the system won't let us.
+    '''
+
+    hwm = high_water_mark()
+    for openstage in openstages:
+        openstage.peak = max(openstage.peak, hwm)
+
+    try:
+        with open('/proc/self/clear_refs', mode = 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def emit(record):
+    if mode == 'quiet':
+        return
+
+    record = dict(context, **record)
+
+    if mode == 'machine':
+        line = json.dumps(record, default = str)
+        if logpath is None:
+            print(line)
+        else:
+            with open(logpath, mode = 'a', encoding = 'utf-8') as f:
+                f.write(line + '\n')
+
+    else:
+        line = '[' + record['stage'] + '] ' + str(round(record['wall'], 2)) + 's'
+        if 'cpu' in record:
+            line += ', cpu ' + str(round(record['cpu'] + record.get('childcpu', 0), 2)) + 's'
+        if record.get('peak') is not None:
+            line += ', peak ' + str(int(record['peak'] / (1024 * 1024))) + ' MB'
+        for key, value in record.items():
+            if key in ('stage', 'time', 'wall', 'cpu', 'childcpu', 'peak', 'rss'):
+                continue
+            elif key.endswith('peak'):
+                value = str(int(value / (1024 * 1024))) + ' MB'
+            elif isinstance(value, float):
+                value = round(value, 4)
+            line += ', ' + key + ' ' + str(value)
+        print(line)
+
+def report(stagename, wall, **fields):
+    '''
+    Records a stage that wasn't timed with stage(): work timed
+    somewhere else, like the cells of a grid search, which run in a
+    pool's workers.
+    '''
+
+    if mode == 'quiet':
+        return
+
+    record = {'stage': stagename, 'time': time.time(), 'wall': wall}
+    record.update(fields)
+    emit(record)
+
+class stage:
+    '''
+    Times a with-block as a stage named stagename. The block gets a
+    dictionary, to which it can add fields for the stage's record.
+    '''
+
+    def __init__(self, stagename, **fields):
+        self.stagename = stagename
+        self.fields = fields
+
+    def __enter__(self):
+        if mode == 'quiet':
+            return self.fields
+
+        self.reset = reset_high_water_mark()
+        self.peak = 0
+        openstages.append(self)
+
+        self.started = time.time()
+        self.wallstart = time.perf_counter()
+        self.cpustart = time.process_time()
+        self.childstart = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        return self.fields
+
+    def __exit__(self, exceptiontype, exception, traceback):
+        if mode == 'quiet':
+            return False
+
+        wall = time.perf_counter() - self.wallstart
+        cpu = time.process_time() - self.cpustart
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        childcpu = (children.ru_utime - self.childstart.ru_utime) + (children.ru_stime - self.childstart.ru_stime)
+
+        openstages.remove(self)
+        hwm = high_water_mark()
+        self.peak = max(self.peak, hwm)
+        for openstage in openstages:
+            openstage.peak = max(openstage.peak, hwm)
+            # stages this one was nested in
+
+        record = {'stage': self.stagename, 'time': self.started, 'wall': wall, 'cpu': cpu, 'childcpu': childcpu, 'peak': self.peak, 'rss': memory_status('VmRSS:')}
+        if not self.reset:
+            record['peakscope'] = 'process'
+        if exceptiontype is not None:
+            record['error'] = exceptiontype.__name__
+        record.update(self.fields)
+
+        emit(record)
+
+        return False
+
+def summarize(paths):
+    '''
+    Totals the wall and CPU seconds of each stage across JSON-lines
+    logs, and prints them, the most expensive first.
+    '''
+
+    totals = dict()
+    for path in paths:
+        with open(path, encoding = 'utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                total = totals.setdefault(record['stage'], {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'peak': 0, 'reported': 'rss' not in record})
+                total['count'] += 1
+                total['wall'] += record['wall']
+                total['cpu'] += record.get('cpu', 0) + record.get('childcpu', 0)
+                total['peak'] = max(total['peak'], record.get('peak') or record.get('workerpeak') or 0)
+
+    allwall = sum([x['wall'] for x in totals.values() if not x['reported']])
+    # Stages from report() (grid cells) happened inside other stages,
+    # so they're shown as a share of the total but not added to it.
+
+    print('stage\tcount\twall\t%wall\tcpu\tmax peak')
+    for stagename in sorted(totals, key = lambda x: totals[x]['wall'], reverse = True):
+        total = totals[stagename]
+        share = 100 * total['wall'] / allwall if allwall > 0 else 0
+        print(stagename + '\t' + str(total['count']) + '\t' + str(round(total['wall'], 1)) + '\t' + str(round(share, 1)) + '\t' + str(round(total['cpu'], 1)) + '\t' + str(int(total['peak'] / (1024 * 1024))) + ' MB')
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description = 'Summarize stage logs written in machine mode.')
+    parser.add_argument('command', choices = ['summarize'])
+    parser.add_argument('paths', nargs = '+')
+    args = parser.parse_args()
+
+    summarize(args.paths)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+# taskgraph.py
+#
+# Runs the steps of an experiment as a graph of tasks, several at a
+# time, within a budget of cores.
+#
+# An experiment like main_experiment.reliable_genre_comparisons()
+# trains four models for each period and replicate, and compares them
+# in pairs. None of those models depends on any other, and each
+# comparison only needs its two models; but run one after another,
+# only the grid search inside each model uses more than one core, and
+# reading data, building vocabularies and comparing models leave the
+# rest of the machine idle.
+#
+# Here each step is a task: a function, its arguments, the tasks it
+# requires, and the number of cores it will use. The scheduler starts
+# every task whose requirements are done, as long as the cores in use
+# stay within the budget, and starts dependent tasks (comparisons) as
+# soon as they can run, ahead of independent ones. A task that needs
+# more cores than the whole budget runs when nothing else is running.
+#
+# Each task runs in a forked process, so it sees everything the parent
+# had loaded when it was started (a batchtrainer.CorpusIndex, say)
+# without copying it, and can open a pool of its own. The function's
+# return value is sent back to the parent and passed to the task's
+# callback, which runs in the parent; that's the place to append rows
+# to a results file, since only one process ever writes it.
+#
+# Tasks can also say how much memory they will need at their peak
+# (for a model, workerpool.estimate_memory() of its matrix). A task is
+# only started if its memory fits in the graph's budget (by default,
+# the machine's physical memory) alongside the estimates of the tasks
+# already running, and also in what the system says is available now,
+# less what our running tasks are still expected to claim. That second
+# test leaves room for other scripts running on the same node. Tasks
+# that don't fit wait until something finishes, or until memory frees
+# up. A task too big for either test still runs when nothing else of
+# ours is running, rather than never.
+#
+# While tasks run, the memory of each task's processes (the task and
+# the workers of its pool) is sampled every sampleinterval seconds,
+# and reported every reportinterval seconds, process by process. We
+# read proportional set sizes where the system provides them, so pages
+# a pool's workers share with their parent are only counted once.
+# When a task finishes, its peak is printed next to its estimate.
+#
+# If poolprofile.enabled is set, the profiles of pool tasks run inside
+# each task come back with its result and are merged into this
+# process's, so poolprofile.report() covers the whole graph.
+#
+# If a task fails, tasks that require it are skipped, everything else
+# still runs, and run() raises an error at the end listing the failures.
+
+import multiprocessing, os, time, traceback
+from multiprocessing.connection import wait
+
+import poolprofile
+
+sampleinterval = 10
+reportinterval = 120
+
+class TaskFailed(Exception):
+    pass
+
+def megabytes(numbytes):
+    return str(int(numbytes / (1024 * 1024))) + ' MB'
+
+def total_memory():
+    ''' Physical memory, in bytes, or None if we can't tell. '''
+
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def available_memory():
+    ''' MemAvailable from /proc/meminfo, in bytes, or None. '''
+
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return None
+
+def process_children():
+    '''
+    Maps each process id to a list of its children's, by reading /proc;
+    on systems without it, the map is empty.
+    '''
+
+    children = dict()
+    try:
+        names = os.listdir('/proc')
+    except OSError:
+        return children
+
+    for name in names:
+        if not name.isdigit():
+            continue
+        try:
+            with open('/proc/' + name + '/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        children.setdefault(int(fields[1]), []).append(int(name))
+
+    return children
+
+def process_tree(pid, children):
+    ''' A process and all its descendants. '''
+
+    tree = [pid]
+    for member in tree:
+        tree.extend(children.get(member, []))
+
+    return tree
+
+def process_memory(pid):
+    '''
+    The proportional set size of a process (its own pages, and its
+    share of pages it shares with others), or its resident set size
+    where that isn't available; 0 if it has gone.
+    '''
+
+    for filename, field in [('smaps_rollup', 'Pss:'), ('status', 'VmRSS:')]:
+        try:
+            with open('/proc/' + str(pid) + '/' + filename) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            continue
+
+    return 0
+
+def run_in_child(function, args, connection):
+    poolprofile.reset()
+    # anything profiled before the fork belongs to the parent
+
+    try:
+        result = function(*args)
+        connection.send((True, result, poolprofile.collected()))
+    except BaseException:
+        connection.send((False, traceback.format_exc(), poolprofile.collected()))
+    finally:
+        connection.close()
+
+class TaskGraph:
+    '''
+    A set of tasks with dependencies, run concurrently by run() within
+    a budget of cores (by default, every core on the machine) and a
+    budget of memory in bytes (by default, all of the machine's).
+    '''
+
+    def __init__(self, cores = None, memory = None):
+        if cores is None:
+            cores = os.cpu_count()
+        if memory is None:
+            memory = total_memory()
+        self.cores = cores
+        self.memory = memory
+        self.tasks = dict()
+        self.order = []
+        self.results = dict()
+        self.failed = dict()
+        self.peaks = dict()
+
+    def add(self, name, function, args = (), requires = [], cores = 1, memory = 0, callback = None):
+        '''
+        Adds a task. It will be run as function(*args) once every task
+        named in requires is done, using (we trust) no more than cores
+        cores and about memory bytes at its peak (0 if we don't know).
+        When it's done, callback(name, result) is called in this
+        process. Returns the name, so it can be listed in later tasks'
+        requires.
+        '''
+
+        if name in self.tasks:
+            raise ValueError('Task ' + name + ' added twice.')
+        for required in requires:
+            if required not in self.tasks:
+                raise ValueError('Task ' + name + ' requires ' + required + ', which has not been added.')
+
+        self.tasks[name] = {'function': function, 'args': args, 'requires': list(requires), 'cores': cores, 'memory': memory, 'callback': callback}
+        self.order.append(name)
+
+        return name
+
+    def __contains__(self, name):
+        return name in self.tasks
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def ready(self, waiting):
+        '''
+        Tasks whose requirements are done, those with requirements
+        first, and otherwise in the order they were added.
+        '''
+
+        readytasks = [x for x in waiting if all(y in self.results for y in self.tasks[x]['requires'])]
+        position = {name: i for i, name in enumerate(self.order)}
+        readytasks.sort(key = lambda x: (len(self.tasks[x]['requires']) == 0, position[x]))
+
+        return readytasks
+
+    def skip_dependents(self, waiting):
+        '''
+        Takes tasks that require a failed task out of waiting, and
+        records them as failed too.
+        '''
+
+        changed = True
+        while changed:
+            changed = False
+            for name in list(waiting):
+                failedrequirements = [x for x in self.tasks[name]['requires'] if x in self.failed]
+                if len(failedrequirements) > 0:
+                    waiting.remove(name)
+                    self.failed[name] = 'skipped, because ' + failedrequirements[0] + ' failed'
+                    changed = True
+
+    def memory_fits(self, name, running, memoryinuse):
+        '''
+        True if the task's estimated memory fits in the budget beside
+        the tasks running, and in the memory available right now.
+        '''
+
+        memory = self.tasks[name]['memory']
+        if memory == 0 or len(running) == 0:
+            return True
+
+        if self.memory is not None and memoryinuse + memory > self.memory:
+            return False
+
+        available = available_memory()
+        if available is not None:
+            unclaimed = 0
+            for runningname, process, cores in running.values():
+                unclaimed += max(self.tasks[runningname]['memory'] - self.peaks.get(runningname, 0), 0)
+            if memory > available - unclaimed:
+                return False
+
+        return True
+
+    def sample_memory(self, running, report):
+        '''
+        Measures the memory of each running task's processes, updating
+        its peak, and if report is True prints what each one is using.
+        '''
+
+        if report:
+            print('Task graph memory (available: ' + megabytes(available_memory() or 0) + '):')
+
+        children = process_children()
+        for name, process, cores in running.values():
+            sizes = [process_memory(x) for x in process_tree(process.pid, children)]
+            if sum(sizes) > 0:
+                self.peaks[name] = max(self.peaks.get(name, 0), sum(sizes))
+                # (0 if the task has just exited)
+
+            if report:
+                estimate = self.tasks[name]['memory']
+                line = '    ' + name + ': ' + megabytes(sum(sizes))
+                if estimate > 0:
+                    line += ' (estimated ' + megabytes(estimate) + ')'
+                line += '; task ' + megabytes(sizes[0])
+                if len(sizes) > 1:
+                    line += ', workers ' + ', '.join([megabytes(x) for x in sizes[1 : ]])
+                print(line)
+
+    def run(self):
+        '''
+        Runs every task, and returns a dictionary mapping task names
+        to results.
+        '''
+
+        context = multiprocessing.get_context('fork')
+        waiting = list(self.order)
+        running = dict()
+        # maps each running task's pipe to (name, process, cores)
+
+        coresinuse = 0
+        memoryinuse = 0
+        started = time.time()
+        lastreport = started
+
+        description = 'Task graph: ' + str(len(waiting)) + ' tasks, ' + str(self.cores) + ' cores'
+        if self.memory is not None:
+            description += ', ' + megabytes(self.memory)
+        print(description + '.')
+
+        while len(waiting) > 0 or len(running) > 0:
+
+            for name in self.ready(waiting):
+                cores = min(self.tasks[name]['cores'], self.cores)
+                if coresinuse + cores > self.cores:
+                    continue
+                if not self.memory_fits(name, running, memoryinuse):
+                    continue
+
+                receiver, sender = context.Pipe(duplex = False)
+                process = context.Process(target = run_in_child, args = (self.tasks[name]['function'], self.tasks[name]['args'], sender), name = name)
+                process.start()
+                sender.close()
+
+                running[receiver] = (name, process, cores)
+                coresinuse += cores
+                memoryinuse += self.tasks[name]['memory']
+                waiting.remove(name)
+
+            if len(running) == 0:
+                break
+                # nothing can start, and nothing is running to finish
+
+            finished = wait(list(running.keys()), timeout = sampleinterval)
+
+            report = time.time() - lastreport >= reportinterval
+            self.sample_memory(running, report)
+            if report:
+                lastreport = time.time()
+
+            if len(finished) == 0:
+                continue
+                # Nothing finished, but memory may have been freed
+                # elsewhere; see if anything waiting can start now.
+
+            for receiver in finished:
+                name, process, cores = running.pop(receiver)
+                coresinuse -= cores
+                memoryinuse -= self.tasks[name]['memory']
+
+                try:
+                    succeeded, result, profile = receiver.recv()
+                except EOFError:
+                    succeeded, result, profile = False, 'process died (exit code ' + str(process.exitcode) + ')', None
+
+                if profile is not None:
+                    poolprofile.merge(*profile)
+                receiver.close()
+                process.join()
+
+                if name in self.peaks:
+                    line = 'Task ' + name + ' peaked at ' + megabytes(self.peaks[name])
+                    if self.tasks[name]['memory'] > 0:
+                        line += ' (estimated ' + megabytes(self.tasks[name]['memory']) + ')'
+                    print(line + '.')
+
+                if succeeded:
+                    self.results[name] = result
+                    callback = self.tasks[name]['callback']
+                    if callback is not None:
+                        callback(name, result)
+                else:
+                    print('Task ' + name + ' failed:')
+                    print(result)
+                    self.failed[name] = result
+                    self.skip_dependents(waiting)
+
+            done = len(self.results) + len(self.failed)
+            print('Task graph: ' + str(done) + ' of ' + str(len(self.tasks)) + ' tasks finished; ' + str(len(running)) + ' running, ' + str(int(time.time() - started)) + 's.')
+
+        if len(self.failed) > 0:
+            raise TaskFailed(str(len(self.failed)) + ' tasks failed or were skipped: ' + ', '.join(sorted(self.failed)[0 : 10]))
+
+        return self.results
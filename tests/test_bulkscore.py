@@ -0,0 +1,57 @@
+# A volume that can't be read must not stop a bulk scoring run: it
+# gets a row of NaN, and the other volumes are scored as usual.
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+import bulkscore, versatiletrainer2
+
+VOCABULARY = ['word' + str(j) for j in range(5)]
+
+def make_model(folder):
+    rng = np.random.RandomState(0)
+    data = rng.rand(40, len(VOCABULARY))
+    classes = np.arange(40) % 2
+    data[ : , 0] += classes
+
+    scaler = StandardScaler()
+    model = LogisticRegression()
+    model.fit(scaler.fit_transform(data), classes)
+
+    modelpath = os.path.join(folder, 'model.pkl')
+    versatiletrainer2.export_model(model, 'logistic', scaler, VOCABULARY, {'fant'}, {'random'}, 1.0, len(VOCABULARY), 'model', modelpath)
+    return modelpath
+
+def test_unreadable_volume_gets_nan(tmp_path):
+    folder = str(tmp_path)
+    modelpath = make_model(folder)
+    datafolder = os.path.join(folder, 'data')
+    os.makedirs(datafolder)
+
+    docids = ['vol0', 'vol1', 'vol2', 'vol3']
+    for docid in docids:
+        with open(os.path.join(datafolder, docid + '.tsv'), mode = 'w', encoding = 'utf-8') as f:
+            for word in VOCABULARY:
+                f.write(word + '\t' + str(len(docid) + len(word)) + '\n')
+    os.remove(os.path.join(datafolder, 'vol2.tsv'))
+    with open(os.path.join(datafolder, 'vol2.tsv.gz'), mode = 'wb') as f:
+        f.write(b'this is not gzip')
+
+    bulkscore.init_worker(modelpath, 'folder', datafolder, '.tsv')
+    chunknumber, results, missing, failed = bulkscore.score_chunk((0, docids + ['absent']))
+    assert missing == ['absent']
+    assert list(failed.keys()) == ['vol2']
+
+    outpath = os.path.join(folder, 'scores.tsv')
+    bulkscore.bulk_score(modelpath, outpath, docids, root = datafolder, chunksize = 2, processes = 1)
+    with open(outpath, encoding = 'utf-8') as f:
+        rows = dict([line.rstrip('\n').split('\t') for line in f][1 : ])
+
+    assert sorted(rows.keys()) == docids
+    assert np.isnan(float(rows['vol2']))
+    assert all([0 <= float(rows[x]) <= 1 for x in ['vol0', 'vol1', 'vol3']])
@@ -0,0 +1,88 @@
+# Grid checkpoints: records survive a reload, a record cut short is
+# truncated away, a seeded run resumes from the cells already done,
+# and an unseeded run isn't allowed to checkpoint at all.
+
+import os, pickle, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pytest
+
+import versatiletrainer2
+
+MODELPARAMS = ('logistic', 4, 10, 21, 10, [0.01, 1])
+
+def make_corpus(folder):
+    os.makedirs(os.path.join(folder, 'data'))
+    with open(os.path.join(folder, 'meta.csv'), mode = 'w', encoding = 'utf-8') as f:
+        f.write('docid,author,firstpub,tags\n')
+        for i in range(60):
+            docid = 'vol' + str(i).zfill(3)
+            tag = 'fant' if i % 2 == 0 else 'random'
+            f.write(docid + ',author' + str(i) + ',' + str(1800 + i) + ',' + tag + '\n')
+            with open(os.path.join(folder, 'data', docid + '.tsv'), mode = 'w', encoding = 'utf-8') as v:
+                for j in range(20):
+                    count = 1 + (i * (j + 3)) % 7
+                    if tag == 'fant' and j < 3:
+                        count += 3
+                    v.write('word' + str(j) + '\t' + str(count) + '\n')
+
+def get_data(folder, seed):
+    return versatiletrainer2.get_simple_data(folder + '/data/', folder + '/meta.csv', folder + '/vocab.txt', {'fant'}, {'random'}, 30, numfeatures = 20, seed = seed)
+
+def tune(folder, data, seed):
+    metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = data
+    return versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, {'fant'}, {'random'}, MODELPARAMS, 'm', folder + '/m.csv', verbose = False, seed = seed)
+
+def test_checkpoint_reloads_and_truncates_a_torn_record(tmp_path):
+    folder = str(tmp_path)
+    ids = ['a', 'b', 'c', 'd']
+    classvector = np.array([1, 0, 1, 0])
+    foldlabels = np.array([0, 1, 0, 1], dtype = np.int32)
+
+    checkpoint = versatiletrainer2.GridCheckpoint(folder, ids, classvector, ['x', 'y'], 'logistic', 2)
+    checkpoint.start(foldlabels)
+    checkpoint.record(10, 0.1, 0.75)
+    checkpoint.record(20, 0.1, 0.5)
+    goodsize = os.path.getsize(checkpoint.path)
+
+    with open(checkpoint.path, mode = 'ab') as f:
+        f.write(pickle.dumps((30, 0.1, 0.25, None))[ : -3])
+        # the process died while writing this record
+
+    reloaded = versatiletrainer2.GridCheckpoint(folder, ids, classvector, ['x', 'y'], 'logistic', 2)
+    assert np.array_equal(reloaded.foldlabels, foldlabels)
+    assert reloaded.cells == {(10, 0.1): (0.75, None), (20, 0.1): (0.5, None)}
+    assert os.path.getsize(checkpoint.path) == goodsize
+
+    reloaded.record(30, 0.1, 0.25)
+    again = versatiletrainer2.GridCheckpoint(folder, ids, classvector, ['x', 'y'], 'logistic', 2)
+    assert len(again.cells) == 3
+
+def test_seeded_run_resumes_from_checkpoint(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    make_corpus(folder)
+    checkpoints = os.path.join(folder, 'checkpoints')
+    monkeypatch.setattr(versatiletrainer2, 'checkpointfolder', checkpoints)
+
+    metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = get_data(folder, 11)
+    checkpoint = versatiletrainer2.GridCheckpoint(checkpoints, orderedIDs, np.asarray(classvector), vocablist, 'logistic', 4)
+    checkpoint.start(np.arange(len(orderedIDs), dtype = np.int32) % 4)
+    checkpoint.record(10, 0.01, 0.123)
+    # as if a run had finished one cell before it was preempted
+
+    matrix = tune(folder, get_data(folder, 11), 11)[0]
+
+    assert matrix[0, 0] == 0.123
+    assert matrix[1, 1] > 0.5
+    assert not os.path.isfile(checkpoint.path)
+    # removed once the model is written
+
+def test_checkpointing_requires_a_seed(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    make_corpus(folder)
+    monkeypatch.setattr(versatiletrainer2, 'checkpointfolder', os.path.join(folder, 'checkpoints'))
+
+    with pytest.raises(ValueError):
+        tune(folder, get_data(folder, None), None)
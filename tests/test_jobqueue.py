@@ -0,0 +1,44 @@
+# A job can only require jobs the queue knows about, and workers stop,
+# rather than wait forever, when nothing left can ever run.
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import jobqueue
+
+def test_add_rejects_unknown_requirements(tmp_path):
+    queue = jobqueue.JobQueue(str(tmp_path))
+
+    with pytest.raises(ValueError):
+        queue.add([{'id': 'a', 'kind': 'x', 'args': []}, {'id': 'b', 'kind': 'x', 'args': [], 'requires': ['a', 'nonesuch']}])
+    assert queue.counts()['pending'] == 0
+
+    assert queue.add([{'id': 'a', 'kind': 'x', 'args': []}, {'id': 'b', 'kind': 'x', 'args': [], 'requires': ['a']}]) == 2
+    assert queue.add([{'id': 'c', 'kind': 'x', 'args': [], 'requires': ['b']}]) == 1
+
+def test_work_stops_when_requirements_can_never_be_met(tmp_path, capsys):
+    queue = jobqueue.JobQueue(str(tmp_path))
+    queue.add([{'id': 'a', 'kind': 'x', 'args': []}, {'id': 'b', 'kind': 'x', 'args': [], 'requires': ['a']}, {'id': 'c', 'kind': 'x', 'args': []}])
+    os.remove(queue.path('pending', 'a.json'))
+    # removed by hand
+
+    ran = []
+    jobsrun = jobqueue.work(queue, {'x': lambda: ran.append(1)}, worker = 'w', poll = 0.01)
+
+    assert jobsrun == 1
+    assert queue.counts()['pending'] == 1
+    assert 'b requires a' in capsys.readouterr().out
+
+def test_work_stops_when_a_requirement_failed(tmp_path, capsys):
+    queue = jobqueue.JobQueue(str(tmp_path), maxattempts = 1)
+    queue.add([{'id': 'a', 'kind': 'bad', 'args': []}, {'id': 'b', 'kind': 'x', 'args': [], 'requires': ['a']}])
+
+    def fail():
+        raise RuntimeError('no')
+
+    assert jobqueue.work(queue, {'bad': fail, 'x': lambda: None}, worker = 'w', poll = 0.01) == 0
+    assert queue.counts()['failed'] == 1
+    assert 'b requires a' in capsys.readouterr().out
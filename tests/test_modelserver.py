@@ -0,0 +1,90 @@
+# The model server reports volumes it can't read as missing instead of
+# failing the batch, notices volumes rewritten on disk, keeps its parsed
+# volumes within a budget, and answers clients in modelclient.py.
+
+import os, sys, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+import modelclient, modelserver, versatiletrainer2
+
+VOCABULARY = ['word' + str(j) for j in range(5)]
+
+def make_model(folder):
+    rng = np.random.RandomState(0)
+    data = rng.rand(40, len(VOCABULARY))
+    classes = np.arange(40) % 2
+    data[ : , 0] += 2 * classes
+
+    scaler = StandardScaler()
+    model = LogisticRegression()
+    model.fit(scaler.fit_transform(data), classes)
+
+    modelpath = os.path.join(folder, 'model.pkl')
+    versatiletrainer2.export_model(model, 'logistic', scaler, VOCABULARY, {'fant'}, {'random'}, 1.0, len(VOCABULARY), 'model', modelpath)
+    return modelpath
+
+def write_volume(datafolder, docid, word0):
+    path = os.path.join(datafolder, docid + '.tsv')
+    with open(path, mode = 'w', encoding = 'utf-8') as f:
+        f.write('word0\t' + str(word0) + '\nword1\t1\n')
+    return path
+
+def make_server(folder, budget = None):
+    datafolder = os.path.join(folder, 'data')
+    os.makedirs(datafolder)
+    resident = modelserver.ResidentModels(datafolder, '.tsv', budget = budget)
+    resident.load_model(make_model(folder))
+    return resident, datafolder
+
+def test_unreadable_volume_is_missing(tmp_path):
+    resident, datafolder = make_server(str(tmp_path))
+    write_volume(datafolder, 'good', 1)
+    with open(os.path.join(datafolder, 'bad.tsv.gz'), mode = 'wb') as f:
+        f.write(b'this is not gzip')
+
+    probabilities, missing = resident.score(docids = ['good', 'bad', 'absent'])
+
+    assert list(probabilities['model'].keys()) == ['good']
+    assert missing == ['bad', 'absent']
+
+def test_rewritten_volume_is_read_again(tmp_path):
+    resident, datafolder = make_server(str(tmp_path))
+    path = write_volume(datafolder, 'vol', 0)
+    before = resident.score(docids = ['vol'])[0]['model']['vol']
+
+    write_volume(datafolder, 'vol', 50)
+    os.utime(path, ns = (time.time_ns(), os.stat(path).st_mtime_ns + 10 ** 9))
+    after = resident.score(docids = ['vol'])[0]['model']['vol']
+
+    assert after > before
+
+def test_parsed_volumes_stay_within_budget(tmp_path):
+    resident, datafolder = make_server(str(tmp_path), budget = 100)
+    for i in range(20):
+        write_volume(datafolder, 'vol' + str(i), i)
+
+    loaded, missing = resident.preload(['vol' + str(i) for i in range(20)])
+
+    assert len(loaded) == 20
+    assert resident.volumes.bytes <= 100
+    assert len(resident.volumes.entries) < 20
+
+def test_client_scores_through_a_socket(tmp_path):
+    resident, datafolder = make_server(str(tmp_path))
+    write_volume(datafolder, 'vol', 3)
+    socketpath = str(tmp_path / 'models.sock')
+    threading.Thread(target = modelserver.serve, args = (resident,), kwargs = {'socketpath': socketpath}, daemon = True).start()
+    for i in range(50):
+        if os.path.exists(socketpath):
+            break
+        time.sleep(0.1)
+
+    probabilities, missing = modelclient.score(socketpath, docids = ['vol', 'absent'])
+
+    assert np.isclose(probabilities['model']['vol'], resident.score(docids = ['vol'])[0]['model']['vol'])
+    assert missing == ['absent']
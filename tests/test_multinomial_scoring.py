@@ -0,0 +1,86 @@
+# A model of several classes, exported with labels, must be scored
+# with a probability for each class by the model server and by
+# bulkscore, agreeing with apply_pickled_model().
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+import bulkscore, modelserver, versatiletrainer2
+
+LABELS = ['fant', 'myst', 'rom']
+VOCABULARY = ['word' + str(j) for j in range(6)]
+
+def make_model(folder):
+    rng = np.random.RandomState(0)
+    data = rng.rand(60, len(VOCABULARY))
+    classes = np.array([i % 3 for i in range(60)])
+    data[np.arange(60), classes] += 1
+
+    scaler = StandardScaler()
+    standarddata = scaler.fit_transform(data)
+    model = LogisticRegression(C = 1.0, max_iter = 1000)
+    model.fit(standarddata, classes)
+
+    modelpath = os.path.join(folder, 'genres.pkl')
+    versatiletrainer2.export_model(model, 'logistic', scaler, VOCABULARY, LABELS, [], 1.0, len(VOCABULARY), 'genres', modelpath, labels = LABELS)
+    return modelpath
+
+def make_volumes(folder):
+    datafolder = os.path.join(folder, 'data')
+    os.makedirs(datafolder)
+    docids = ['vol' + str(i) for i in range(6)]
+    with open(os.path.join(folder, 'meta.csv'), mode = 'w', encoding = 'utf-8') as f:
+        f.write('docid\n')
+        for i, docid in enumerate(docids):
+            f.write(docid + '\n')
+            with open(os.path.join(datafolder, docid + '.tsv'), mode = 'w', encoding = 'utf-8') as v:
+                for j, word in enumerate(VOCABULARY):
+                    v.write(word + '\t' + str(1 + (i * (j + 1)) % 5 + (8 if j == i % 3 else 0)) + '\n')
+    return datafolder, docids
+
+def expected_probabilities(folder, modelpath, datafolder):
+    metadata = versatiletrainer2.apply_pickled_model(modelpath, datafolder, '.tsv', os.path.join(folder, 'meta.csv'))
+    return metadata[['alien_' + x for x in LABELS]]
+
+def test_model_server_scores_each_class(tmp_path):
+    folder = str(tmp_path)
+    modelpath = make_model(folder)
+    datafolder, docids = make_volumes(folder)
+    expected = expected_probabilities(folder, modelpath, datafolder)
+
+    resident = modelserver.ResidentModels(datafolder, '.tsv')
+    modelname = resident.load_model(modelpath)
+    probabilities, missing = resident.score(docids = docids + ['absent'])
+
+    assert missing == ['absent']
+    for docid in docids:
+        scored = probabilities[modelname][docid]
+        assert list(scored.keys()) == LABELS
+        assert np.allclose([scored[x] for x in LABELS], expected.loc[docid].values)
+
+def test_bulkscore_writes_a_column_per_class(tmp_path):
+    folder = str(tmp_path)
+    modelpath = make_model(folder)
+    datafolder, docids = make_volumes(folder)
+    expected = expected_probabilities(folder, modelpath, datafolder)
+
+    bulkscore.init_worker(modelpath, 'folder', datafolder, '.tsv')
+    chunknumber, results, missing, failed = bulkscore.score_chunk((0, docids))
+    assert [x[0] for x in results] == docids
+    for docid, probabilities in results:
+        assert np.allclose(probabilities, expected.loc[docid].values)
+
+    outpath = os.path.join(folder, 'scores.tsv')
+    bulkscore.bulk_score(modelpath, outpath, docids, root = datafolder, chunksize = 4, processes = 1)
+    with open(outpath, encoding = 'utf-8') as f:
+        lines = [line.rstrip('\n').split('\t') for line in f]
+
+    assert lines[0] == ['docid'] + LABELS
+    assert sorted([x[0] for x in lines[1 : ]]) == docids
+    for fields in lines[1 : ]:
+        assert np.allclose([float(x) for x in fields[1 : ]], expected.loc[fields[0]].values)
@@ -0,0 +1,40 @@
+# volumeio.parse_counts must keep and skip the same lines, and produce
+# the same words, as the loop it replaced.
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import volumeio
+
+def baseline_counts(data):
+    ''' The loop get_dataframe() used before volumeio existed. '''
+
+    voldict = dict()
+    for line in data.decode('utf-8').splitlines(keepends = True):
+        fields = line.strip().split('\t')
+        if len(fields) > 2 or len(fields) < 2:
+            continue
+        if fields[1] == 'frequency':
+            continue
+        voldict[fields[0]] = float(fields[1])
+    return voldict
+
+CASES = [
+    b'a\t3\t\n',
+    b'\td\t4',
+    b' the\t5 \n',
+    b'a\t3\t\n\td\t4\n the\t5 \nplain\t2\n',
+    b'word\t1\r\nother\t2\r\n',
+    b'\n  \n\t\nx\t1\n',
+    b'#header\tfrequency\nx\t1\n',
+    b'two\ttabs\there\nok\t7',
+    b'spaced word \t 3\n',
+]
+
+@pytest.mark.parametrize('data', CASES)
+def test_parity_with_baseline_loop(data):
+    words, counts, malformed = volumeio.parse_counts(data)
+    assert dict(zip(words.tolist(), counts.tolist())) == baseline_counts(data)
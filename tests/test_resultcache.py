@@ -0,0 +1,57 @@
+# The result cache returns a stored model for an identical problem,
+# writing its files under the new output path, and misses when the
+# same volume IDs resolve to different data.
+
+import os, pickle, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import versatiletrainer2
+
+MODELPARAMS = ('logistic', 4, 10, 21, 10, [0.01, 1])
+
+def make_corpus(folder, boost = 3):
+    os.makedirs(os.path.join(folder, 'data'), exist_ok = True)
+    with open(os.path.join(folder, 'meta.csv'), mode = 'w', encoding = 'utf-8') as f:
+        f.write('docid,author,firstpub,tags\n')
+        for i in range(60):
+            docid = 'vol' + str(i).zfill(3)
+            tag = 'fant' if i % 2 == 0 else 'random'
+            f.write(docid + ',author' + str(i) + ',' + str(1800 + i) + ',' + tag + '\n')
+            with open(os.path.join(folder, 'data', docid + '.tsv'), mode = 'w', encoding = 'utf-8') as v:
+                for j in range(20):
+                    count = 1 + (i * (j + 3)) % 7
+                    if tag == 'fant' and j < 3:
+                        count += boost
+                    v.write('word' + str(j) + '\t' + str(count) + '\n')
+
+def train(folder, outputpath):
+    metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = versatiletrainer2.get_simple_data(folder + '/data/', folder + '/meta.csv', folder + '/vocab.txt', {'fant'}, {'random'}, 30, numfeatures = 20, seed = 3)
+    return versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, {'fant'}, {'random'}, MODELPARAMS, 'm', outputpath, verbose = False, seed = 3)
+
+def test_cache_hit_copies_artefacts_and_miss_on_new_data(tmp_path, monkeypatch, capsys):
+    folder = str(tmp_path)
+    make_corpus(folder)
+    monkeypatch.setattr(versatiletrainer2, 'resultcache', os.path.join(folder, 'cache'))
+
+    first = train(folder, folder + '/first.csv')
+    capsys.readouterr()
+
+    second = train(folder, folder + '/second.csv')
+    assert 'Identical model found in the result cache' in capsys.readouterr().out
+    assert np.array_equal(first[0], second[0])
+    assert list(first[2].probability) == list(second[2].probability)
+
+    with open(folder + '/second.pkl', mode = 'rb') as f:
+        model = pickle.load(f)
+    assert model['name'] == 'second'
+    with open(folder + '/first.coefs.csv', encoding = 'utf-8') as f1, open(folder + '/second.coefs.csv', encoding = 'utf-8') as f2:
+        assert f1.read() == f2.read()
+
+    make_corpus(folder, boost = 6)
+    # the same IDs, extracted again with different counts
+    train(folder, folder + '/third.csv')
+    assert 'Identical model found in the result cache' not in capsys.readouterr().out
+    assert len(os.listdir(os.path.join(folder, 'cache'))) == 2
@@ -0,0 +1,46 @@
+# Seeded selections must pick the same volumes in every process, even
+# though the order of Python's sets changes with PYTHONHASHSEED.
+
+import json, os, subprocess, sys
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SELECT = '''
+import json, sys
+sys.path.insert(0, sys.argv[1])
+import batchtrainer, versatiletrainer2
+
+folder = sys.argv[2]
+data = versatiletrainer2.get_simple_data(folder + '/data/', folder + '/meta.csv', folder + '/vocab.txt', {'fant'}, {'random'}, 20, numfeatures = 10, seed = 7)
+
+index = batchtrainer.CorpusIndex(folder + '/data/', folder + '/meta.csv')
+spec = {'name': 'x', 'tags4positive': {'fant'}, 'tags4negative': {'random'}}
+matched = index.select(spec, 20, negative_strategy = 'closely match', rng = __import__('random').Random(7))[0]
+
+print(json.dumps([data[4], matched]))
+'''
+
+def make_corpus(folder):
+    os.makedirs(os.path.join(folder, 'data'))
+    with open(os.path.join(folder, 'meta.csv'), mode = 'w', encoding = 'utf-8') as f:
+        f.write('docid,author,firstpub,tags\n')
+        for i in range(200):
+            docid = 'vol' + str(i).zfill(3)
+            tag = 'fant' if i % 2 == 0 else 'random'
+            f.write(docid + ',author' + str(i % 37) + ',' + str(1800 + i % 90) + ',' + tag + '\n')
+            with open(os.path.join(folder, 'data', docid + '.tsv'), mode = 'w', encoding = 'utf-8') as v:
+                for j in range(12):
+                    v.write('word' + str(j) + '\t' + str(1 + (i * j) % 7) + '\n')
+
+def select_in_subprocess(folder, hashseed):
+    environment = dict(os.environ, PYTHONHASHSEED = str(hashseed))
+    output = subprocess.run([sys.executable, '-c', SELECT, REPO, folder], env = environment, cwd = folder, capture_output = True, text = True, check = True).stdout
+    return json.loads(output.strip().split('\n')[-1])
+
+def test_seeded_selection_ignores_hash_seed(tmp_path):
+    folder = str(tmp_path)
+    make_corpus(folder)
+
+    first = select_in_subprocess(folder, 1)
+    for hashseed in [2, 3]:
+        assert select_in_subprocess(folder, hashseed) == first
@@ -0,0 +1,90 @@
+# The streaming 'sgd' path: seeded runs must not depend on the global
+# random state, volumes that can't be read must not count against the
+# accuracy, and each fit should read volumes with a single pool.
+
+import os, random, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import versatiletrainer2, volumeio, workerpool
+
+def make_corpus(folder):
+    os.makedirs(os.path.join(folder, 'data'))
+    with open(os.path.join(folder, 'meta.csv'), mode = 'w', encoding = 'utf-8') as f:
+        f.write('docid,author,firstpub,tags\n')
+        for i in range(80):
+            docid = 'vol' + str(i).zfill(3)
+            tag = 'fant' if i % 2 == 0 else 'random'
+            f.write(docid + ',author' + str(i) + ',' + str(1800 + i) + ',' + tag + '\n')
+            with open(os.path.join(folder, 'data', docid + '.tsv'), mode = 'w', encoding = 'utf-8') as v:
+                for j in range(20):
+                    count = 1 + (i * (j + 3)) % 7
+                    if tag == 'fant' and j < 4:
+                        count += 4
+                    v.write('word' + str(j) + '\t' + str(count) + '\n')
+
+def train(folder, seed, globalseed):
+    random.seed(globalseed)
+    metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist = versatiletrainer2.get_simple_data(folder + '/data/', folder + '/meta.csv', folder + '/vocab.txt', {'fant'}, {'random'}, 40, numfeatures = 20, streaming = True, seed = seed)
+    os.remove(folder + '/data/' + orderedIDs[0] + '.tsv')
+    # one volume that can no longer be read
+
+    random.seed(globalseed)
+    modelparams = ('sgd', 4, 10, 21, 10, [0.001, 0.1])
+    matrix, maxaccuracy, metadata, coefficientuples, features4max, c = versatiletrainer2.tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, {'fant'}, {'random'}, modelparams, 'm', folder + '/m.csv', verbose = False, seed = seed)
+
+    return matrix, list(metadata.probability)
+
+def test_calculate_accuracy_leaves_out_missing_predictions(capsys):
+    predictions = np.array([0.9, np.nan, 0.2, np.nan])
+    classvector = np.array([1, 1, 0, 0], dtype = np.int8)
+
+    assert versatiletrainer2.calculate_accuracy(predictions, classvector, False) == 1.0
+    assert '2 volumes had no prediction' in capsys.readouterr().out
+
+def test_seeded_streaming_ignores_global_random_state(tmp_path):
+    volumeio.volumecache.set_budget(0)
+    try:
+        results = []
+        for globalseed in [1, 2]:
+            folder = str(tmp_path / str(globalseed))
+            make_corpus(folder)
+            results.append(train(folder, 5, globalseed))
+    finally:
+        volumeio.volumecache.set_budget(None)
+
+    assert np.array_equal(results[0][0], results[1][0])
+    assert np.allclose(results[0][1], results[1][1], equal_nan = True)
+    assert np.isnan(results[0][1][0])
+    assert results[0][0].max() == 1.0
+    # The unreadable volume would have cost accuracy if it were counted.
+
+def test_fit_streaming_opens_one_pool(tmp_path, monkeypatch):
+    folder = str(tmp_path)
+    make_corpus(folder)
+    volspresent = [(x, folder + '/data/' + x + '.tsv') for x in sorted(os.listdir(folder + '/data/'))]
+    vocablist = ['word' + str(j) for j in range(20)]
+    stream = versatiletrainer2.VolumeStream([(x.replace('.tsv', ''), y) for x, y in volspresent], vocablist, False, seed = 0)
+    classvector = np.array([i % 2 == 0 for i in range(len(stream))], dtype = np.int8)
+
+    opened = []
+    def counting_pool(*args, **kwargs):
+        opened.append(args)
+        return original(*args, **kwargs)
+    original = workerpool.open_pool
+    monkeypatch.setattr(workerpool, 'open_pool', counting_pool)
+    monkeypatch.setattr(versatiletrainer2, 'ingest_processes', 2)
+    monkeypatch.setattr(versatiletrainer2, 'ingest_chunksize', 1)
+
+    volumeio.volumecache.set_budget(0)
+    try:
+        scaler = stream.fold_scalers(np.zeros(len(stream), dtype = np.int32))[0]
+        opened.clear()
+        versatiletrainer2.fit_streaming(stream, classvector, np.arange(len(stream)), scaler, 0.01, 20)
+    finally:
+        volumeio.volumecache.set_budget(None)
+
+    assert len(opened) == 1
+    assert stream.pool is None
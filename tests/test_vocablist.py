@@ -0,0 +1,63 @@
+# Every reader that ranks words by document frequency counts a word
+# once for every line it appears on, as the original readers did, so a
+# word repeated within a volume counts more than once.
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import batchtrainer, logisticpredict, versatiletrainer, versatiletrainer2
+
+VOLUMES = [('a', 'the\t3\nwhale\t1\nwhale\t2\n'), ('b', 'the\t1\nship\t4\n')]
+EXPECTED = {'the': 2, 'whale': 2, 'ship': 1}
+
+def write_volumes(folder):
+    volspresent = []
+    for volid, text in VOLUMES:
+        path = os.path.join(folder, volid + '.tsv')
+        with open(path, mode = 'w', encoding = 'utf-8') as f:
+            f.write(text)
+        volspresent.append((volid, path))
+    return volspresent
+
+def read_docfreqs(vocabpath):
+    with open(vocabpath, encoding = 'utf-8') as f:
+        return {word: int(count) for word, count in [line.strip().split(',') for line in f][1 : ]}
+
+def test_make_vocablist_counts_per_line(tmp_path):
+    volspresent = write_volumes(str(tmp_path))
+    vocabpath = str(tmp_path / 'vocab.csv')
+    vocabulary = logisticpredict.make_vocablist(volspresent, 10, vocabpath)
+
+    assert read_docfreqs(vocabpath) == EXPECTED
+    assert set(vocabulary) == set(EXPECTED)
+
+def test_create_vocablist_counts_per_line(tmp_path):
+    volspresent = write_volumes(str(tmp_path))
+    vocabpath = str(tmp_path / 'vocab.csv')
+    vocabulary = versatiletrainer2.create_vocablist(volspresent, 10, vocabpath, set())
+
+    assert read_docfreqs(vocabpath) == EXPECTED
+    assert vocabulary == ['the', 'whale', 'ship']
+
+def test_older_readers_count_per_line(tmp_path):
+    volspresent = write_volumes(str(tmp_path))
+    vocabpath = str(tmp_path / 'vocab.csv')
+    versatiletrainer.make_vocablist(volspresent, 10, vocabpath)
+
+    assert read_docfreqs(vocabpath) == EXPECTED
+    assert dict(versatiletrainer.get_docfrequency(volspresent, set())) == EXPECTED
+    assert dict(logisticpredict.get_docfrequency(volspresent, set())) == EXPECTED
+
+def test_corpus_index_ranks_like_create_vocablist(tmp_path):
+    folder = str(tmp_path)
+    volspresent = write_volumes(folder)
+    with open(os.path.join(folder, 'meta.csv'), mode = 'w', encoding = 'utf-8') as f:
+        f.write('docid,author,firstpub,tags\na,x,1850,fant\nb,y,1860,random\n')
+
+    index = batchtrainer.CorpusIndex(folder, os.path.join(folder, 'meta.csv'))
+    index.load(['a', 'b'])
+    vocablist, docfreqs = index.vocabulary(['a', 'b'], 10)
+
+    assert vocablist == versatiletrainer2.create_vocablist(volspresent, 10, os.path.join(folder, 'vocab.csv'), set())
+    assert dict(zip(vocablist, docfreqs)) == EXPECTED
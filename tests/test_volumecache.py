@@ -0,0 +1,41 @@
+# The volume cache follows volumeio.cachebudget as it changes, unless
+# it has been given a budget of its own with set_budget().
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import volumeio
+
+def write_volume(folder, name):
+    path = os.path.join(folder, name + '.tsv')
+    with open(path, mode = 'w', encoding = 'utf-8') as f:
+        f.write('the\t10\nwhale\t3\n')
+    return path
+
+def test_cachebudget_is_read_when_used(tmp_path, monkeypatch):
+    cache = volumeio.VolumeCache()
+    monkeypatch.setattr(volumeio, 'volumecache', cache)
+    first = write_volume(str(tmp_path), 'first')
+    second = write_volume(str(tmp_path), 'second')
+
+    volumeio.cached_read_counts(first)
+    assert cache.key(first) in cache
+
+    monkeypatch.setattr(volumeio, 'cachebudget', 0)
+    assert cache.key(first) not in cache
+    volumeio.cached_read_counts(second)
+    assert len(cache.entries) == 0 and cache.bytes == 0
+
+def test_set_budget_overrides_cachebudget(tmp_path, monkeypatch):
+    cache = volumeio.VolumeCache()
+    monkeypatch.setattr(volumeio, 'volumecache', cache)
+    path = write_volume(str(tmp_path), 'volume')
+
+    cache.set_budget(0)
+    volumeio.cached_read_counts(path)
+    assert len(cache.entries) == 0
+
+    cache.set_budget(None)
+    volumeio.cached_read_counts(path)
+    assert cache.key(path) in cache
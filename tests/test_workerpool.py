@@ -0,0 +1,20 @@
+# A fixed number of processes is still capped by the budget of cores
+# the pool was given.
+
+import os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import workerpool
+
+def test_fixed_processes_fit_the_budget(monkeypatch):
+    monkeypatch.setattr(workerpool, 'processes', 8)
+    assert workerpool.split(cores = 2) == (2, 1)
+    assert workerpool.split(cores = 16) == (8, 2)
+
+    monkeypatch.setattr(workerpool, 'threads', 1)
+    assert workerpool.split(cores = 3) == (3, 1)
+
+def test_numthreads_ignores_fixed_processes(monkeypatch):
+    monkeypatch.setattr(workerpool, 'processes', 8)
+    assert workerpool.split(cores = 4, numthreads = 1) == (4, 1)
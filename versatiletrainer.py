@@ -119,7 +119,6 @@ import numpy as np
 import pandas as pd
 import csv, os, random, sys, datetime, pickle
 from collections import Counter
-from multiprocessing import Pool
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import StandardScaler
 
@@ -128,6 +127,9 @@ import matplotlib.pyplot as plt
 import modelingprocess
 import metafilter
 import metautils
+import poolprofile
+import volumeio
+import workerpool
 
 usedate = False
 # Leave this flag false unless you plan major
@@ -329,22 +331,19 @@ def make_vocablist(volspresent, n, vocabpath):
 
     global includespecialfeatures
 
-    sourcepaths = [x[1] for x in volspresent]
     # volspresent is a list of id, path 2-tuples created by get_volume_lists
 
     wordcounts = Counter()
+    malformed = dict()
 
-    for path in sourcepaths:
+    for volid, path in volspresent:
 
-        with open(path, encoding = 'utf-8') as f:
-            for line in f:
-                fields = line.strip().split('\t')
-                if len(fields) > 2 or len(fields) < 2:
-                    continue
-                if fields[1] != 'frequency':
-                    word = fields[0]
-                    if len(word) > 0 and not word.startswith('#bi_'):
-                        wordcounts[word] += 1
+        words, counts, malformed[volid] = volumeio.read_counts(path)
+        for word in words.tolist():
+            if len(word) > 0 and not word.startswith('#bi_'):
+                wordcounts[word] += 1
+
+    volumeio.report_malformed(malformed)
 
     with open(vocabpath, mode = 'w', encoding = 'utf-8') as f:
         writer = csv.writer(f)
@@ -394,45 +393,44 @@ def get_docfrequency(volspresent, donttrainset):
     '''
 
     wordcounts = Counter()
+    malformed = dict()
 
     for volid, volpath in volspresent:
         if volid in donttrainset:
             continue
         else:
-            with open(volpath, encoding = 'utf-8') as f:
-                for line in f:
-                    fields = line.strip().split('\t')
-                    if len(fields) > 2 or len(fields) < 2:
-                        # this is a malformed line; there are a few of them,
-                        # but not enough to be important -- ignore
-                        continue
-                    word = fields[0]
-                    if len(word) > 0 and word[0].isalpha():
-                        wordcounts[word] += 1
-                        # We're getting docfrequency (the number of documents that
-                        # contain this word), not absolute number of word occurrences.
-                        # So just add 1 no matter how many times the word occurs.
+            words, counts, malformed[volid] = volumeio.read_counts(volpath)
+            # malformed lines are skipped and counted by volumeio
+            for word in words.tolist():
+                if len(word) > 0 and word[0].isalpha():
+                    wordcounts[word] += 1
+                    # We're getting docfrequency (the number of documents that
+                    # contain this word), not absolute number of word occurrences.
+                    # So just add 1 no matter how many times the word occurs.
+
+    volumeio.report_malformed(malformed)
 
     return wordcounts
 
 def model_call(quintuplets, algorithm):
     '''
     Invokes multiprocessing to distribute n-fold crossvalidation
-    simultaneously across multiple threads. Since I'm usually doing this
-    on a computer with 12 cores, I set 12 threads.
+    simultaneously across multiple processes, split between processes
+    and BLAS threads by workerpool.split().
     '''
 
     print('Beginning multiprocessing.')
-    pool = Pool(processes = 12)
+    data = quintuplets[0][0]
+    pool = workerpool.open_pool(rows = data.shape[0], features = data.shape[1], tasks = len(quintuplets))
 
     if algorithm == 'logistic':
-        res = pool.map_async(modelingprocess.model_volume_list, quintuplets)
+        res = pool.map_async(*poolprofile.wrap(modelingprocess.model_volume_list, quintuplets))
     else:
-        res = pool.map_async(modelingprocess.svm_model, quintuplets)
+        res = pool.map_async(*poolprofile.wrap(modelingprocess.svm_model, quintuplets))
 
     # After all files are processed, write metadata, errorlog, and counts of phrases.
     res.wait()
-    resultlist = res.get()
+    resultlist = poolprofile.unwrap(res.get())
     pool.close()
     pool.join()
     print('Multiprocessing concluded.')
@@ -669,22 +667,11 @@ def get_dataframe(metadict, volspresent, classdictionary, vocablist, freqs_alrea
     voldata = list()
     classvector = list()
 
-    for volid, volpath in volspresent:
+    malformed = dict()
 
-        with open(volpath, encoding = 'utf-8') as f:
-            voldict = dict()
-            totalcount = 0
-            for line in f:
-                fields = line.strip().split('\t')
-                if len(fields) > 2 or len(fields) < 2:
-                    continue
+    for volid, volpath in volspresent:
 
-                word = fields[0]
-                if fields[1] == 'frequency':
-                    continue
-                count = float(fields[1])
-                voldict[word] = count
-                totalcount += count
+        voldict, totalcount, malformed[volid] = volumeio.read_voldict(volpath)
 
         features = get_features(voldict, vocablist)
         if totalcount == 0:
@@ -698,6 +685,8 @@ def get_dataframe(metadict, volspresent, classdictionary, vocablist, freqs_alrea
         classflag = classdictionary[volid]
         classvector.append(classflag)
 
+    volumeio.report_malformed(malformed)
+
     masterdata = pd.DataFrame(voldata)
 
     return masterdata, classvector, metadict
@@ -757,12 +746,10 @@ def get_data_for_model(paths, exclusions, classifyconditions):
 
     for filename in allthefiles:
 
-        if filename.endswith(extension):
-            volID = filename.replace(extension, "")
-            # The volume ID is basically the filename minus its extension.
-            # Extensions are likely to be long enough that there is little
-            # danger of accidental occurrence inside a filename. E.g.
-            # '.fic.tsv'
+        volID = volumeio.volume_id(filename, extension)
+        if volID is not None:
+            # The volume ID is basically the filename minus its extension
+            # (and minus .gz, .bz2 or .zst, if the volume is compressed).
             path = sourcefolder + filename
             volumeIDs.append(volID)
             volumepaths.append(path)
@@ -833,7 +820,11 @@ def get_data_for_model(paths, exclusions, classifyconditions):
 
     # This list will include for ALL volumes, the indexes of vols in the donttrainset.
 
-    donttrainon = [orderedIDs.index(x) for x in donttrainset]
+    rowcodes = {anid: i for i, anid in enumerate(orderedIDs)}
+    # maps each volume ID to its position in orderedIDs, so we don't
+    # have to search the list every time we need a position
+
+    donttrainon = [rowcodes[x] for x in donttrainset]
 
     authormatches = [list(donttrainon) for x in range(len(orderedIDs))]
 
@@ -869,9 +860,9 @@ def get_data_for_model(paths, exclusions, classifyconditions):
             continue
 
         if thisclass == 1:
-            trainingpositives.add(orderedIDs.index(anid))
+            trainingpositives.add(rowcodes[anid])
         else:
-            trainingnegatives.add(orderedIDs.index(anid))
+            trainingnegatives.add(rowcodes[anid])
 
     print('Training positives: ' + str(len(trainingpositives)))
     print('Training negatives: ' + str(len(trainingnegatives)))
@@ -963,14 +954,14 @@ def apply_pickled_model(amodelpath, folder, extension, metapath):
     resultindex = []
 
     for doc in metadata.index:
-        inpath = os.path.join(folder, doc + extension)
-        if os.path.exists(inpath):
+        inpath = volumeio.find_volume(folder, doc, extension)
+        if inpath is not None:
             volspresent.append( (doc, inpath) )
             classdictionary[doc] = 0
             metadict[doc] = dict()
             resultindex.append(doc)
         else:
-            print(inpath)
+            print(os.path.join(folder, doc + extension))
 
     print(len(volspresent))
 
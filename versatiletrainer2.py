@@ -55,9 +55,8 @@
 
 import numpy as np
 import pandas as pd
-import csv, os, random, sys, datetime, pickle
+import csv, os, random, shutil, sys, datetime, pickle, tempfile, hashlib, time
 from collections import Counter
-from multiprocessing import Pool
 from sklearn.linear_model import LogisticRegression
 from sklearn.preprocessing import StandardScaler
 
@@ -65,12 +64,60 @@ import matplotlib.pyplot as plt
 
 import modelingprocess
 import metaselector
+import efreader
+import poolprofile
+import stagelog
+import volumeio
+import workerpool
 
 usedate = False
 # Leave this flag false unless you plan major
 # surgery to reactivate the currently-deprecated
 # option to use "date" as a predictive feature.
 
+sgd_batchsize = 256
+sgd_epochs = 5
+# With the 'sgd' algorithm and streaming = True, models are trained
+# on mini-batches of sgd_batchsize volumes, making sgd_epochs passes
+# through the training set.
+
+ingest_processes = None
+ingest_chunksize = 16
+ingest_batchsize = 1024
+# Volumes are read and parsed by a pool of ingest_processes
+# workers (by default, one per core; see workerpool.py),
+# ingest_chunksize volumes per task. We never have more
+# than two batches of ingest_batchsize parsed volumes in flight at
+# once. With fewer than ingest_processes * ingest_chunksize volumes
+# to read we just read them in this process. Parsed volumes are
+# kept in volumeio.volumecache, so the next model that uses the
+# same volumes doesn't read them again.
+
+checkpointfolder = None
+checkpoint_predictions = False
+# If checkpointfolder is set, tune_a_model() records each cell of the
+# grid search there as it's completed (see GridCheckpoint), so a run
+# that dies part of the way through can be restarted without redoing
+# the cells it finished. Set checkpoint_predictions to keep each cell's
+# crossvalidated predictions as well as its accuracy; that makes the
+# checkpoint larger, but spares us the final crossvalidation.
+#
+# A checkpoint is found again by a hash of the model's selection, and
+# an unseeded selection comes out different every run, so a restarted
+# run would never find its checkpoint (and would leave the old one
+# behind). tune_a_model() therefore refuses to checkpoint without a
+# seed; pass the same seed to get_simple_data() (or batchtrainer's
+# functions) and tune_a_model(), so the selection is the same too.
+
+resultcache = None
+# If resultcache is set to a folder, tune_a_model() keeps the results
+# of every model there, under a hash of its selection, vocabulary,
+# data, folds, algorithm and grid. A later run of an identical problem (from
+# any script) gets the stored results and files instead of training
+# again. Selections and folds are random, so an identical problem only
+# comes up again if they are seeded; see the seed arguments of
+# get_simple_data() and tune_a_model().
+
 # FUNCTIONS GET DEFINED BELOW.
 
 def get_features(wordcounts, wordlist):
@@ -136,24 +183,27 @@ def create_vocablist(volspresent, n, vocabpath, forbidden):
     Makes a list of the top n words in sourcedir, and writes it
     to vocabpath. Notice that we are ranking words by document
     frequency: that is, by the number of documents they occur in.
+    (Strictly, the number of lines that list them; a volume that
+    lists a word twice counts twice, as it always has.)
     '''
 
-    sourcepaths = [x[1] for x in volspresent]
     # volspresent is a list of id, path 2-tuples created by get_volume_lists
 
     wordcounts = Counter()
+    malformed = dict()
+    failed = dict()
 
-    for path in sourcepaths:
+    for volid, words, counts, badlines, error in ingest_volumes(volspresent):
+        if error is not None:
+            failed[volid] = error
+            continue
+        malformed[volid] = badlines
+        for word in words.tolist():
+            if word not in forbidden and len(word) > 0:
+                wordcounts[word] += 1
 
-        with open(path, encoding = 'utf-8') as f:
-            for line in f:
-                fields = line.strip().split('\t')
-                if len(fields) > 2 or len(fields) < 2:
-                    continue
-                if fields[1] != 'frequency':
-                    word = fields[0]
-                    if word not in forbidden and len(word) > 0:
-                        wordcounts[word] += 1
+    volumeio.report_malformed(malformed)
+    report_failures(failed)
 
     with open(vocabpath, mode = 'w', encoding = 'utf-8') as f:
         writer = csv.writer(f)
@@ -191,94 +241,157 @@ def get_vocablist(vocabpath, volspresent, n, forbidden):
 
     return vocablist
 
-def model_call(quintuplets, algorithm):
+def open_pool(data, classvector, foldlabels, tasks = None, cores = None):
+    '''
+    Starts a pool of processes, each of which holds the data matrix,
+    class vector and fold labels (see modelingprocess.init_shared),
+    so tasks only need to say which fold, how many features and what
+    regularization to use. The pool's cores (by default, all of them)
+    are split between processes and BLAS threads by workerpool.split(),
+    according to the size of the matrix and the number of tasks.
+    '''
+
+    if isinstance(data, pd.DataFrame):
+        data = data.values
+    else:
+        data = np.asarray(data)
+
+    rows, features = data.shape
+
+    return workerpool.open_pool(cores, rows = rows, features = features, tasks = tasks, initializer = modelingprocess.init_shared, initargs = (data, classvector, foldlabels))
+
+def share_with_pool(data, classvector, foldlabels):
+    '''
+    For a pool that wasn't opened with this model's data (one shared by
+    many models, as in batchtrainer.py), writes the data matrix, class
+    vector and fold labels to a temporary folder, and returns the folder.
+    Tasks that name it as their datakey are run on those arrays. The
+    caller should remove the folder when the model is finished.
+    '''
+
+    if isinstance(data, pd.DataFrame):
+        data = data.values
+
+    datakey = tempfile.mkdtemp(prefix = 'sharedmodel')
+    modelingprocess.save_shared(datakey, data, classvector, foldlabels)
+
+    return datakey
+
+def fold_tasks(foldlabels, algorithm, regu_const, numfeatures, datakey = None):
+    '''
+    One task for each fold, in the form modelingprocess.model_fold() expects.
+    '''
+
+    numfolds = int(foldlabels.max()) + 1
+
+    return [(datakey, algorithm, foldnumber, numfeatures, regu_const) for foldnumber in range(numfolds)]
+
+def assemble_predictions(resultlist, foldlabels):
+    '''
+    Puts the predictions for each fold back in row order. For a model
+    of more than two classes, each fold's predictions are a matrix
+    with a column for each class, and so is the result.
+    '''
+
+    if np.ndim(resultlist[0]) == 2:
+        predictions = np.full((len(foldlabels), resultlist[0].shape[1]), np.nan)
+    else:
+        predictions = np.full(len(foldlabels), np.nan)
+    for foldnumber, results in enumerate(resultlist):
+        predictions[foldlabels == foldnumber] = results
+
+    return predictions
+
+def model_call(tasks, pool):
     '''
     Invokes multiprocessing to distribute n-fold crossvalidation
-    simultaneously across multiple threads. Since I'm usually doing this
-    on a computer with 12 cores, I set 12 threads.
+    simultaneously across multiple processes.
     '''
 
     print('Beginning multiprocessing.')
-    pool = Pool(processes = 12)
 
-    if algorithm == 'logistic':
-        res = pool.map_async(modelingprocess.model_volume_list, quintuplets)
-    else:
-        res = pool.map_async(modelingprocess.svm_model, quintuplets)
+    function, tasks = poolprofile.wrap(modelingprocess.model_fold, tasks)
+    resultlist = poolprofile.unwrap(pool.map(function, tasks))
 
-    # After all files are processed, write metadata, errorlog, and counts of phrases.
-    res.wait()
-    resultlist = res.get()
-    pool.close()
-    pool.join()
     print('Multiprocessing concluded.')
 
     return resultlist
 
-def crossvalidate(data, classvector, folds, algorithm, regu_const):
+def crossvalidate(data, classvector, foldlabels, algorithm, regu_const, numfeatures = None, pool = None, datakey = None):
     '''
-    Creates a set of tuples that can be sent to a multiprocessing Pool,
-    one "quintuplet" for each thread.
+    Creates a task for each fold, to be sent to a pool whose processes
+    already hold the data (see open_pool), or can find it at datakey
+    (see share_with_pool). Each task models the first numfeatures
+    columns, or all of them if numfeatures is None.
+    Returns an array of predicted probabilities, one for each row.
+
+    If a pool isn't provided, we open one for the occasion.
     '''
-    quintuplets = list()
-    foldindices = []
-    for fold in folds:
-        foldindices, foldids = tuple(zip(*fold))
-        foldindices = list(foldindices)
-        foldids = list(foldids)
-        # we package each fold as a zipped list of numeric-index, id pairs
 
-        aquintuple = data, classvector, foldids, foldindices, regu_const
-        quintuplets.append(aquintuple)
+    if numfeatures is None:
+        numfeatures = data.shape[1]
 
-    # Now do crossvalidation.
-    resultlist = model_call(quintuplets, algorithm)
+    if isinstance(data, VolumeStream):
+        return crossvalidate_streaming(data, classvector, foldlabels, regu_const, numfeatures)
 
-    assert len(resultlist) == len(folds)
+    tasks = fold_tasks(foldlabels, algorithm, regu_const, numfeatures, datakey)
 
-    predictions = dict()
-    for results, fold in zip(resultlist, folds):
-        assert len(results) == len(fold)
-        foldindices, foldids = tuple(zip(*fold))
-        for r, volid in zip(results, foldids):
-            predictions[volid] = r
+    if pool is None:
+        temporarypool = open_pool(data, classvector, foldlabels, tasks = len(tasks))
+        try:
+            resultlist = model_call(tasks, temporarypool)
+        finally:
+            temporarypool.close()
+            temporarypool.join()
+    else:
+        resultlist = model_call(tasks, pool)
 
-    return predictions
+    return assemble_predictions(resultlist, foldlabels)
 
-def calculate_accuracy(orderedIDs, predictions, classdictionary, verbose):
+def calculate_accuracy(predictions, classvector, verbose):
     '''
-    What it says on the tin.
+    What it says on the tin. Predictions and classvector are
+    both arrays with one entry per row of the data.
+
+    If predictions is a matrix of probabilities for several classes,
+    each row is predicted to be the class with the highest probability.
+
+    Rows without a prediction (NaN, for volumes a VolumeStream couldn't
+    read) are left out, and we say how many.
     '''
 
-    truepositives = 0
-    truenegatives = 0
-    falsepositives = 0
-    falsenegatives = 0
-    totalcount = 0
+    predictions = np.asarray(predictions, dtype = np.float64)
+    classvector = np.asarray(classvector)
+
+    if np.ndim(predictions) == 2:
+        scored = ~np.isnan(predictions).any(axis = 1)
+    else:
+        scored = ~np.isnan(predictions)
 
-    for volid in orderedIDs:
+    if not np.all(scored):
+        print(str(int(np.sum(~scored))) + ' volumes had no prediction, and were left out of the accuracy.')
+        predictions = predictions[scored]
+        classvector = classvector[scored]
 
-        totalcount += 1
+    if np.ndim(predictions) == 2:
+        predictedclass = predictions.argmax(axis = 1)
+        accuracy = float(np.mean(predictedclass == classvector))
 
-        # The donttrainset contains volids that are *only* ever
-        # being predicted, and do not appear in the training set for
-        # any fold of crossvalidation.
+        if verbose:
+            for classlabel in range(predictions.shape[1]):
+                inclass = classvector == classlabel
+                print('Class ' + str(classlabel) + ': ' + str(int(np.sum(predictedclass[inclass] == classlabel))) + ' of ' + str(int(np.sum(inclass))) + ' correct')
 
-        # We're not going to count the donttrainset in assessing
-        # accuracy during gridsearch, because we're not trying to
-        # *optimize* on it.
+        return accuracy
 
-        probability = predictions[volid]
-        realclass = classdictionary[volid]
+    predictedpositive = predictions > 0.5
+    reallypositive = classvector > 0.5
 
-        if probability > 0.5 and classdictionary[volid] > 0.5:
-            truepositives += 1
-        elif probability <= 0.5 and classdictionary[volid] < 0.5:
-            truenegatives += 1
-        elif probability <= 0.5 and classdictionary[volid] > 0.5:
-            falsenegatives += 1
-        elif probability > 0.5 and classdictionary[volid] < 0.5:
-            falsepositives += 1
+    truepositives = int(np.sum(predictedpositive & reallypositive))
+    truenegatives = int(np.sum(~predictedpositive & ~reallypositive))
+    falsepositives = int(np.sum(predictedpositive & ~reallypositive))
+    falsenegatives = int(np.sum(~predictedpositive & reallypositive))
+    totalcount = len(classvector)
 
     print()
 
@@ -296,12 +409,213 @@ def calculate_accuracy(orderedIDs, predictions, classdictionary, verbose):
 
     return accuracy
 
-def gridsearch(featurestart, featureend, featurestep, c_range, masterdata, orderedIDs, folds, algorithm, classdictionary, classvector):
+class GridCheckpoint:
+    '''
+    A record of the completed cells of a grid search, kept in a file
+    named by a hash of the selection (volume IDs, classes, vocabulary),
+    the algorithm and the number of folds. The file is a series of
+    pickles: first the fold labels, then one (numfeatures, C, accuracy,
+    predictions) record for each cell, appended and flushed to disk as
+    the cell is finished.
+
+    Folds are drawn at random, so the first run's fold labels are kept,
+    and a restarted run uses them instead of drawing new ones; that way
+    its cells are comparable with the ones already recorded.
+    '''
+
+    def __init__(self, folder, orderedIDs, classvector, vocablist, algorithm, k):
+        self.key = selection_key(orderedIDs, classvector, vocablist, algorithm, k)
+        self.path = os.path.join(folder, self.key + '.gridcheckpoint')
+        self.foldlabels = None
+        self.cells = dict()
+
+        os.makedirs(folder, exist_ok = True)
+        if os.path.isfile(self.path):
+            self.load()
+
+    def load(self):
+        '''
+        Reads the records in the file. If the last one was cut short
+        (the process died while writing it), we truncate the file
+        after the last complete record.
+        '''
+
+        goodbytes = 0
+        with open(self.path, mode = 'rb') as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except (EOFError, pickle.UnpicklingError, ValueError, AttributeError, IndexError):
+                    break
+
+                if self.foldlabels is None:
+                    self.foldlabels = record
+                else:
+                    numfeatures, regu_const, accuracy, predictions = record
+                    self.cells[(numfeatures, regu_const)] = (accuracy, predictions)
+
+                goodbytes = f.tell()
+
+        if goodbytes < os.path.getsize(self.path):
+            with open(self.path, mode = 'r+b') as f:
+                f.truncate(goodbytes)
+
+        if self.foldlabels is not None:
+            print('Checkpoint ' + self.path + ': ' + str(len(self.cells)) + ' cells already done.')
+
+    def append(self, record):
+        with open(self.path, mode = 'ab') as f:
+            pickle.dump(record, f)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, foldlabels):
+        if self.foldlabels is None:
+            self.foldlabels = foldlabels
+            self.append(foldlabels)
+
+    def record(self, numfeatures, regu_const, accuracy, predictions = None):
+        if not checkpoint_predictions:
+            predictions = None
+        self.cells[(numfeatures, regu_const)] = (accuracy, predictions)
+        self.append((numfeatures, regu_const, accuracy, predictions))
+
+    def predictions(self, numfeatures, regu_const):
+        ''' The stored predictions for a cell, or None. '''
+
+        if (numfeatures, regu_const) in self.cells:
+            return self.cells[(numfeatures, regu_const)][1]
+        else:
+            return None
+
+    def remove(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+def selection_key(orderedIDs, classvector, vocablist, algorithm, k):
+    '''
+    A hash identifying a modeling problem: which volumes, in which
+    classes, modeled with what vocabulary, algorithm and number of folds.
+    '''
+
+    digest = hashlib.sha1()
+    digest.update('\n'.join([str(x) for x in orderedIDs]).encode('utf-8'))
+    digest.update(np.asarray(classvector, dtype = np.int64).tobytes())
+    digest.update('\n'.join(vocablist).encode('utf-8'))
+    digest.update((str(algorithm) + '\t' + str(k) + '\t' + str(usedate)).encode('utf-8'))
+
+    return digest.hexdigest()
+
+def data_digest(masterdata):
+    '''
+    A hash of the data a selection's IDs resolved to: the values of
+    the matrix, or for a VolumeStream (which has no matrix), the path,
+    size and modification time of every volume.
+    '''
+
+    digest = hashlib.sha1()
+
+    if isinstance(masterdata, VolumeStream):
+        for volid, volpath in masterdata.volspresent:
+            try:
+                stat = os.stat(volpath)
+                digest.update((volpath + '\t' + str(stat.st_size) + '\t' + str(stat.st_mtime_ns) + '\n').encode('utf-8'))
+            except OSError:
+                digest.update((volpath + '\tmissing\n').encode('utf-8'))
+    else:
+        values = np.ascontiguousarray(np.asarray(masterdata, dtype = np.float64))
+        digest.update(str(values.shape).encode('utf-8'))
+        digest.update(values.tobytes())
+
+    return digest.hexdigest()
+
+def result_key(orderedIDs, classvector, vocablist, foldlabels, modelparams, write_fullmodel, masterdata):
+    '''
+    A hash identifying everything that determines the results of
+    tune_a_model(): the selection, the data it resolved to, the folds,
+    and the grid searched. The data matters because the same IDs may
+    be read from another folder, or a corpus extracted again.
+    '''
+
+    algorithm, k, featurestart, featureend, featurestep, crange = modelparams
+
+    digest = hashlib.sha1()
+    digest.update(selection_key(orderedIDs, classvector, vocablist, algorithm, k).encode('utf-8'))
+    digest.update(data_digest(masterdata).encode('utf-8'))
+    digest.update(np.asarray(foldlabels, dtype = np.int64).tobytes())
+    grid = [featurestart, featureend, featurestep, list(crange), write_fullmodel]
+    digest.update(repr(grid).encode('utf-8'))
+
+    return digest.hexdigest()
+
+def cached_result(resultkey):
+    '''
+    Returns the results stored in resultcache for a key, as a tuple
+    (matrix, maxaccuracy, features4max, c, coefficientuples, predicted),
+    or None if there aren't any.
+    '''
+
+    resultpath = os.path.join(resultcache, resultkey, 'result.pkl')
+    if not os.path.isfile(resultpath):
+        return None
+
+    with open(resultpath, mode = 'rb') as f:
+        return pickle.load(f)
+
+def store_result(resultkey, outputpath, result):
+    '''
+    Stores a model's results, and copies of its .pkl and .coefs.csv
+    files, in resultcache. The entry is written to a temporary folder
+    and renamed into place, so a half-written entry is never found.
+    '''
+
+    os.makedirs(resultcache, exist_ok = True)
+    tempfolder = tempfile.mkdtemp(prefix = 'tmp', dir = resultcache)
+
+    with open(os.path.join(tempfolder, 'result.pkl'), mode = 'wb') as f:
+        pickle.dump(result, f)
+    shutil.copyfile(outputpath.replace('.csv', '.pkl'), os.path.join(tempfolder, 'model.pkl'))
+    shutil.copyfile(outputpath.replace('.csv', '.coefs.csv'), os.path.join(tempfolder, 'coefs.csv'))
+
+    try:
+        os.rename(tempfolder, os.path.join(resultcache, resultkey))
+    except OSError:
+        shutil.rmtree(tempfolder, ignore_errors = True)
+        # someone else stored the same result first
+
+def copy_cached_artefacts(resultkey, outputpath, positive_tags, negative_tags):
+    '''
+    Writes the .pkl and .coefs.csv files for outputpath from a cache
+    entry. The model's name and tags are those of the current run,
+    since an identical problem may go by another name.
+    '''
+
+    entry = os.path.join(resultcache, resultkey)
+    shutil.copyfile(os.path.join(entry, 'coefs.csv'), outputpath.replace('.csv', '.coefs.csv'))
+
+    modelpath = outputpath.replace('.csv', '.pkl')
+    with open(os.path.join(entry, 'model.pkl'), mode = 'rb') as f:
+        model = pickle.load(f)
+    model['positivelabel'] = positive_tags
+    model['negativelabel'] = negative_tags
+    model['name'] = modelpath.split('/')[-1].replace('.pkl', '')
+    with open(modelpath, 'wb') as output:
+        pickle.dump(model, output)
+
+def gridsearch(featurestart, featureend, featurestep, c_range, masterdata, foldlabels, algorithm, classvector, pool = None, datakey = None, checkpoint = None):
     '''
     Does a grid search cross a range of feature counts and
     C values. The assumption is that we're always taking the top
     x words in the vocabulary.
 
+    If a GridCheckpoint is provided, cells it has already recorded
+    are skipped, and each new cell is recorded as it's finished.
+
+    Every cell of the grid is sent to the pool at once, so workers
+    don't sit idle while the slowest fold of each cell finishes.
+    If a pool is provided, its workers find the data at datakey
+    (see share_with_pool); otherwise we open a pool for the search.
+
     Note that the matrix will actually display with the "x axis"
     on the side, and the "y axis" at the bottom. Sorry!
     '''
@@ -316,19 +630,66 @@ def gridsearch(featurestart, featureend, featurestep, c_range, masterdata, order
     ylen = len(yaxis)
     matrix = np.zeros((xlen, ylen))
 
-    for xpos, variablecount in enumerate(xaxis):
-        data = masterdata.iloc[ : , 0 : variablecount]
+    todo = []
+    for xpos, ypos in np.ndindex(xlen, ylen):
+        if checkpoint is not None and (xaxis[xpos], yaxis[ypos]) in checkpoint.cells:
+            matrix[xpos, ypos] = checkpoint.cells[(xaxis[xpos], yaxis[ypos])][0]
+        else:
+            todo.append((xpos, ypos))
 
-        for ypos, regu_const in enumerate(yaxis):
+    if len(todo) < xlen * ylen:
+        print('Grid search: ' + str(xlen * ylen - len(todo)) + ' cells restored from checkpoint.')
 
+    if isinstance(masterdata, VolumeStream):
+        for xpos, ypos in todo:
+            variablecount = xaxis[xpos]
+            regu_const = yaxis[ypos]
             print('variablecount: ' + str(variablecount) + "  regularization: " + str(regu_const))
-
-            predictions = crossvalidate(data, classvector, folds, algorithm, regu_const)
-
-            accuracy = calculate_accuracy(orderedIDs, predictions, classdictionary, False)
+            with stagelog.stage('cell', features = variablecount, c = regu_const) as record:
+                predictions = crossvalidate(masterdata, classvector, foldlabels, algorithm, regu_const, numfeatures = variablecount)
+                accuracy = calculate_accuracy(predictions, classvector, False)
+                record['accuracy'] = accuracy
+                record['unscored'] = int(np.sum(np.isnan(predictions)))
             print('Accuracy: ' + str(accuracy))
             print()
             matrix[xpos, ypos] = accuracy
+            if checkpoint is not None:
+                checkpoint.record(variablecount, regu_const, accuracy, predictions)
+
+    else:
+        ownpool = pool is None and len(todo) > 0
+        if ownpool:
+            pool = open_pool(masterdata, classvector, foldlabels, tasks = len(todo) * (int(foldlabels.max()) + 1))
+            datakey = None
+            # The workers get the whole matrix once; each cell of the grid
+            # just tells them how many columns to use.
+
+        try:
+            pending = []
+            for xpos, ypos in todo:
+                tasks = fold_tasks(foldlabels, algorithm, yaxis[ypos], xaxis[xpos], datakey)
+                pending.append(pool.map_async(*poolprofile.wrap(modelingprocess.timed_fold, tasks)))
+
+            print('Grid search: ' + str(len(pending)) + ' cells sent to the pool.')
+            sent = time.perf_counter()
+
+            for cellnum, (xpos, ypos) in enumerate(todo):
+                timedresults = poolprofile.unwrap(pending[cellnum].get())
+                predictions = assemble_predictions([x[0] for x in timedresults], foldlabels)
+                print('variablecount: ' + str(xaxis[xpos]) + "  regularization: " + str(yaxis[ypos]))
+                accuracy = calculate_accuracy(predictions, classvector, False)
+                stagelog.report('cell', sum([x[1] for x in timedresults]), cpu = sum([x[2] for x in timedresults]), workerpeak = max([x[3] for x in timedresults]), elapsed = time.perf_counter() - sent, features = xaxis[xpos], c = yaxis[ypos], accuracy = accuracy)
+                # wall and cpu are the workers' own times for the cell's
+                # folds; elapsed is the time since the grid was sent.
+                print('Accuracy: ' + str(accuracy))
+                print()
+                matrix[xpos, ypos] = accuracy
+                if checkpoint is not None:
+                    checkpoint.record(xaxis[xpos], yaxis[ypos], accuracy, predictions)
+        finally:
+            if ownpool:
+                pool.close()
+                pool.join()
 
     if showmap:
         plt.rcParams["figure.figsize"] = [9.0, 6.0]
@@ -343,43 +704,35 @@ def gridsearch(featurestart, featureend, featurestep, c_range, masterdata, order
 
     return matrix, features4max, c4max, matrix.max()
 
-def create_folds(k, orderedIDs, authormatches, classdictionary):
+def create_folds(k, classvector, authormatches, rng = random):
     '''
-    Does k-fold crossvalidation. Returns a list of "folds," which will
-    be a list of lists [ [], [], [], etc. ],
-    where each sublist is a list of two-tuples (), (), ()
-    of which the first element is the index of a volume in orderedIDs,
-    and the second element the volume ID itself.
+    Does k-fold crossvalidation. Returns an int32 array with one
+    entry for each row (each position in orderedIDs): the number of
+    the fold in which that row is held out. Works by the same author
+    always go in the same fold. Classes are numbered from 0; there
+    can be more than two. Rows are shuffled with rng, which can be a
+    seeded random.Random to make the folds reproducible.
     '''
 
-    folds = [[] for x in range(k)]
-    # e.g. k == 10 will produce: [[], [], [], [], [], [], [], [], [], []]
+    foldlabels = np.full(len(classvector), -1, dtype = np.int32)
 
     assignedinclass = dict()
-    assignedinclass[0] = [0 for x in range(k)]
-    assignedinclass[1] = [0 for x in range(k)]
+    for classlabel in range(max(int(np.max(classvector)) + 1, 2)):
+        assignedinclass[classlabel] = [0 for x in range(k)]
 
     # we make an effort to keep the classes balanced across folds
 
+    randomizedrows = list(range(len(classvector)))
+    rng.shuffle(randomizedrows)
 
-    ids_to_distribute = set(orderedIDs)
-    nextbin = 0
-
-    randomizedtuples = list(zip(list(range(len(orderedIDs))), orderedIDs))
-    random.shuffle(randomizedtuples)
-
-    for i, anid in randomizedtuples:
-        if anid in ids_to_distribute:
-            classlabel = classdictionary[anid]
+    for i in randomizedrows:
+        if foldlabels[i] < 0:
+            classlabel = int(classvector[i])
             thisclasscounts = assignedinclass[classlabel]
-            ascending = sorted(thisclasscounts)
-            whichlowest = thisclasscounts.index(ascending[0])
-
-            nextbin = whichlowest
+            nextbin = thisclasscounts.index(min(thisclasscounts))
 
-            folds[nextbin].append((i, anid))
+            foldlabels[i] = nextbin
             assignedinclass[classlabel][nextbin] += 1
-            ids_to_distribute.remove(anid)
 
             for anotheridx in authormatches[i]:
                 if anotheridx == i:
@@ -387,103 +740,477 @@ def create_folds(k, orderedIDs, authormatches, classdictionary):
                     # for some reason I've made everything a member
                     # of its own authormatch list
 
-                anotherid = orderedIDs[anotheridx]
-                folds[nextbin].append((anotheridx, anotherid))
-                classlabel = classdictionary[anotherid]
+                foldlabels[anotheridx] = nextbin
+                classlabel = int(classvector[anotheridx])
                 assignedinclass[classlabel][nextbin] += 1
 
-                if anotherid in ids_to_distribute:
-                    ids_to_distribute.remove(anotherid)
-                    # but notice, we assign anotherid even if it has already
-                    # been assigned elsewhere; all the donottrain volumes
-                    # need to be in all folds
+    for classlabel in assignedinclass:
+        print(assignedinclass[classlabel])
 
-    print(assignedinclass[0])
-    print(assignedinclass[1])
+    return foldlabels
 
-    return folds
-
-def leave_one_out_folds(orderedIDs, authormatches, classdictionary):
+def leave_one_out_folds(numrows, authormatches):
     '''
-    Makes folds for leave-one-out crossvalidation.
+    Makes folds for leave-one-out crossvalidation: each fold holds
+    out a volume along with the other works by the same author.
+    Returns fold labels, like create_folds().
     '''
 
-    folds = []
-    alreadyassigned = set()
+    foldlabels = np.full(numrows, -1, dtype = np.int32)
+    numfolds = 0
 
     # our strategy is to create folds only if they contain an index
     # not already assigned
 
     for matchlist in authormatches:
-        allassigned = True
-        for idx in matchlist:
-            if idx not in alreadyassigned:
-                allassigned = False
-
-        if not allassigned:
-            afold = [(x, orderedIDs[x]) for x in matchlist]
-            folds.append(afold)
-            for item in matchlist:
-                alreadyassigned.add(item)
+        if np.any(foldlabels[matchlist] < 0):
+            foldlabels[matchlist] = numfolds
+            numfolds += 1
 
     # confirm we got everything
 
-    print([len(x) for x in folds])
-    print(len(folds))
+    print(np.bincount(foldlabels[foldlabels >= 0]).tolist())
+    print(numfolds)
+
+    assert np.all(foldlabels >= 0)
+
+    return foldlabels
+
+def match_authors(metadata, holdout_authors = True):
+    '''
+    For each row of metadata, returns an int32 array of the rows by
+    the same author (including the row itself), in descending order,
+    so the same author is never in both the training and test sets.
+    Volumes with no author get an empty array: they match no other
+    row, and are assigned to folds on their own.
+    '''
 
-    assert alreadyassigned == set(range(len(orderedIDs)))
+    numrows = len(metadata)
 
-    return folds
+    if not holdout_authors:
+        return [np.array([], dtype = np.int32) for x in range(numrows)]
+
+    authorcodes, authors = pd.factorize(metadata['author'])
+    rows = np.arange(numrows, dtype = np.int32)
+    order = np.argsort(authorcodes, kind = 'stable')
+    boundaries = np.flatnonzero(np.diff(authorcodes[order])) + 1
+    groups = np.split(rows[order], boundaries)
+
+    bycode = dict()
+    for group in groups:
+        bycode[authorcodes[group[0]]] = group[ : : -1]
+
+    authormatches = []
+    for i in range(numrows):
+        if authorcodes[i] < 0:
+            authormatches.append(np.array([], dtype = np.int32))
+        else:
+            authormatches.append(bycode[authorcodes[i]])
+
+    return authormatches
+
+def get_voldict(volpath):
+    '''
+    Reads a single volume, stored as word<tab>count lines (possibly
+    compressed), and returns a dictionary mapping words to counts,
+    along with the sum of all the counts in the volume. HathiTrust
+    Extended Features files (.json.bz2) are read by efreader.
+    '''
+
+    if efreader.is_ef_path(volpath):
+        return efreader.read_ef_volume(volpath)
+
+    voldict, totalcount, malformed = volumeio.read_voldict(volpath)
+
+    return voldict, totalcount
+
+def read_counts_safely(volpath):
+    '''
+    Runs in a worker process. Returns the words, counts and number of
+    malformed lines in a volume, plus None; or, if the volume can't be
+    read, (None, None, 0, error message).
+    '''
+
+    try:
+        if efreader.is_ef_path(volpath):
+            voldict, totalcount = efreader.read_ef_volume(volpath)
+            words = np.array(list(voldict.keys()), dtype = object)
+            counts = np.array(list(voldict.values()), dtype = np.float64)
+            return words, counts, 0, None
+        else:
+            words, counts, malformed = volumeio.read_counts(volpath)
+            return words, counts, malformed, None
+
+    except Exception as e:
+        return None, None, 0, type(e).__name__ + ': ' + str(e)
+
+def dispatch_batch(batch, pool):
+    '''
+    Looks up each volume in a batch in the volume cache, and starts
+    reading the ones that aren't there, in the pool if we have one.
+    '''
+
+    keys = [volumeio.volumecache.key(volpath) for volid, volpath in batch]
+    cached = [volumeio.volumecache.get(key) for key in keys]
+    toread = [volpath for (volid, volpath), entry in zip(batch, cached) if entry is None]
+
+    if pool is None:
+        pending = [read_counts_safely(x) for x in toread]
+    else:
+        pending = pool.map_async(read_counts_safely, toread, chunksize = ingest_chunksize)
+
+    return batch, keys, cached, pending
+
+def collect_batch(batch, keys, cached, pending):
+    '''
+    Yields the volumes of a batch in order, taking each from the cache
+    or from what was read, and caching what was read successfully.
+    '''
+
+    if isinstance(pending, list):
+        results = iter(pending)
+    else:
+        results = iter(pending.get())
+
+    for (volid, volpath), key, entry in zip(batch, keys, cached):
+        if entry is None:
+            result = next(results)
+            if result[3] is None:
+                volumeio.volumecache.put(key, result[0 : 3])
+        else:
+            result = entry + (None,)
+        yield (volid,) + result
+
+def ingest_pool(volspresent, processes = None):
+    '''
+    Opens a pool to read the volumes in volspresent, or returns None
+    if there are too few of them (not already in volumeio.volumecache)
+    to be worth it.
+    '''
+
+    if processes is None:
+        processes = ingest_processes
+    if processes is None:
+        processes = workerpool.available_cores()
+
+    toread = 0
+    for volid, volpath in volspresent:
+        if volumeio.volumecache.key(volpath) not in volumeio.volumecache:
+            toread += 1
+
+    if processes < 2 or toread < processes * ingest_chunksize:
+        return None
+    else:
+        return workerpool.open_pool(processes, numthreads = 1)
+
+def ingest_volumes(volspresent, processes = None, pool = None):
+    '''
+    Reads every volume in volspresent (a list of id, path tuples) and
+    yields (volid, words, counts, malformed, error) tuples, in the same
+    order as volspresent.
+
+    Volumes already in volumeio.volumecache aren't read again. The rest
+    are read by a pool of processes, a batch at a time, so that memory
+    stays bounded; while the parent works through one batch the pool
+    parses the next. If a pool is given (see ingest_pool) it's used,
+    and left open; otherwise one is opened for the occasion.
+    '''
+
+    ownpool = pool is None
+    if ownpool:
+        pool = ingest_pool(volspresent, processes)
+
+    batches = [volspresent[i : i + ingest_batchsize] for i in range(0, len(volspresent), ingest_batchsize)]
+
+    try:
+        pending = None
+        for batchnum, batch in enumerate(batches):
+            if pending is None:
+                pending = dispatch_batch(batch, pool)
+            current = pending
+            pending = None
+            if pool is not None and batchnum + 1 < len(batches):
+                pending = dispatch_batch(batches[batchnum + 1], pool)
+                # The pool parses the next batch while we hand on this one.
+            for result in collect_batch(*current):
+                yield result
+    finally:
+        if ownpool and pool is not None:
+            pool.close()
+            pool.join()
+
+def report_failures(failed, outcome = 'were left out'):
+    '''
+    Given a dictionary mapping volume IDs to error messages, prints
+    a summary of the volumes that couldn't be read, and what became
+    of them.
+    '''
+
+    if len(failed) == 0:
+        return
+
+    print(str(len(failed)) + ' volumes could not be read, and ' + outcome + ':')
+    for volid in list(failed.keys())[0 : 10]:
+        print('    ' + volid + '\t' + failed[volid])
+    if len(failed) > 10:
+        print('    ...')
+
+def feature_row(words, counts, vocabindex, freqs_already_normalized):
+    '''
+    Turns the words and counts of a volume into a row of features,
+    one for each word in vocabindex (a pd.Index of the vocabulary).
+    '''
+
+    features = np.zeros(len(vocabindex))
+    columns = vocabindex.get_indexer(words)
+    invocab = columns >= 0
+    features[columns[invocab]] = counts[invocab]
+
+    if freqs_already_normalized:
+        return features
+
+    totalcount = counts.sum()
+    if totalcount == 0:
+        totalcount = .00001
+
+    return features / totalcount
 
 def get_dataframe(volspresent, classdictionary, vocablist, freqs_already_normalized):
     '''
     Given a vocabulary list, and list of volumes, this actually creates the
     pandas dataframe with volumes as rows and words (or other features) as
     columns.
+
+    Volumes that can't be read are left out, and returned in a dictionary
+    mapping their IDs to the error; rows of the dataframe follow the order
+    of the volumes that remain.
     '''
 
     voldata = list()
     classvector = list()
+    malformed = dict()
+    failed = dict()
 
-    for volid, volpath in volspresent:
+    vocabindex = pd.Index(vocablist)
 
-        with open(volpath, encoding = 'utf-8') as f:
-            voldict = dict()
-            totalcount = 0
-            for line in f:
-                fields = line.strip().split('\t')
-                if len(fields) > 2 or len(fields) < 2:
-                    continue
+    for volid, words, counts, badlines, error in ingest_volumes(volspresent):
+        if error is not None:
+            failed[volid] = error
+            continue
+        malformed[volid] = badlines
 
-                word = fields[0]
-                if fields[1] == 'frequency':
-                    continue
-                count = float(fields[1])
-                voldict[word] = count
-                totalcount += count
-
-        features = get_features(voldict, vocablist)
-        if totalcount == 0:
-            totalcount = .00001
-        if freqs_already_normalized:
-            voldata.append(features)
-        else:
-            voldata.append(features / totalcount)
+        voldata.append(feature_row(words, counts, vocabindex, freqs_already_normalized))
 
         classflag = classdictionary[volid]
         classvector.append(classflag)
 
+    volumeio.report_malformed(malformed)
+    report_failures(failed)
+
     masterdata = pd.DataFrame(voldata)
+    classvector = np.array(classvector, dtype = np.int8)
+
+    return masterdata, classvector, failed
+
+class VolumeStream:
+    '''
+    Stands in for masterdata when a corpus is too large to hold in
+    memory as a single matrix. Instead of rows, it yields batches of
+    rows, read from disk (or from volumeio.volumecache) as they're
+    needed. Used with the 'sgd' algorithm; see get_simple_data().
+
+    Volumes that turn out to be unreadable are skipped, recorded
+    in self.failed, and get no prediction (NaN).
+
+    Mini-batches are shuffled with self.rng, which is random.Random(seed)
+    if a seed is given. While self.pool is set (see fit_streaming),
+    every pass reads volumes with that pool instead of opening its own.
+    '''
+
+    def __init__(self, volspresent, vocablist, freqs_already_normalized = True, seed = None):
+        self.volspresent = volspresent
+        self.vocablist = vocablist
+        self.vocabindex = pd.Index(vocablist)
+        self.freqs_already_normalized = freqs_already_normalized
+        self.shape = (len(volspresent), len(vocablist))
+        self.failed = dict()
+        self.scalers = dict()
+        self.pool = None
+
+        if seed is None:
+            self.rng = random
+        else:
+            self.rng = random.Random(seed)
+
+    def __len__(self):
+        return len(self.volspresent)
+
+    def batches(self, rows, numfeatures = None, batchsize = None):
+        '''
+        Yields (rownumbers, matrix) pairs covering the given rows, in
+        the order given, using only the first numfeatures columns.
+        '''
+
+        if numfeatures is None:
+            numfeatures = len(self.vocablist)
+        if batchsize is None:
+            batchsize = sgd_batchsize
+
+        subset = [self.volspresent[i] for i in rows]
+        batchrows = []
+        batchdata = []
+
+        for i, (volid, words, counts, badlines, error) in zip(rows, ingest_volumes(subset, pool = self.pool)):
+            if error is not None:
+                self.failed[volid] = error
+                continue
+
+            batchrows.append(i)
+            batchdata.append(feature_row(words, counts, self.vocabindex, self.freqs_already_normalized)[0 : numfeatures])
+
+            if len(batchrows) >= batchsize:
+                yield np.array(batchrows), np.array(batchdata)
+                batchrows = []
+                batchdata = []
+
+        if len(batchrows) > 0:
+            yield np.array(batchrows), np.array(batchdata)
+
+    def fold_scalers(self, foldlabels):
+        '''
+        Returns a StandardScaler fit to all rows, and one for each
+        fold fit to the rows outside that fold, all computed in a
+        single streaming pass and remembered for later calls.
+        '''
+
+        key = foldlabels.tobytes()
+        if key in self.scalers:
+            return self.scalers[key]
+
+        numfolds = int(foldlabels.max()) + 1
+        fullscaler = StandardScaler()
+        foldscalers = [StandardScaler() for x in range(numfolds)]
+
+        for batchrows, batch in self.batches(list(range(len(self)))):
+            fullscaler.partial_fit(batch)
+            batchfolds = foldlabels[batchrows]
+            for foldnumber, scaler in enumerate(foldscalers):
+                outside = batchfolds != foldnumber
+                if np.any(outside):
+                    scaler.partial_fit(batch[outside])
+
+        self.scalers[key] = (fullscaler, foldscalers)
+        return fullscaler, foldscalers
+
+def feature_prefix(scaler, numfeatures):
+    '''
+    Returns a copy of a fitted StandardScaler that applies only to
+    the first numfeatures columns, for models that use a prefix of
+    the vocabulary.
+    '''
+
+    prefix = StandardScaler()
+    prefix.mean_ = scaler.mean_[0 : numfeatures]
+    prefix.var_ = scaler.var_[0 : numfeatures]
+    prefix.scale_ = scaler.scale_[0 : numfeatures]
+    prefix.n_samples_seen_ = scaler.n_samples_seen_
+    prefix.n_features_in_ = numfeatures
+
+    return prefix
+
+def fit_streaming(stream, classvector, rows, scaler, regularization, numfeatures):
+    '''
+    Trains a logistic model by stochastic gradient descent on the
+    given rows of a VolumeStream, in mini-batches shuffled by the
+    stream's rng, for sgd_epochs passes. One ingestion pool serves
+    all the passes.
+    '''
+
+    model = modelingprocess.make_classifier('sgd', regularization, numrows = len(rows), random_state = stream.rng.randrange(2 ** 31))
+    classes = np.unique(classvector)
+    order = list(rows)
+
+    ownpool = stream.pool is None
+    if ownpool:
+        stream.pool = ingest_pool([stream.volspresent[i] for i in order])
+
+    try:
+        for epoch in range(sgd_epochs):
+            stream.rng.shuffle(order)
+            for batchrows, batch in stream.batches(order, numfeatures):
+                model.partial_fit(scaler.transform(batch), classvector[batchrows], classes = classes)
+    finally:
+        if ownpool:
+            if stream.pool is not None:
+                stream.pool.close()
+                stream.pool.join()
+            stream.pool = None
+
+    return model
+
+def predict_streaming(stream, model, scaler, rows, numfeatures):
+    '''
+    Returns an array of predicted probabilities for every row of the
+    stream, NaN except for the rows requested.
+    '''
+
+    predictions = np.full(len(stream), np.nan)
+
+    for batchrows, batch in stream.batches(list(rows), numfeatures):
+        predictions[batchrows] = model.predict_proba(scaler.transform(batch))[ : , 1]
+
+    return predictions
 
-    return masterdata, classvector
+def crossvalidate_streaming(stream, classvector, foldlabels, regu_const, numfeatures):
+    '''
+    The streaming counterpart of crossvalidate(): folds are trained
+    one after another in this process, while volumes are read by
+    the ingestion pool.
+    '''
+
+    fullscaler, foldscalers = stream.fold_scalers(foldlabels)
+    predictions = np.full(len(stream), np.nan)
+
+    for foldnumber, scaler in enumerate(foldscalers):
+        scaler = feature_prefix(scaler, numfeatures)
+        trainrows = np.flatnonzero(foldlabels != foldnumber)
+        testrows = np.flatnonzero(foldlabels == foldnumber)
+        model = fit_streaming(stream, classvector, trainrows, scaler, regu_const, numfeatures)
+        foldpredictions = predict_streaming(stream, model, scaler, testrows, numfeatures)
+        predictions[testrows] = foldpredictions[testrows]
+
+    return predictions
+
+def get_streamed_fullmodel(stream, classvector, vocablist, regularization, numfeatures):
+    '''
+    The streaming counterpart of get_fullmodel().
+    '''
+
+    foldlabels = np.zeros(len(stream), dtype = np.int32)
+    fullscaler, foldscalers = stream.fold_scalers(foldlabels)
+    stdscaler = feature_prefix(fullscaler, numfeatures)
+
+    newmodel = fit_streaming(stream, classvector, np.arange(len(stream)), stdscaler, regularization, numfeatures)
 
-def get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4negative, sizecap, forbid4positive = {'allnegative'}, forbid4negative = {'allpositive'}, excludebelow = 0, excludeabove = 3000, verbose = False, datecols = ['firstpub'], indexcol = ['docid'], extension = '.tsv', genrecol = 'tags', numfeatures = 5000, negative_strategy = 'random', overlap_strategy = 'random',force_even_distribution = False, forbiddenwords = set()):
+    coefficients = modelingprocess.model_coefficients(newmodel) * 100
+
+    coefficientuples = list(zip(coefficients, (coefficients / stdscaler.var_), vocablist))
+    coefficientuples.sort()
+
+    return coefficientuples, newmodel, stdscaler
+
+def get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4negative, sizecap, forbid4positive = {'allnegative'}, forbid4negative = {'allpositive'}, excludebelow = 0, excludeabove = 3000, verbose = False, datecols = ['firstpub'], indexcol = ['docid'], extension = '.tsv', genrecol = 'tags', numfeatures = 5000, negative_strategy = 'random', overlap_strategy = 'random',force_even_distribution = False, forbiddenwords = set(), streaming = False, seed = None):
 
     ''' Loads metadata, selects instances for the positive and
     negative classes, creates a lexicon if one doesn't
     already exist, and creates a pandas dataframe storing
     texts as rows and words/features as columns. A refactored
     and simplified version of get_data_for_model().
+
+    If a seed is given, the selection is made with random.Random(seed),
+    so the same seed always selects the same volumes.
+
+    Each stage is timed and reported by stagelog.py.
     '''
 
     holdout_authors = True
@@ -507,28 +1234,34 @@ def get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4n
     if not sourcefolder.endswith('/'):
         sourcefolder = sourcefolder + '/'
 
-    # Get a list of files.
-    allthefiles = os.listdir(sourcefolder)
+    with stagelog.stage('metadata') as record:
 
-    volumeIDsinfolder = list()
-    volumepaths = list()
-    numchars2trim = len(extension)
+        # Get a list of files.
+        volumesinfolder = volumeio.list_volumes(sourcefolder, extension)
+        volumeIDsinfolder = list(volumesinfolder.keys())
 
-    for filename in allthefiles:
+        # The volume ID is basically the filename minus its extension,
+        # and minus .gz, .bz2 or .zst if the volume is compressed.
 
-        if filename.endswith(extension):
-            volID = filename[0 : -numchars2trim]
-            # The volume ID is basically the filename minus its extension.
-            volumeIDsinfolder.append(volID)
+        metadata = metaselector.load_metadata(metadatapath, volumeIDsinfolder, excludebelow, excludeabove, indexcol = indexcol, datecols = datecols, genrecol = genrecol)
 
-    metadata = metaselector.load_metadata(metadatapath, volumeIDsinfolder, excludebelow, excludeabove, indexcol = indexcol, datecols = datecols, genrecol = genrecol)
+        record['infolder'] = len(volumeIDsinfolder)
+        record['rows'] = len(metadata)
 
     # That function returns a pandas dataframe which is guaranteed to be indexed by indexcol,
     # and to contain a numeric column 'std_date' as well as a column 'tagset' which contains
     # sets of genre tags for each row. It has also been filtered so it only contains volumes
     # in the folder, and none whose date is below excludebelow or above excludeabove.
 
-    orderedIDs, classdictionary = metaselector.select_instances(metadata, sizecap, tags4positive, tags4negative, forbid4positive, forbid4negative, negative_strategy = negative_strategy, overlap_strategy = overlap_strategy, force_even_distribution = force_even_distribution)
+    if seed is None:
+        rng = random
+    else:
+        rng = random.Random(seed)
+
+    with stagelog.stage('selection', sizecap = sizecap) as record:
+        orderedIDs, classdictionary = metaselector.select_instances(metadata, sizecap, tags4positive, tags4negative, forbid4positive, forbid4negative, negative_strategy = negative_strategy, overlap_strategy = overlap_strategy, force_even_distribution = force_even_distribution, rng = rng)
+        record['positives'] = sum(classdictionary.values())
+        record['volumes'] = len(orderedIDs)
 
     metadata = metadata.loc[orderedIDs]
     # Limits the metadata data frame to rows we are actually using
@@ -543,12 +1276,14 @@ def get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4n
 
     # We now create an ordered list of id-path tuples.
 
-    volspresent = [(x, sourcefolder + x + extension) for x in orderedIDs]
+    volspresent = [(x, volumesinfolder[x]) for x in orderedIDs]
 
 
     print('Building vocabulary.')
 
-    vocablist = get_vocablist(vocabpath, volspresent, n = numfeatures, forbidden = forbiddenwords)
+    with stagelog.stage('vocabulary', cached = os.path.isfile(vocabpath)) as record:
+        vocablist = get_vocablist(vocabpath, volspresent, n = numfeatures, forbidden = forbiddenwords)
+        record['features'] = len(vocablist)
 
     # This function either gets the vocabulary list already stored in vocabpath, or
     # creates a list of the top n words, by doc frequency, in the volumes
@@ -563,24 +1298,45 @@ def get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4n
     print()
     print("Number of features: " + str(numfeatures))
 
+    if streaming:
+        masterdata = VolumeStream(volspresent, vocablist, freqs_already_normalized, seed = seed)
+        classvector = np.array([classdictionary[x] for x in orderedIDs], dtype = np.int8)
+        failed = dict()
+        # With streaming = True, we don't build a matrix; volumes are
+        # read in batches as the 'sgd' algorithm needs them.
+    else:
+        hits = volumeio.volumecache.hits
+        with stagelog.stage('ingestion', volumes = len(volspresent)) as record:
+            masterdata, classvector, failed = get_dataframe(volspresent, classdictionary, vocablist, freqs_already_normalized)
+            record['shape'] = list(masterdata.shape)
+            record['dtype'] = str(masterdata.values.dtype) if masterdata.shape[1] > 0 else None
+            record['failed'] = len(failed)
+            record['cachehits'] = volumeio.volumecache.hits - hits
+
+    if volumeio.volumecache.budget > 0:
+        volumeio.volumecache.report()
+
+    if len(failed) > 0:
+        orderedIDs = [x for x in orderedIDs if x not in failed]
+        metadata = metadata.loc[orderedIDs]
+        for volid in failed:
+            del classdictionary[volid]
+
+    # Volumes that couldn't be read have been dropped, so the
+    # rows of masterdata still line up with orderedIDs.
+
     # For each volume, we're going to create a list of volumes that should be
     # excluded from the training set when it is to be predicted. More precisely,
     # we're going to create a list of their *indexes*, so that we can easily
     # remove rows from the training matrix.
 
-    authormatches = [ [] for x in orderedIDs]
-
-    # Now we proceed to enlarge that list by identifying, for each volume,
-    # a set of indexes that have the same author. Obvs, there will always be at least one.
-    # We exclude a vol from it's own training set.
-
-    if holdout_authors:
-        for idx1, anid in enumerate(orderedIDs):
-            thisauthor = metadata.loc[anid, 'author']
-            authormatches[idx1] = list(np.flatnonzero(metadata['author'] == thisauthor))
+    with stagelog.stage('authors') as record:
+        authormatches = match_authors(metadata, holdout_authors)
+        record['volumes'] = len(authormatches)
 
-    for alist in authormatches:
-        alist.sort(reverse = True)
+    # For each volume, that identifies a set of indexes that have the same
+    # author. Obvs, there will always be at least one. We exclude a vol from
+    # it's own training set.
 
     print()
     print('Authors matched.')
@@ -590,11 +1346,9 @@ def get_simple_data(sourcefolder, metadatapath, vocabpath, tags4positive, tags4n
     # back to front, without changing indexes yet to be deleted.
     # This will become important in the modelingprocess module.
 
-    masterdata, classvector = get_dataframe(volspresent, classdictionary, vocablist, freqs_already_normalized)
-
     return metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist
 
-def get_fullmodel(data, classvector, vocablist, regularization):
+def get_fullmodel(data, classvector, vocablist, regularization, algorithm = 'logistic'):
     '''
     Instead of crossvalidating (producing multiple models),
     this function runs a single model on the whole set.
@@ -603,7 +1357,7 @@ def get_fullmodel(data, classvector, vocablist, regularization):
     trainingset = data
     yvals = np.array(classvector)
 
-    newmodel = LogisticRegression(C = regularization)
+    newmodel = modelingprocess.make_classifier(algorithm, regularization, numrows = len(yvals))
 
     stdscaler = StandardScaler()
     stdscaler.fit(trainingset)
@@ -611,20 +1365,23 @@ def get_fullmodel(data, classvector, vocablist, regularization):
 
     newmodel.fit(scaledtraining, yvals)
 
-    coefficients = newmodel.coef_[0] * 100
+    coefficients = modelingprocess.model_coefficients(newmodel) * 100
 
     coefficientuples = list(zip(coefficients, (coefficients / stdscaler.var_), vocablist))
     coefficientuples.sort()
 
     return coefficientuples, newmodel, stdscaler
 
-def export_model(modelitself, algorithm, scaler, vocabulary, positive_tags, negative_tags, c, n, modelname, outpath):
+def export_model(modelitself, algorithm, scaler, vocabulary, positive_tags, negative_tags, c, n, modelname, outpath, labels = None):
     '''
     Creates a dictionary with spots for a scikit-learn model and associated data objects that will
     be needed to apply it to texts. E.g., a vocabulary, which tells you which words occupy which
     columns, and a StandardScaler object, which stores the means and variances needed to normalize
     your data (convert frequencies to z scores). Other useful metadata is also stored; the whole
     dictionary is picked and written to file.
+
+    A model of more than two classes also stores labels, a list naming
+    the class of each column of predict_proba().
     '''
     model = dict()
     model['vocabulary'] = vocabulary
@@ -637,6 +1394,8 @@ def export_model(modelitself, algorithm, scaler, vocabulary, positive_tags, nega
     model['n'] = n
     modelname = outpath.split('/')[-1].replace('.pkl', '')
     model['name'] = modelname
+    if labels is not None:
+        model['labels'] = labels
     with open(outpath, 'wb') as output:
         pickle.dump(model, output)
 
@@ -648,6 +1407,9 @@ def apply_pickled_model(amodelpath, folder, extension, metapath):
 
     The metapath here will ordinarily be metadata produced by a different model.
     This allows you to correlate logistic and alien_model columns.
+
+    A model with several classes (see batchtrainer.train_multinomial) gets
+    a column for each class instead: 'alien_' + the class label.
     '''
 
     with open(amodelpath, 'rb') as input:
@@ -672,22 +1434,30 @@ def apply_pickled_model(amodelpath, folder, extension, metapath):
     resultindex = []
 
     for doc in metadata.index:
-        inpath = os.path.join(folder, doc + extension)
-        if os.path.exists(inpath):
+        inpath = volumeio.find_volume(folder, doc, extension)
+        if inpath is not None:
             volspresent.append( (doc, inpath) )
             classdictionary[doc] = 0
             metadict[doc] = dict()
             resultindex.append(doc)
         else:
-            print(inpath)
+            print(os.path.join(folder, doc + extension))
 
     print(len(volspresent))
 
-    masterdata, classvector = get_dataframe(volspresent, classdictionary, vocablist, True)
+    masterdata, classvector, failed = get_dataframe(volspresent, classdictionary, vocablist, True)
     # True, there, means frequencies already normalized to be relative freqs.
+    resultindex = [x for x in resultindex if x not in failed]
     print(masterdata.shape)
 
     standarddata = scaler.transform(masterdata)
+
+    if 'labels' in modeldict:
+        probabilities = model.predict_proba(standarddata)
+        for column, label in enumerate(modeldict['labels']):
+            metadata['alien_' + label] = pd.Series(probabilities[ : , column], index = resultindex)
+        return metadata
+
     probabilities = [x[1] for x in model.predict_proba(standarddata)]
 
     # we create a column named for the model
@@ -700,7 +1470,7 @@ def apply_pickled_model(amodelpath, folder, extension, metapath):
 
     return metadata
 
-def tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, positive_tags, negative_tags, modelparams, modelname, outputpath, verbose = True, write_fullmodel = False):
+def tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs, authormatches, vocablist, positive_tags, negative_tags, modelparams, modelname, outputpath, verbose = True, write_fullmodel = False, pool = None, seed = None):
     '''
     This has become the central workhorse class in the module. It takes
     a set of parameters defining positive and negative subsets of a corpus,
@@ -726,6 +1496,23 @@ def tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs,
 
     We write coefficients, predictions, and model object to file, using variations
     of the outputpath contained in the "path" tuple.
+
+    If a pool is provided (see batchtrainer.py) crossvalidation runs in
+    it; otherwise a pool is opened for the grid search and another for
+    the final crossvalidation.
+
+    If checkpointfolder is set, a seed is required (ValueError without
+    one), and the grid search is checkpointed there
+    (see GridCheckpoint); the checkpoint is removed once the model's
+    results have been written.
+
+    If a seed is given, folds are drawn with random.Random(seed), and
+    so are the mini-batches of a VolumeStream. If
+    resultcache is set and holds the results of an identical run, they
+    are returned, and the model's files written, without training.
+
+    Each stage, and each cell of the grid search, is timed and reported
+    by stagelog.py.
     '''
 
     algorithm, k, featurestart, featureend, featurestep, crange = modelparams
@@ -733,47 +1520,123 @@ def tune_a_model(metadata, masterdata, classvector, classdictionary, orderedIDs,
     # Create folds for crossvalidation.
     # To request leave-one-out crossvalidation, set k to zero
 
-    if k < 1:
-        folds = leave_one_out_folds(orderedIDs, authormatches, classdictionary)
-    else:
-        folds = create_folds(k, orderedIDs, authormatches, classdictionary)
+    # From here on, volumes are identified by their row number in
+    # masterdata (their position in orderedIDs), and classes by an
+    # array with one entry for each row.
 
-    matrix, features4max, best_regularization_coef, maxaccuracy = gridsearch(featurestart, featureend, featurestep, crange, masterdata, orderedIDs, folds, algorithm, classdictionary, classvector)
+    classvector = np.asarray(classvector)
 
-    datasubset = masterdata.iloc[ : , 0 : features4max]
+    if checkpointfolder is not None and seed is None:
+        raise ValueError('checkpointfolder is set, but tune_a_model() was given no seed; an unseeded run selects different volumes and folds when restarted, so it could never resume from its checkpoint.')
 
-    predictions = crossvalidate(datasubset, classvector, folds, algorithm, best_regularization_coef)
-    accuracy = calculate_accuracy(orderedIDs, predictions, classdictionary, verbose)
+    if checkpointfolder is not None:
+        checkpoint = GridCheckpoint(checkpointfolder, orderedIDs, classvector, vocablist, algorithm, k)
+    else:
+        checkpoint = None
 
-    print(accuracy, maxaccuracy)
-    # those two should be effectively the same
+    with stagelog.stage('folds', model = modelname, k = k) as record:
+        record['checkpointed'] = checkpoint is not None and checkpoint.foldlabels is not None
 
-    coefficientuples, fullmodel, scaler = get_fullmodel(datasubset, classvector, vocablist,best_regularization_coef)
+        if record['checkpointed']:
+            foldlabels = checkpoint.foldlabels
+        elif k < 1:
+            foldlabels = leave_one_out_folds(len(orderedIDs), authormatches)
+        elif seed is None:
+            foldlabels = create_folds(k, classvector, authormatches)
+        else:
+            foldlabels = create_folds(k, classvector, authormatches, rng = random.Random(seed))
 
-    modelpath = outputpath.replace('.csv', '.pkl')
-    export_model(fullmodel, algorithm, scaler, vocablist[0 : features4max], positive_tags, negative_tags, best_regularization_coef, len(orderedIDs), modelname, modelpath)
+        record['folds'] = int(np.max(foldlabels)) + 1
 
-    coefficientpath = outputpath.replace('.csv', '.coefs.csv')
-    with open(coefficientpath, mode = 'w', encoding = 'utf-8') as f:
-        writer = csv.writer(f)
-        for triple in coefficientuples:
-            coef, normalizedcoef, word = triple
-            writer.writerow([word, coef, normalizedcoef])
+    if seed is not None and isinstance(masterdata, VolumeStream):
+        masterdata.rng = random.Random(seed)
 
-    if write_fullmodel:
-        # If we want to, we can write predictions created by a model
-        # trained on all the data.
-        standarddata = scaler.transform(datasubset)
-        predicted = [x[1] for x in fullmodel.predict_proba(standarddata)]
+    if checkpoint is not None:
+        checkpoint.start(foldlabels)
 
+    if resultcache is not None:
+        with stagelog.stage('resultcache', model = modelname) as record:
+            resultkey = result_key(orderedIDs, classvector, vocablist, foldlabels, modelparams, write_fullmodel, masterdata)
+            cached = cached_result(resultkey)
+            record['cachehit'] = cached is not None
     else:
-        # But the default is to write the crossvalidated predictions.
-        predicted = [predictions[x] for x in orderedIDs]
+        cached = None
 
-    metadata = metadata.assign(probability = predicted)
-    metadata = metadata.assign(realclass = classvector)
-    metadata.drop('tagset', axis = 1, inplace = True)
-    metadata.to_csv(outputpath)
+    if cached is not None:
+        print('Identical model found in the result cache: ' + resultkey)
+        matrix, maxaccuracy, features4max, best_regularization_coef, coefficientuples, predicted = cached
+        copy_cached_artefacts(resultkey, outputpath, positive_tags, negative_tags)
+    else:
+        if pool is not None and not isinstance(masterdata, VolumeStream):
+            datakey = share_with_pool(masterdata, classvector, foldlabels)
+        else:
+            pool = None
+            datakey = None
+
+        try:
+            with stagelog.stage('gridsearch', model = modelname, shape = list(masterdata.shape), algorithm = algorithm) as record:
+                matrix, features4max, best_regularization_coef, maxaccuracy = gridsearch(featurestart, featureend, featurestep, crange, masterdata, foldlabels, algorithm, classvector, pool = pool, datakey = datakey, checkpoint = checkpoint)
+                record['cells'] = matrix.size
+                if checkpoint is not None:
+                    record['checkpointed'] = len(checkpoint.cells)
+
+            with stagelog.stage('finalcv', model = modelname, features = features4max, c = best_regularization_coef) as record:
+                record['checkpointed'] = checkpoint is not None and checkpoint.predictions(features4max, best_regularization_coef) is not None
+                if record['checkpointed']:
+                    predictions = checkpoint.predictions(features4max, best_regularization_coef)
+                else:
+                    predictions = crossvalidate(masterdata, classvector, foldlabels, algorithm, best_regularization_coef, numfeatures = features4max, pool = pool, datakey = datakey)
+        finally:
+            if datakey is not None:
+                shutil.rmtree(datakey, ignore_errors = True)
+
+        accuracy = calculate_accuracy(predictions, classvector, verbose)
+
+        print(accuracy, maxaccuracy)
+        # those two should be effectively the same
+
+        with stagelog.stage('fullmodel', model = modelname, features = features4max, c = best_regularization_coef):
+            if isinstance(masterdata, VolumeStream):
+                coefficientuples, fullmodel, scaler = get_streamed_fullmodel(masterdata, classvector, vocablist, best_regularization_coef, features4max)
+            else:
+                datasubset = masterdata.iloc[ : , 0 : features4max]
+                coefficientuples, fullmodel, scaler = get_fullmodel(datasubset, classvector, vocablist, best_regularization_coef, algorithm = algorithm)
+
+            if write_fullmodel:
+                # If we want to, we can write predictions created by a model
+                # trained on all the data.
+                if isinstance(masterdata, VolumeStream):
+                    predicted = predict_streaming(masterdata, fullmodel, scaler, range(len(masterdata)), features4max)
+                else:
+                    standarddata = scaler.transform(datasubset)
+                    predicted = [x[1] for x in fullmodel.predict_proba(standarddata)]
+
+            else:
+                # But the default is to write the crossvalidated predictions.
+                predicted = predictions
+
+        with stagelog.stage('export', model = modelname):
+            modelpath = outputpath.replace('.csv', '.pkl')
+            export_model(fullmodel, algorithm, scaler, vocablist[0 : features4max], positive_tags, negative_tags, best_regularization_coef, len(orderedIDs), modelname, modelpath)
+
+            coefficientpath = outputpath.replace('.csv', '.coefs.csv')
+            with open(coefficientpath, mode = 'w', encoding = 'utf-8') as f:
+                writer = csv.writer(f)
+                for triple in coefficientuples:
+                    coef, normalizedcoef, word = triple
+                    writer.writerow([word, coef, normalizedcoef])
+
+    with stagelog.stage('predictions', model = modelname, cachehit = cached is not None):
+        metadata = metadata.assign(probability = predicted)
+        metadata = metadata.assign(realclass = classvector)
+        metadata.drop('tagset', axis = 1, inplace = True)
+        metadata.to_csv(outputpath)
+
+        if resultcache is not None and cached is None:
+            store_result(resultkey, outputpath, (matrix, maxaccuracy, features4max, best_regularization_coef, coefficientuples, predicted))
+
+    if checkpoint is not None:
+        checkpoint.remove()
 
     return matrix, maxaccuracy, metadata, coefficientuples, features4max, best_regularization_coef
 
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+
+# volumeio.py
+#
+# Finding and opening volume files. Each volume is a file of
+# word<tab>count lines, named docid + extension (e.g. '.tsv'),
+# but it may also be compressed, in which case the name has a
+# further suffix: '.tsv.gz', '.tsv.bz2' or '.tsv.zst'. Every
+# reader in the package opens volumes through open_volume(), so
+# compressed and uncompressed corpora can be used interchangeably.
+#
+# read_counts() parses a whole volume at once: the file's bytes are
+# split into lines and fields with numpy, instead of a Python loop
+# over lines, and malformed lines are counted rather than silently
+# dropped.
+#
+# Parsed volumes are kept in a process-wide cache (volumecache),
+# keyed by path and modification time, so a volume used in many
+# models is only read once. The cache has a memory budget in bytes
+# (cachebudget) and evicts the least recently used volumes first.
+#
+# On shared storage, reading is usually the bottleneck rather than
+# decompression, so we read in large buffered blocks and use the
+# fastest decompressor available: python-isal for gzip, if it's
+# installed, and the zstandard package for .zst files.
+
+import bz2, gzip, io, os, threading, warnings
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    from isal import igzip as fastgzip
+except ImportError:
+    fastgzip = gzip
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSION_SUFFIXES = ['.gz', '.bz2', '.zst']
+
+buffersize = 1024 * 1024
+# Size in bytes of the blocks we read from disk.
+
+cachebudget = 2 * 1024 * 1024 * 1024
+# Memory, in bytes, that the cache of parsed volumes may use. The cache
+# reads it each time it's used, so it can be changed at any point; set
+# it to 0 to turn caching off. volumecache.set_budget() gives the cache
+# a budget of its own instead, until it's called again with None.
+
+def open_binary(path):
+    '''
+    Opens a volume for reading as bytes, decompressing transparently
+    if the path ends with a compression suffix.
+    '''
+
+    if path.endswith('.gz'):
+        raw = fastgzip.open(path, mode = 'rb')
+    elif path.endswith('.bz2'):
+        raw = bz2.open(path, mode = 'rb')
+    elif path.endswith('.zst'):
+        if zstandard is None:
+            raise ImportError('Reading ' + path + ' requires the zstandard package.')
+        raw = zstandard.ZstdDecompressor().stream_reader(open(path, mode = 'rb'), read_size = buffersize, closefd = True)
+    else:
+        return open(path, mode = 'rb', buffering = buffersize)
+
+    return io.BufferedReader(raw, buffer_size = buffersize)
+
+def open_volume(path):
+    '''
+    Opens a volume for reading as text, decompressing transparently
+    if the path ends with a compression suffix.
+    '''
+
+    if not path.endswith(tuple(COMPRESSION_SUFFIXES)):
+        return open(path, encoding = 'utf-8', buffering = buffersize)
+
+    return io.TextIOWrapper(open_binary(path), encoding = 'utf-8')
+
+WHITESPACE_BYTES = np.array([9, 10, 11, 12, 13, 28, 29, 30, 31, 32], dtype = np.uint8)
+# the single-byte characters str.strip() removes
+
+def gather_fields(buf, starts, ends):
+    '''
+    Concatenates the byte ranges buf[start : end], each followed by a
+    newline, using a single fancy-indexing operation instead of a loop.
+    '''
+
+    lengths = ends - starts + 1
+    total = int(lengths.sum())
+    if total == 0:
+        return b''
+
+    positions = np.cumsum(lengths)
+    offsets = np.repeat(starts - (positions - lengths), lengths)
+    idx = np.arange(total) + offsets
+    np.minimum(idx, len(buf) - 1, out = idx)
+
+    gathered = buf[idx]
+    gathered[positions - 1] = 10
+    # The byte after each field is a tab, newline or carriage
+    # return, or past the end of the buffer; make it a newline.
+
+    return gathered.tobytes()
+
+def parse_counts(data):
+    '''
+    Parses the bytes of a whole volume, in word<tab>count form, and
+    returns three things: an array of words, an array of (float)
+    counts, and the number of malformed lines that were skipped.
+
+    Lines are split with vectorized numpy operations rather than a
+    Python loop, but exactly as line.strip().split('\t') would split
+    them. As before, lines that don't have exactly two fields, and
+    'frequency' header lines, are skipped; but lines that don't have
+    exactly two fields, or whose count isn't a number, are now counted
+    as malformed. Blank lines are ignored silently.
+    '''
+
+    buf = np.frombuffer(data, dtype = np.uint8)
+    if len(buf) == 0:
+        return np.array([], dtype = object), np.array([], dtype = np.float64), 0
+
+    newlines = np.flatnonzero(buf == 10)
+    if buf[-1] == 10:
+        ends = newlines
+    else:
+        ends = np.append(newlines, len(buf))
+    starts = np.concatenate(([0], newlines + 1))[0 : len(ends)]
+
+    # Like line.strip(), trim whitespace (spaces, tabs, carriage returns
+    # and the other ASCII whitespace characters) from both ends of each
+    # line before looking for its tab: each line starts at its first
+    # non-whitespace byte and ends after its last.
+
+    whitespace = np.isin(buf, WHITESPACE_BYTES)
+    solid = np.flatnonzero(~whitespace)
+    if len(solid) == 0:
+        return np.array([], dtype = object), np.array([], dtype = np.float64), 0
+
+    firstsolid = np.searchsorted(solid, starts)
+    lastsolid = np.searchsorted(solid, ends) - 1
+    nonblank = (firstsolid < len(solid)) & (firstsolid <= lastsolid)
+
+    starts = solid[firstsolid[nonblank]]
+    ends = solid[lastsolid[nonblank]] + 1
+
+    tabs = np.flatnonzero(buf == 9)
+    firsttabidx = np.searchsorted(tabs, starts)
+    tabsinline = np.searchsorted(tabs, ends) - firsttabidx
+
+    if len(tabs) > 0:
+        firsttab = tabs[np.minimum(firsttabidx, len(tabs) - 1)]
+    else:
+        firsttab = starts
+
+    wellformed = (tabsinline == 1)
+    # Since lines are trimmed, a single tab always has something on
+    # both sides of it.
+    malformed = len(starts) - int(wellformed.sum())
+
+    starts = starts[wellformed]
+    ends = ends[wellformed]
+    firsttab = firsttab[wellformed]
+
+    words = gather_fields(buf, starts, firsttab).decode('utf-8').split('\n')[0 : -1]
+    words = np.array(words, dtype = object)
+
+    # Counts normally begin with a digit, a point or a sign. The few
+    # that don't ('frequency' headers, or anything odd) are checked
+    # individually; the rest are parsed in one call.
+
+    firstbyte = buf[firsttab + 1]
+    ordinary = ((firstbyte >= 48) & (firstbyte <= 57)) | (firstbyte == 46) | (firstbyte == 45) | (firstbyte == 43)
+
+    counts = np.zeros(len(words), dtype = np.float64)
+    keep = np.ones(len(words), dtype = bool)
+
+    for i in np.flatnonzero(~ordinary):
+        field = buf[firsttab[i] + 1 : ends[i]].tobytes()
+        keep[i] = False
+        if field == b'frequency':
+            continue
+        try:
+            counts[i] = float(field)
+            keep[i] = True
+        except ValueError:
+            malformed += 1
+
+    countfields = gather_fields(buf, firsttab[ordinary] + 1, ends[ordinary]).decode('utf-8')
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', DeprecationWarning)
+            parsed = np.fromstring(countfields, dtype = np.float64, sep = '\n')
+        if len(parsed) != int(ordinary.sum()):
+            raise ValueError('unparsed counts')
+        counts[ordinary] = parsed
+    except (ValueError, DeprecationWarning):
+        for i, field in zip(np.flatnonzero(ordinary), countfields.split('\n')):
+            try:
+                counts[i] = float(field)
+            except ValueError:
+                keep[i] = False
+                malformed += 1
+
+    if not keep.all():
+        words = words[keep]
+        counts = counts[keep]
+
+    return words, counts, malformed
+
+def read_counts(path):
+    '''
+    Reads a whole volume at once and returns its words, counts,
+    and number of malformed lines, as parse_counts() does.
+    '''
+
+    with open_binary(path) as f:
+        data = f.read()
+
+    return parse_counts(data)
+
+def read_voldict(path):
+    '''
+    Returns a dictionary mapping words to counts for a volume, the
+    sum of its counts, and the number of malformed lines. If a word
+    appears twice, the later count wins, as it always has.
+    '''
+
+    words, counts, malformed = read_counts(path)
+    voldict = dict(zip(words.tolist(), counts.tolist()))
+
+    return voldict, float(counts.sum()), malformed
+
+def report_malformed(malformed):
+    '''
+    Given a dictionary mapping volume IDs to the number of malformed
+    lines found in each, prints a summary of the volumes that had any.
+    '''
+
+    bad = {k: v for k, v in malformed.items() if v > 0}
+    if len(bad) == 0:
+        return
+
+    print(str(sum(bad.values())) + ' malformed lines skipped in ' + str(len(bad)) + ' volumes:')
+    for volid in sorted(bad, key = lambda x: bad[x], reverse = True)[0 : 10]:
+        print('    ' + volid + '\t' + str(bad[volid]))
+    if len(bad) > 10:
+        print('    ...')
+
+def volume_id(filename, extension):
+    '''
+    If filename is a volume with this extension, compressed or not,
+    returns the volume ID (the filename minus extension and suffix).
+    Otherwise returns None.
+    '''
+
+    if filename.endswith(extension):
+        return filename[0 : -len(extension)]
+
+    for suffix in COMPRESSION_SUFFIXES:
+        if filename.endswith(extension + suffix):
+            return filename[0 : -len(extension + suffix)]
+
+    return None
+
+def list_volumes(folder, extension):
+    '''
+    Returns a dictionary mapping volume IDs to paths for every volume
+    in folder. If a volume is present both compressed and
+    uncompressed, we use the uncompressed file.
+    '''
+
+    volumes = dict()
+
+    for filename in os.listdir(folder):
+        volID = volume_id(filename, extension)
+        if volID is None:
+            continue
+
+        if volID not in volumes or filename.endswith(extension):
+            volumes[volID] = os.path.join(folder, filename)
+
+    return volumes
+
+def find_volume(folder, docid, extension):
+    '''
+    Returns the path to a volume, trying the uncompressed file first
+    and then each compressed variant. Returns None if there is no
+    such volume.
+    '''
+
+    path = os.path.join(folder, docid + extension)
+    if os.path.exists(path):
+        return path
+
+    for suffix in COMPRESSION_SUFFIXES:
+        if os.path.exists(path + suffix):
+            return path + suffix
+
+    return None
+
+def parsed_size(words, counts):
+    '''
+    Rough number of bytes used by a parsed volume: the two arrays,
+    plus the word strings they point to.
+    '''
+
+    return words.nbytes + counts.nbytes + sum(map(len, words)) + 49 * len(words)
+
+class VolumeCache:
+    '''
+    A least-recently-used cache of parsed volumes, holding
+    (words, counts, malformed) tuples up to a budget in bytes.
+    Entries are keyed by path and modification time, so a volume
+    that changes on disk is read again.
+
+    Unless a budget is given (here or by set_budget), the budget is
+    the module's cachebudget, whatever it is at the time.
+    '''
+
+    def __init__(self, budget = None):
+        self.ownbudget = budget
+        self.entries = OrderedDict()
+        self.sizes = dict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def budget(self):
+        if self.ownbudget is not None:
+            return self.ownbudget
+        return cachebudget
+
+    def key(self, path):
+        ''' Returns the cache key for a path, or None if it can't be stat'ed. '''
+
+        try:
+            return (path, os.stat(path).st_mtime_ns)
+        except OSError:
+            return None
+
+    def __contains__(self, key):
+        with self.lock:
+            self.evict()
+            return key in self.entries
+
+    def get(self, key):
+        with self.lock:
+            self.evict()
+            # in case the budget has been lowered since the last put
+            if key is not None and key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            else:
+                self.misses += 1
+                return None
+
+    def put(self, key, entry, size = None):
+        '''
+        Stores an entry: by default a (words, counts, malformed) tuple,
+        but a cache can hold any tuple of arrays if it's given their
+        size in bytes.
+        '''
+
+        if size is None:
+            words, counts, malformed = entry
+            size = parsed_size(words, counts)
+
+        if key is None or size > self.budget:
+            with self.lock:
+                self.evict()
+            return
+
+        for part in entry:
+            if isinstance(part, np.ndarray):
+                part.flags.writeable = False
+        # Cached arrays are shared by everyone who asks for the
+        # volume, so nobody should change them in place.
+
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.sizes[key]
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            self.sizes[key] = size
+            self.bytes += size
+            self.evict()
+
+    def evict(self):
+        while self.bytes > self.budget and len(self.entries) > 0:
+            key, entry = self.entries.popitem(last = False)
+            self.bytes -= self.sizes.pop(key)
+            self.evictions += 1
+
+    def set_budget(self, budget):
+        ''' Fixes this cache's budget, or with None, goes back to cachebudget. '''
+
+        with self.lock:
+            self.ownbudget = budget
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def report(self):
+        print('Volume cache: ' + str(self.hits) + ' hits, ' + str(self.misses) + ' misses, ' + str(self.evictions) + ' evictions; ' + str(len(self.entries)) + ' volumes in ' + str(round(self.bytes / (1024 * 1024), 1)) + ' MB.')
+
+volumecache = VolumeCache()
+
+def cached_read_counts(path):
+    '''
+    Like read_counts(), but checks volumecache first, and stores
+    what it reads there.
+    '''
+
+    key = volumecache.key(path)
+    entry = volumecache.get(key)
+    if entry is None:
+        entry = read_counts(path)
+        volumecache.put(key, entry)
+
+    return entry
@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+# workerpool.py
+#
+# Starts pools of worker processes that divide a budget of cores
+# between processes and the BLAS / OpenMP threads inside each process.
+#
+# Every LogisticRegression fit, StandardScaler transform and large
+# numpy operation in a worker may start its own BLAS or OpenMP threads,
+# by default one for every core on the machine. A pool of 12 processes
+# on a 32-core node can then run hundreds of threads, which fight over
+# the cores and make fold times erratic. So each worker pins its thread
+# count when it starts, and the pool has only as many processes as fit
+# in the budget at that many threads each.
+#
+# The split is chosen by split(), unless processes or threads is set
+# below. The folds of most of our models are small (a few hundred rows
+# by a few thousand words), and a solver gains nothing from threads on
+# a matrix that size, so workers get one thread each and the budget is
+# spent on processes. A fold of more than threadedelements cells gets
+# more threads (up to maxthreads) and correspondingly fewer processes,
+# which also keeps fewer copies of big folds in memory. And when there
+# are fewer tasks than cores, the spare cores go to threads.
+#
+# estimate_memory() says how much memory training a model with such a
+# pool will take at its peak, so that a scheduler (taskgraph.py) can
+# decide how many models fit on a node at once.
+#
+# Threads are pinned with threadpoolctl, which scikit-learn depends on.
+# Without it we can only set the usual environment variables, which
+# libraries read when they are loaded; in a forked worker they already
+# have been, so that mostly affects libraries imported later.
+
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+corebudget = None
+# The number of cores a pool may use, if not given when it's opened.
+# By default, every core this process is allowed to run on.
+
+processes = None
+threads = None
+# Set either (or both) to fix the split of modeling pools instead of
+# letting split() choose it, e.g. threads = 1 to always spend the
+# whole budget on processes. A pool never gets more processes than
+# its budget of cores.
+
+threadedelements = 4000000
+maxthreads = 4
+# A fold bigger than threadedelements (rows x features) gets another
+# thread for every threadedelements, up to maxthreads.
+
+workerbytes = 150 * 1024 * 1024
+# roughly what a worker occupies before it holds any data, having
+# imported numpy, pandas and scikit-learn
+
+THREAD_VARIABLES = ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS']
+
+def available_cores():
+    ''' The default budget: corebudget, or the cores we may run on. '''
+
+    if corebudget is not None:
+        return corebudget
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count()
+        # not available on every platform
+
+def split(cores = None, rows = None, features = None, tasks = None, numthreads = None):
+    '''
+    Divides a budget of cores (by default, available_cores()) between
+    processes and threads per process, for work on matrices of rows x
+    features, in a pool that will run tasks tasks at a time (if known).
+    Passing numthreads fixes the threads per process, and ignores
+    the module's settings; pools for reading files pass 1.
+    Returns (processes, threads).
+    '''
+
+    if cores is None:
+        cores = available_cores()
+    cores = max(int(cores), 1)
+
+    if numthreads is None and processes is not None:
+        numprocesses = min(processes, cores)
+        if threads is not None:
+            return numprocesses, threads
+        return numprocesses, max(cores // numprocesses, 1)
+
+    if numthreads is None:
+        numthreads = threads
+
+    if numthreads is None:
+        numthreads = 1
+        if rows is not None and features is not None:
+            numthreads = min(maxthreads, cores, 1 + int(rows * features) // threadedelements)
+
+        numprocesses = max(cores // numthreads, 1)
+        if tasks is not None and 0 < tasks < numprocesses:
+            numprocesses = tasks
+            numthreads = max(numthreads, cores // numprocesses)
+    else:
+        numprocesses = max(cores // numthreads, 1)
+        if tasks is not None and 0 < tasks < numprocesses:
+            numprocesses = tasks
+
+    return numprocesses, numthreads
+
+def estimate_memory(rows, features, numprocesses, k = 5, dtype = np.float64):
+    '''
+    Estimates the peak memory, in bytes, of crossvalidating and
+    training a model on a rows x features matrix of dtype, with k folds
+    (fewer than one meaning leave-one-out), in a pool of numprocesses.
+
+    The parent holds the matrix, and at the end a slice of it and a
+    scaled copy of that for the full model. Workers share the parent's
+    matrix (forked, or memory-mapped), but each copies the training
+    rows of its fold and scales them into another copy.
+    '''
+
+    itemsize = np.dtype(dtype).itemsize
+    matrixbytes = rows * features * itemsize
+
+    if k < 1:
+        k = max(rows, 2)
+    foldbytes = 2 * matrixbytes * (k - 1) / k
+
+    return int(3 * matrixbytes + numprocesses * (workerbytes + foldbytes))
+
+def limit_threads(numthreads):
+    '''
+    Limits the BLAS and OpenMP threads this process will start, for
+    the rest of its life.
+    '''
+
+    for variable in THREAD_VARIABLES:
+        os.environ[variable] = str(numthreads)
+
+    if threadpool_limits is not None:
+        threadpool_limits(limits = numthreads)
+
+def init_worker(numthreads, initializer, initargs):
+    limit_threads(numthreads)
+    if initializer is not None:
+        initializer(*initargs)
+
+def open_pool(cores = None, rows = None, features = None, tasks = None, numthreads = None, initializer = None, initargs = ()):
+    '''
+    Starts a pool within a budget of cores, split as split() decides,
+    each of whose workers pins its thread count and then runs
+    initializer(*initargs), if given.
+    '''
+
+    numprocesses, numthreads = split(cores, rows = rows, features = features, tasks = tasks, numthreads = numthreads)
+    print('Pool: ' + str(numprocesses) + ' processes x ' + str(numthreads) + ' threads.')
+
+    return Pool(processes = numprocesses, initializer = init_worker, initargs = (numthreads, initializer, initargs))